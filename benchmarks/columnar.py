@@ -0,0 +1,121 @@
+"""Compare the CSV zip with the columnar output formats.
+
+Writes synthetic `stop_times` and `shapes` tables of growing size with
+GTFSWriter and ColumnarGTFSWriter, then loads them back the way a
+consumer would: CSV through GTFSReader, Parquet with pyarrow and `.npz`
+with NumPy. Prints write time, read time and file size per format as CSV.
+
+    $ python benchmarks/columnar.py --rows 100000 1000000
+"""
+import os
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+from o2g.osm.models import Shape
+from o2g.gtfs.gtfs_writer import GTFSWriter
+from o2g.gtfs.gtfs_reader import GTFSReader
+from o2g.gtfs import gtfs_columnar
+from o2g.gtfs.gtfs_columnar import ColumnarGTFSWriter
+
+
+TABLES = ('stop_times', 'shapes')
+
+
+def stop_times(rows):
+    for idx in range(rows):
+        yield {'trip_id': '{}.1'.format(idx // 20),
+               'arrival_time': '05:{:02}:00'.format(idx % 60),
+               'departure_time': '05:{:02}:30'.format(idx % 60),
+               'stop_id': idx % 5000,
+               'stop_sequence': idx % 20}
+
+
+def shapes(rows):
+    for idx in range(rows):
+        yield Shape(idx // 100, 48.0 + idx * 1e-7, 7.8 + idx * 1e-7, idx % 100)
+
+
+def read_csv(path):
+    reader = GTFSReader(path)
+    for table in TABLES:
+        for _ in reader.records(table):
+            pass
+
+
+def read_columnar(path, backend):
+    with zipfile.ZipFile(path) as archive:
+        for table in TABLES:
+            with archive.open('{}.{}'.format(table, backend)) as file:
+                if backend == 'parquet':
+                    gtfs_columnar.pq.read_table(file)
+                else:
+                    with gtfs_columnar.np.load(file) as arrays:
+                        for name in arrays.files:
+                            arrays[name]
+
+
+def measure(rows, backend, workdir):
+    path = os.path.join(workdir, '{}_{}.zip'.format(backend, rows))
+
+    start = time.time()
+    if backend == 'csv':
+        writer = GTFSWriter(tables=TABLES)
+    else:
+        writer = ColumnarGTFSWriter(tables=TABLES, backend=backend)
+    writer.add_stop_times(stop_times(rows))
+    writer.add_shapes(shapes(rows))
+    writer.write_zipped(path)
+    write_seconds = time.time() - start
+
+    start = time.time()
+    if backend == 'csv':
+        read_csv(path)
+    else:
+        read_columnar(path, backend)
+    read_seconds = time.time() - start
+
+    return {'rows': rows,
+            'format': backend,
+            'write_seconds': write_seconds,
+            'read_seconds': read_seconds,
+            'bytes': os.path.getsize(path)}
+
+
+def bench():
+    parser = argparse.ArgumentParser(
+        description='Compare write and read times of the output formats.')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='rows per table and run')
+    args = parser.parse_args()
+
+    backends = ['csv']
+    if gtfs_columnar.np is not None:
+        backends.append('npz')
+    else:
+        print('numpy is not installed, skipping npz.', file=sys.stderr)
+    if gtfs_columnar.pa is not None:
+        backends.append('parquet')
+    else:
+        print('pyarrow is not installed, skipping parquet.', file=sys.stderr)
+
+    workdir = tempfile.mkdtemp(prefix='o2g_bench_')
+    columns = ['rows', 'format', 'write_seconds', 'read_seconds', 'bytes']
+    print(','.join(columns))
+    try:
+        for rows in sorted(args.rows):
+            for backend in backends:
+                result = measure(rows, backend, workdir)
+                print(','.join(
+                    '{:.3f}'.format(result[c]) if isinstance(result[c], float)
+                    else str(result[c]) for c in columns))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    bench()
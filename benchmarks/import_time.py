@@ -0,0 +1,79 @@
+"""Measure the startup cost of the o2g command line.
+
+Runs each command in a fresh interpreter a number of times and prints
+the fastest and the median wall time as CSV. With --modules, the slowest
+imports of `import o2g.cli` as reported by `python -X importtime` are
+printed as well.
+
+    $ python benchmarks/import_time.py --repeat 20 --modules 10
+"""
+import sys
+import time
+import argparse
+import subprocess
+from statistics import median
+
+
+COMMANDS = [
+    ('python', []),
+    ('import o2g.cli', ['-c', 'import o2g.cli']),
+    ('o2g --version', ['-c', 'import sys; from o2g.cli import cli; '
+                             'sys.argv = ["o2g", "--version"]; cli()']),
+    ('o2g.cli.preload', ['-c', 'from o2g.cli import preload; preload()']),
+    ('import osmium', ['-c', 'import osmium']),
+]
+
+
+def measure(args, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        proc = subprocess.run([sys.executable] + args,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+        timings.append(time.time() - start)
+        if proc.returncode:
+            return None
+    return min(timings), median(timings)
+
+
+def slowest_imports(count):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import o2g.cli'],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def bench():
+    parser = argparse.ArgumentParser(
+        description='Measure how long o2g takes to start.')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='runs per command')
+    parser.add_argument('--modules', type=int, default=0,
+                        help='also list this many of the slowest imports')
+    args = parser.parse_args()
+
+    print('command,min_seconds,median_seconds')
+    for name, command in COMMANDS:
+        result = measure(command, args.repeat)
+        if result is None:
+            print('{},failed,failed'.format(name))
+            continue
+        print('{},{:.3f},{:.3f}'.format(name, *result))
+
+    if args.modules:
+        print()
+        print('module,cumulative_us')
+        for cumulative, module in slowest_imports(args.modules):
+            print('{},{}'.format(module, cumulative))
+
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,124 @@
+"""Measure how the o2g pipeline scales with the size of the input.
+
+Generates synthetic networks of growing size and runs the full
+`TransitDataExporter` -> `GTFSWriter` pipeline on each of them in a fresh
+process. Prints time and peak memory per size as CSV and, if matplotlib is
+installed, plots both curves.
+
+    $ python benchmarks/scaling.py --routes 10 100 1000 --plot scaling.png
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import multiprocessing
+
+from o2g.osm.synthetic import network_size, write_network
+
+
+def run_pipeline(osmfile, outdir, dummy, queue):
+    # Imports happen in the child, so their cost is part of the measurement
+    # the same way it is for the `o2g` script.
+    from o2g.cli import main
+
+    start = time.time()
+    main(osmfile, outdir, None, dummy)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((elapsed, peak_rss_mb))
+
+
+def measure(routes, workdir, dummy=False, background_factor=10):
+    size = network_size(routes, background_factor)
+    osmfile = os.path.join(workdir, 'synthetic_{}.osm.pbf'.format(routes))
+    outdir = os.path.join(workdir, 'gtfs_{}'.format(routes))
+    os.makedirs(outdir, exist_ok=True)
+
+    nodes, ways, relations = write_network(osmfile, size)
+
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(
+        target=run_pipeline, args=(osmfile, outdir, dummy, queue))
+    proc.start()
+    # The result is small enough to sit in the pipe until it is read.
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError('Conversion of {} routes failed with exit code {}.'
+                           .format(routes, proc.exitcode))
+    elapsed, peak_rss_mb = queue.get(timeout=10)
+
+    return {'routes': routes,
+            'nodes': nodes,
+            'ways': ways,
+            'relations': relations,
+            'input_bytes': os.path.getsize(osmfile),
+            'seconds': elapsed,
+            'peak_rss_mb': peak_rss_mb}
+
+
+def plot(results, filename):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('matplotlib is not installed, skipping the plot.', file=sys.stderr)
+        return
+
+    sizes = [r['input_bytes'] / 2**20 for r in results]
+    fig, (time_ax, mem_ax) = plt.subplots(1, 2, figsize=(10, 4))
+    time_ax.plot(sizes, [r['seconds'] for r in results], marker='o')
+    time_ax.set_xlabel('input size (MiB)')
+    time_ax.set_ylabel('time (s)')
+    mem_ax.plot(sizes, [r['peak_rss_mb'] for r in results], marker='o')
+    mem_ax.set_xlabel('input size (MiB)')
+    mem_ax.set_ylabel('peak RSS (MiB)')
+    fig.tight_layout()
+    fig.savefig(filename)
+
+
+def bench():
+    parser = argparse.ArgumentParser(
+        description='Benchmark o2g on synthetic networks of growing size.')
+    parser.add_argument('--routes', type=int, nargs='+',
+                        default=[10, 100, 1000],
+                        help='number of route relations per run')
+    parser.add_argument('--background-factor', type=int, default=10,
+                        help='background nodes per transit node')
+    parser.add_argument('--dummy', action='store_true', default=False,
+                        help='also generate dummy trips and stop times')
+    parser.add_argument('--plot',
+                        help='save time and memory curves to this image')
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help='keep the generated files')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='o2g_bench_')
+    columns = ['routes', 'nodes', 'ways', 'relations', 'input_bytes',
+               'seconds', 'peak_rss_mb']
+    print(','.join(columns))
+
+    results = []
+    try:
+        for routes in sorted(args.routes):
+            result = measure(routes, workdir, args.dummy, args.background_factor)
+            results.append(result)
+            print(','.join(
+                '{:.3f}'.format(result[c]) if isinstance(result[c], float)
+                else str(result[c]) for c in columns))
+    finally:
+        if args.keep:
+            print('Generated files are in {}'.format(workdir), file=sys.stderr)
+        else:
+            shutil.rmtree(workdir)
+
+    if args.plot:
+        plot(results, args.plot)
+
+
+if __name__ == '__main__':
+    bench()
@@ -2,21 +2,23 @@
 """
 Extracts partial GTFS data from OSM file.
 """
+import io
 import os
+import sys
 import time
-import tempfile
 import logging
-from logging import FileHandler
+import threading
+from logging import StreamHandler
 from contextlib import contextmanager
 from pathlib import Path
 
 import argparse
 
 from o2g import __version__
-from o2g.gtfs import gtfs_dummy
-from o2g.gtfs.gtfs_writer import GTFSWriter
-from o2g.osm.exporter import TransitDataExporter
-from o2g.web import dl_osm_from_overpass
+from o2g.gtfs.gtfs_misc import GTFS_TABLES, DUMMY_TABLES
+
+# Everything else, most of all osmium, is imported where it is needed, so
+# that --help, --version and argument errors return right away.
 
 
 class readable_dir(argparse.Action):
@@ -33,6 +35,30 @@ class readable_dir(argparse.Action):
             parser.exit("Error: Unreadable dir: {0}".format(prospective_dir))
 
 
+class table_list(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        tables = [t.strip() for t in values.split(',') if t.strip()]
+        unknown = [t for t in tables if t not in GTFS_TABLES]
+        if unknown:
+            parser.print_usage()
+            print('Try "{} --help" for help.\n'.format(parser.prog))
+            parser.exit("Error: Unknown tables: {0}".format(', '.join(unknown)))
+        setattr(namespace, self.dest, tables)
+
+
+class sort_key(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        table, _, columns = values.partition('=')
+        table = table.strip()
+        if table not in GTFS_TABLES:
+            parser.print_usage()
+            print('Try "{} --help" for help.\n'.format(parser.prog))
+            parser.exit("Error: Unknown table: {0}".format(table))
+        keys = dict(getattr(namespace, self.dest) or {})
+        keys[table] = [c.strip() for c in columns.split(',') if c.strip()]
+        setattr(namespace, self.dest, keys)
+
+
 class readable_file(argparse.Action):
     def __call__(self, parser, namespace, prospective_file, option_string=None):
         if not os.path.isfile(prospective_file):
@@ -48,6 +74,11 @@ class readable_file(argparse.Action):
 
 
 def cli():
+    # Subcommands are dispatched by hand, since OSMFILE is an optional
+    # positional argument of the main command.
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+
     parser = argparse.ArgumentParser(
         prog='o2g',
         epilog='Here is a smile for you :)',
@@ -61,14 +92,78 @@ def cli():
                         help='an OSM area name, e.g. Freiburg')
     parser.add_argument('--bbox',
                         help='a boundary box, e.g. 47.9485,7.7066,48.1161,8.0049')
+    parser.add_argument('--overpass-url', action='append',
+                        help='Overpass API instance to ask. Repeat it to fail '
+                             'over between mirrors. Defaults to '
+                             '$O2G_OVERPASS_URLS or overpass-api.de')
+    parser.add_argument('--stream', action='store_true',
+                        default=False,
+                        help='parse Overpass data while it is being downloaded')
+    parser.add_argument('--way-geometry', choices=['skel', 'geom'],
+                        default='skel',
+                        help='how Overpass returns ways for --way-shapes: '
+                             'node references plus tagless nodes, or '
+                             'coordinates inline')
     parser.add_argument('--outdir', action=readable_dir,
                         default='.',
                         help='output directory')
     parser.add_argument('--zipfile',
                         help='output zip file name')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'npz'],
+                        default='csv',
+                        help='csv writes a standard GTFS feed. parquet and '
+                             'npz write every table as typed columns')
+    parser.add_argument('--validate', action='store_true',
+                        default=False,
+                        help='check the written feed and log its problems')
+    parser.add_argument('--previous',
+                        help='previous feed directory or zip. Row changes '
+                             'against it are written next to the new feed')
     parser.add_argument('--dummy', action='store_true',
                         default=False,
                         help='fill the missing parts with dummy data')
+    parser.add_argument('--template-trips', action='store_true',
+                        default=False,
+                        help='with --dummy, write one trip per route and '
+                             'service, repeated by frequencies.txt')
+    parser.add_argument('--tables', action=table_list,
+                        help='comma separated GTFS tables to write, e.g. '
+                             'stops,routes. Defaults to all of {}'.format(
+                                 ','.join(GTFS_TABLES)))
+    parser.add_argument('--sort', action=sort_key, metavar='TABLE=COLUMNS',
+                        help='sort a table by comma separated columns, e.g. '
+                             'trips=route_id,trip_id. Can be repeated. '
+                             'stop_times, shapes and routes are sorted by '
+                             'their keys unless e.g. stop_times= is given')
+    parser.add_argument('--way-shapes', action='store_true',
+                        default=False,
+                        help='build shapes out of route ways instead of stops')
+    parser.add_argument('--clip', action=readable_file,
+                        help='a .poly or GeoJSON polygon file. Only data '
+                             'inside of it is converted')
+    parser.add_argument('--clip-fraction', type=float,
+                        default=0.5,
+                        help='keep routes with at least this fraction of '
+                             'their stops inside of the --clip polygon')
+    parser.add_argument('--snap-radius', type=float,
+                        default=0,
+                        help='attach stops without stop_area to the nearest '
+                             'station within this many meters')
+    parser.add_argument('--cluster-radius', type=float,
+                        default=0,
+                        help='group stops closer than this many meters '
+                             'under a generated station')
+    parser.add_argument('--out-of-core', action='store_true',
+                        default=False,
+                        help='keep extracted data on disk to convert large '
+                             'extracts with bounded memory')
+    parser.add_argument('--memory-budget', type=int,
+                        default=256,
+                        help='memory budget in MB for --out-of-core')
+    parser.add_argument('--no-pbf', action='store_true',
+                        default=False,
+                        help='read XML inputs directly instead of converting '
+                             'them to a cached PBF file first')
     parser.add_argument('--loglevel',
                         default='WARNING',
                         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
@@ -83,6 +178,10 @@ def cli():
         parser.print_usage()
         parser.exit("o2g: error: one of these args are required: OSMFILE, bbox or area.")
 
+    if args.previous and args.format != 'csv':
+        parser.print_usage()
+        parser.exit("o2g: error: --previous only works with --format csv.")
+
     if args.loglevel:
         logging.basicConfig(level=args.loglevel)
     if hasattr(args, 'osmfile'):
@@ -93,68 +192,300 @@ def cli():
     logging.debug('Zip?: %s', args.zipfile or False)
     logging.debug('Dummy?: %s', args.dummy)
 
-    if args.area or args.bbox:
-        filename, filepath = dl_osm_from_overpass(args.area, args.bbox)
+    from o2g.osm.clip import load_polygon
+    from o2g.web import dl_osm_from_overpass, OverpassStream,\
+        OVERPASS_API_URLS
+
+    # Ways are only downloaded if way shapes are going to be built.
+    way_geometry = None
+    if args.way_shapes and 'shapes' in (args.tables or GTFS_TABLES):
+        way_geometry = args.way_geometry
+
+    stream = None
+    overpass_urls = args.overpass_url or OVERPASS_API_URLS
+    if (args.area or args.bbox) and args.stream:
+        stream = OverpassStream(args.area, args.bbox, overpass_urls,
+                                way_geometry=way_geometry).start()
+        osmfile = stream.filepath
+    elif args.area or args.bbox:
+        filename, filepath = dl_osm_from_overpass(args.area, args.bbox,
+                                                  overpass_urls,
+                                                  way_geometry=way_geometry)
         osmfile = filepath
     else:
         osmfile = args.osmfile
 
-    main(osmfile, args.outdir, args.zipfile, args.dummy)
+    try:
+        main(osmfile, args.outdir, args.zipfile, args.dummy,
+             previous=args.previous,
+             output_format=args.format,
+             validate=args.validate,
+             sort_keys=args.sort,
+             template_trips=args.template_trips,
+             snap_radius=args.snap_radius,
+             cluster_radius=args.cluster_radius,
+             out_of_core=args.out_of_core,
+             memory_budget=args.memory_budget * 2**20,
+             convert_xml=not args.no_pbf,
+             tables=args.tables,
+             way_shapes=args.way_shapes,
+             clip=load_polygon(args.clip) if args.clip else None,
+             clip_fraction=args.clip_fraction,
+             stream=stream,
+             inline_way_locations=way_geometry == 'geom')
+    finally:
+        if stream:
+            stream.close()
 
 
-def main(osmfile, outdir, zipfile, dummy):
+def extract_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog='o2g extract',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Write transit relations and the nodes and ways they '
+                    'reference to a small OSM file. Converting that file is '
+                    'much cheaper than converting the original one.')
+    parser.add_argument('osmfile', metavar='OSMFILE', action=readable_file,
+                        help='an OSM data file supported by osmium')
+    parser.add_argument('-o', '--output', required=True,
+                        help='output file, e.g. transit.osm.pbf')
+    parser.add_argument('--loglevel',
+                        default='WARNING',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='the logging level')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.loglevel)
+
+    from o2g.osm.extract import extract_transit
+
     start = time.time()
+    extract_transit(args.osmfile, args.output)
+    logging.info('Transit extract saved in %s', args.output)
+    logging.debug('Done in %d seconds.', (time.time() - start))
 
-    with capture_logs() as logfile:
-        tde = TransitDataExporter(osmfile)
-        tde.process()
-        logging.debug('Preprocessing took %d seconds.', (time.time() - start))
-
-        writer = GTFSWriter()
-        patched_agencies = None
-        if dummy:
-            dummy_data = gtfs_dummy.create_dummy_data(list(tde.routes),
-                                                      list(tde.stops))
-            writer.add_trips(dummy_data.trips)
-            writer.add_stop_times(dummy_data.stop_times)
-            writer.add_calendar(dummy_data.calendar)
-            writer.add_frequencies(dummy_data.frequencies)
-            patched_agencies = gtfs_dummy.patch_agencies(tde.agencies)
-
-        if patched_agencies:
-            writer.add_agencies(patched_agencies)
-        else:
-            writer.add_agencies(tde.agencies)
-        writer.add_stops(tde.stops)
-        writer.add_routes(tde.routes)
-        writer.add_shapes(tde.shapes)
-        writer.add_feedinfo({
-            'feed_publisher_name': 'Generated by o2g',
-            'feed_publisher_url': 'hiposfer.com',
-            'feed_lang': 'en',
-            'feed_version': int(time.time())
-        })
+
+def validate_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog='o2g validate',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        description='Check a GTFS feed for missing fields, broken '
+                    'references, invalid coordinates and stop times.')
+    parser.add_argument('feed', metavar='FEED',
+                        help='a GTFS feed directory or zip file')
+    parser.add_argument('--max-examples', type=int,
+                        default=10,
+                        help='problems listed per kind of problem')
+
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.feed):
+        parser.exit(2, "Error: Invalid path: {0}\n".format(args.feed))
+
+    from o2g.gtfs.gtfs_validator import GTFSValidator
+
+    validator = GTFSValidator(args.feed, args.max_examples).validate()
+    print('\n'.join(validator.summary()))
+    return 1 if validator.errors else 0
+
+
+SUBCOMMANDS = {
+    'extract': extract_cli,
+    'validate': validate_cli,
+}
+
+
+def main(osmfile, outdir, zipfile, dummy, previous=None, output_format='csv',
+         validate=False, stats=None, sort_keys=None, template_trips=False,
+         **options):
+    """Convert an OSM file to a GTFS feed.
+
+    `options` are passed on to TransitDataExporter.
+
+    :param osmfile: path of the OSM file, or the OSM data as bytes or a
+        readable binary file object
+    :param zipfile: name of the zip file in `outdir`, or a writable
+        binary file object to stream the zip to while tables are built
+    :param previous: previous feed to write a changeset against
+    :param output_format: 'csv' or one of the columnar backends
+    :param validate: validate the written feed. Only for 'csv'.
+    :param sort_keys: map of table name to the columns to sort it by, see
+        GTFSWriter
+    :param template_trips: one dummy trip per route and service, see
+        gtfs_dummy.create_dummy_data
+    :param stats: dict to fill with the seconds spent per stage under
+        'timings' and the hits and misses of the PBF and timezone caches
+    :return: the GTFSValidator if the feed was validated
+    """
+    from o2g.gtfs import gtfs_dummy
+    from o2g.gtfs.gtfs_writer import GTFSWriter
+    from o2g.osm.exporter import TransitDataExporter
+    from o2g.osm.builders import ShapeDeduplicator
+    from o2g.osm.convert import CACHE_STATS
+
+    streaming = zipfile is not None and not isinstance(zipfile, str)
+    if streaming and output_format != 'csv':
+        raise ValueError('Only CSV feeds can be streamed.')
+    if streaming and previous:
+        raise ValueError('Changesets are not written for streamed feeds.')
+
+    start = time.time()
+    cache_stats = dict(CACHE_STATS)
+
+    writer = None
+    try:
+        with capture_logs() as logs, \
+                TransitDataExporter(osmfile, **options) as tde:
+            tde.process()
+            logging.debug('Preprocessing took %d seconds.', (time.time() - start))
+            tables_start = time.time()
+
+            tables = set(options.get('tables') or GTFS_TABLES)
+            if output_format == 'csv':
+                out_of_core = options.get('out_of_core', False)
+                writer = GTFSWriter(spool=out_of_core, tables=tables,
+                                    previous=previous, sort_keys=sort_keys)
+                if out_of_core:
+                    # The stores of the exporter hold the rest of the budget.
+                    writer.sort_memory = tde.sort_memory
+            else:
+                from o2g.gtfs.gtfs_columnar import ColumnarGTFSWriter
+                writer = ColumnarGTFSWriter(tables=tables, backend=output_format,
+                                            sort_keys=sort_keys)
+            if streaming:
+                writer.stream_zipped(zipfile)
+
+            # Shapes go first, so that trips can refer to the shared ones.
+            shape_ids = None
+            if 'shapes' in tables:
+                shapes = ShapeDeduplicator()
+                writer.add_shapes(shapes.deduplicate(tde.shapes))
+                shape_ids = shapes.shape_ids
+                logging.info('Dropped %d duplicate shapes, saving %d bytes of shapes.txt.',
+                             shapes.duplicates, shapes.bytes_saved)
+
+            if dummy and tables & set(DUMMY_TABLES):
+                dummy_data = gtfs_dummy.create_dummy_data(list(tde.routes),
+                                                          list(tde.stops),
+                                                          tde.stop_routes,
+                                                          shape_ids,
+                                                          template_trips)
+                trips = dummy_data.trips
+                if 'shapes' not in tables:
+                    trips = [dict(trip, shape_id='') for trip in trips]
+                writer.add_trips(trips)
+                writer.add_stop_times(dummy_data.stop_times)
+                writer.add_calendar(dummy_data.calendar)
+                writer.add_frequencies(dummy_data.frequencies)
+
+            # Builders are only run for requested tables.
+            if 'agency' in tables:
+                if dummy:
+                    writer.add_agencies(gtfs_dummy.patch_agencies(tde.agencies))
+                else:
+                    writer.add_agencies(tde.agencies)
+            if 'stops' in tables:
+                writer.add_stops(tde.stops)
+            if 'routes' in tables:
+                writer.add_routes(tde.routes)
+            writer.add_feedinfo({
+                'feed_publisher_name': 'Generated by o2g',
+                'feed_publisher_url': 'hiposfer.com',
+                'feed_lang': 'en',
+                'feed_version': int(time.time())
+            })
+
+            # Builders report their issues while the tables are added.
+            tde.diagnostics.log()
 
         writer.add_file('LICENSE', Path(__file__).parents[0] / 'ODbL-1.0.txt')
-        writer.add_file('logs.txt', logfile)
+        writer.add_file_data('logs.txt', logs.getvalue())
+        writer.add_file_data('diagnostics.txt', tde.diagnostics.dumps())
 
-    if zipfile:
-        writer.write_zipped(os.path.join(outdir, zipfile))
-        logging.info('GTFS feed saved in %s' % os.path.join(outdir, zipfile))
-    else:
-        writer.write_unzipped(outdir)
-        logging.info('GTFS feed saved in %s' % outdir)
+        if streaming:
+            feed = None
+            writer.close()
+        elif zipfile:
+            feed = os.path.join(outdir, zipfile)
+            writer.write_zipped(feed)
+            logging.info('GTFS feed saved in %s' % feed)
+        else:
+            feed = outdir
+            writer.write_unzipped(outdir)
+            logging.info('GTFS feed saved in %s' % outdir)
+    except BaseException:
+        if streaming and writer is not None:
+            # What was sent is a truncated zip. Finishing it would pass it
+            # off as complete.
+            writer.abort()
+        raise
+
+    if stats is not None:
+        # Tables are built while they are added to the writer.
+        stats['timings'] = dict(tde.timings, tables=time.time() - tables_start)
+        stats['pbf_cache'] = {key: CACHE_STATS[key] - cache_stats[key]
+                              for key in CACHE_STATS}
+        if tde.timezones:
+            stats['timezone_cache'] = {'hits': tde.timezones.hits,
+                                       'misses': tde.timezones.misses}
+
+    validator = None
+    if validate and feed and output_format == 'csv':
+        from o2g.gtfs.gtfs_validator import GTFSValidator
+        validator = GTFSValidator(feed).validate()
+        validator.log()
 
     logging.debug('Done in %d seconds.', (time.time() - start))
+    return validator
+
+
+def convert(data, fileobj=None, dummy=False, **options):
+    """Convert OSM data in memory to a zipped GTFS feed.
+
+    Nothing is written to disk unless `options` ask for it, e.g. with
+    `out_of_core`. Only CSV feeds without changesets are supported.
+
+    :param data: OSM data as bytes or a readable binary file object.
+        `data_format` in `options` overrides the detected format.
+    :param fileobj: writable binary file object to stream the zip to.
+    :return: the zip as bytes if no `fileobj` was given
+    """
+    output = io.BytesIO() if fileobj is None else fileobj
+    main(data, None, output, dummy, **options)
+    if fileobj is None:
+        return output.getvalue()
+
+
+def preload():
+    """Import everything a conversion needs.
+
+    Meant for long running processes, so that the first conversion does
+    not pay for importing osmium and the builders.
+    """
+    import osmium  # noqa: F401
+    import o2g.osm.exporter  # noqa: F401
+    import o2g.osm.extract  # noqa: F401
+    import o2g.osm.clip  # noqa: F401
+    import o2g.web  # noqa: F401
+    import o2g.gtfs.gtfs_dummy  # noqa: F401
+    import o2g.gtfs.gtfs_writer  # noqa: F401
+    import o2g.gtfs.gtfs_validator  # noqa: F401
+    import o2g.gtfs.gtfs_columnar  # noqa: F401
 
 
 @contextmanager
 def capture_logs():
-    logfile = tempfile.mktemp()
-    handler = FileHandler(logfile, mode='w')
+    """Collect log records of the block in a StringIO.
+
+    Only records of the current thread are collected, so that conversions
+    running in other threads keep their logs to themselves.
+    """
+    logs = io.StringIO()
+    handler = StreamHandler(logs)
+    thread = threading.get_ident()
+    handler.addFilter(lambda record: record.thread == thread)
     logging.getLogger().addHandler(handler)
     try:
-        yield logfile
+        yield logs
     finally:
         logging.getLogger().removeHandler(handler)
 
@@ -0,0 +1,258 @@
+"""HTTP client for Overpass and OSM downloads.
+
+Connections are kept alive and reused per host, and the number of
+concurrent requests per host is capped. Requests are retried with
+exponential backoff on connection errors, timeouts, 429 and 5xx. Given a
+list of mirrors, a request fails over to the next mirror instead of
+waiting, and only backs off once every mirror failed.
+"""
+import time
+import random
+import logging
+import threading
+import http.client
+from urllib.parse import urlsplit, urljoin
+
+
+# Worth asking again, possibly somewhere else
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+REDIRECT_STATUSES = frozenset((301, 302, 303, 307, 308))
+
+MAX_REDIRECTS = 5
+
+# Bodies of redirects and errors up to this size are read to keep their
+# connection. Larger ones are cheaper to drop.
+MAX_DISCARDED_BYTES = 64 * 1024
+
+# Seconds a socket may block. Overpass only answers once the query ran,
+# which takes minutes for large areas.
+DEFAULT_TIMEOUT = 300
+
+# Overpass API hands out two query slots per client address.
+DEFAULT_MAX_PER_HOST = 2
+
+
+class _Pool(object):
+    """Idle connections to one host, and slots for requests to it."""
+    def __init__(self, scheme, netloc, size, timeout):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def acquire(self):
+        """Wait for a slot. Returns a connection and whether it was idle."""
+        self._slots.acquire()
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connect(), False
+
+    def release(self, conn, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.append(conn)
+        else:
+            conn.close()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Response(object):
+    """Response holding its connection until it is read or closed.
+
+    Has the `status`, `reason`, `headers`, `read` and `read1` of
+    http.client.HTTPResponse. The connection goes back to its pool once
+    the body was read completely, and is dropped if closed before.
+    """
+    def __init__(self, url, pool, conn, resp):
+        self.url = url
+        self._pool = pool
+        self._conn = conn
+        self._resp = resp
+
+    @property
+    def status(self):
+        return self._resp.status
+
+    @property
+    def reason(self):
+        return self._resp.reason
+
+    @property
+    def headers(self):
+        return self._resp.headers
+
+    def read(self, amt=None):
+        data = self._resp.read(amt)
+        if self._resp.isclosed():
+            self.close()
+        return data
+
+    def read1(self, amt=-1):
+        data = self._resp.read1(amt)
+        if not data and self._resp.isclosed():
+            self.close()
+        return data
+
+    def close(self):
+        if self._conn is None:
+            return
+        reusable = self._resp.isclosed() and not self._resp.will_close
+        self._resp.close()
+        self._pool.release(self._conn, reusable)
+        self._conn = None
+
+    def discard(self):
+        """Close a response whose body is of no interest."""
+        length = self._resp.length
+        if self._conn is not None and length is not None \
+                and length <= MAX_DISCARDED_BYTES:
+            try:
+                self.read()
+            except (OSError, http.client.HTTPException):
+                pass
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPClient(object):
+    """Keep-alive HTTP client with retries and mirror failover.
+
+    :param timeout: seconds a socket may block
+    :param retries: attempts after the first one, over all mirrors
+    :param backoff: seconds to wait after the first failed round of
+        mirrors, doubled after every further round
+    :param max_backoff: longest wait, Retry-After headers included
+    :param max_per_host: concurrent requests per host. More wait.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=4, backoff=1,
+                 max_backoff=60, max_per_host=DEFAULT_MAX_PER_HOST):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_per_host = max_per_host
+        self._pools = {}
+        self._preferred = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported URL: {}'.format(url))
+        key = (parts.scheme, parts.netloc)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = self._pools[key] = _Pool(parts.scheme, parts.netloc,
+                                                self.max_per_host, self.timeout)
+        return pool
+
+    def _send(self, method, url, body, headers):
+        """One request, on a fresh connection if an idle one went stale."""
+        pool = self._pool(url)
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        conn, reused = pool.acquire()
+        try:
+            while True:
+                try:
+                    conn.request(method, path, body, headers)
+                    return Response(url, pool, conn, conn.getresponse())
+                except (OSError, http.client.HTTPException):
+                    if not reused:
+                        raise
+                    # The server dropped the idle connection.
+                    conn.close()
+                    conn, reused = pool.connect(), False
+        except BaseException:
+            pool.release(conn, False)
+            raise
+
+    def _follow(self, method, url, body, headers):
+        for _ in range(MAX_REDIRECTS):
+            resp = self._send(method, url, body, headers)
+            location = resp.headers.get('Location')
+            if resp.status not in REDIRECT_STATUSES or not location:
+                return resp
+            resp.discard()
+            url = urljoin(url, location)
+            if resp.status == 303:
+                method, body = 'GET', None
+        return self._send(method, url, body, headers)
+
+    def _delay(self, round_, resp):
+        delay = self.backoff * 2 ** round_
+        retry_after = resp.headers.get('Retry-After') if resp else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        # Jitter keeps clients that failed together from retrying together.
+        return min(delay, self.max_backoff) * random.uniform(0.5, 1)
+
+    def request(self, method, urls, body=None, headers=None):
+        """Send a request and return its Response.
+
+        :param urls: a URL or a list of mirrors serving the same requests.
+            The mirror that answered last is asked first.
+        :return: the first response that is not worth retrying, or the
+            last one once retries are exhausted. Connection errors and
+            timeouts are raised once retries are exhausted.
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        mirrors = tuple(urls)
+        start = self._preferred.get(mirrors, 0)
+        headers = dict(headers or {})
+
+        for attempt in range(self.retries + 1):
+            url = mirrors[(start + attempt) % len(mirrors)]
+            resp = error = None
+            try:
+                resp = self._follow(method, url, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+            else:
+                if resp.status not in RETRY_STATUSES:
+                    self._preferred[mirrors] = (start + attempt) % len(mirrors)
+                    return resp
+
+            if attempt == self.retries:
+                if error:
+                    raise error
+                return resp
+            logging.warning('%s %s failed: %s. Retrying.', method, url,
+                            error or '{} {}'.format(resp.status, resp.reason))
+            round_, position = divmod(attempt + 1, len(mirrors))
+            delay = self._delay(round_ - 1, resp) if not position else 0
+            if resp:
+                resp.discard()
+            if delay:
+                time.sleep(delay)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        for pool in pools:
+            pool.close()
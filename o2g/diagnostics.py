@@ -0,0 +1,89 @@
+"""Counts of data issues found while converting.
+
+Broken extracts can have millions of issues. Hot loops only count them
+here, together with a few examples each, and a summary is reported once
+at the end instead of one log record per issue.
+"""
+import io
+import csv
+import logging
+from collections import Counter, OrderedDict
+
+
+# Category to description, in the order they are reported
+CATEGORIES = OrderedDict([
+    ('missing_node', 'Relation member nodes missing in the input'),
+    ('invalid_node_location', 'Nodes with an invalid location'),
+    ('missing_way_location', 'Way nodes without a location'),
+    ('stop_area_without_nodes', 'stop_area relations without any node'),
+    ('stop_area_without_station', 'stop_area relations without a station node'),
+    ('route_without_nodes', 'Routes without a node or way to locate them'),
+    ('route_without_way_points', 'Routes without way points for their shape'),
+    ('unknown_wheelchair_value', 'Unknown values of the wheelchair tag'),
+])
+
+
+class Diagnostics(object):
+    """Issue counts by category with up to `max_examples` examples each."""
+    def __init__(self, max_examples=10):
+        self.max_examples = max_examples
+        self.counts = Counter()
+        self.examples = {}
+
+    def add(self, category, example=None, template='{}'):
+        """Count an issue.
+
+        :param example: e.g. the id of the object with the issue. It is
+            only formatted with `template` while the category has fewer
+            than `max_examples` examples, so hot loops pass raw ids.
+        """
+        self.counts[category] += 1
+        if example is None:
+            return
+        examples = self.examples.get(category)
+        if examples is None:
+            examples = self.examples[category] = []
+        elif len(examples) >= self.max_examples:
+            return
+        example = template.format(example)
+        if example not in examples:
+            examples.append(example)
+
+    def add_many(self, category, count, examples=()):
+        """Count `count` issues at once with some of their examples."""
+        self.counts[category] += count
+        for example in examples:
+            current = self.examples.setdefault(category, [])
+            if len(current) >= self.max_examples:
+                break
+            current.append(example)
+
+    def _categories(self):
+        known = [c for c in CATEGORIES if self.counts[c]]
+        return known + sorted(c for c in self.counts if c not in CATEGORIES)
+
+    def summary(self):
+        """One line per category with issues."""
+        lines = []
+        for category in self._categories():
+            examples = self.examples.get(category, [])
+            lines.append('{}: {}{}'.format(
+                CATEGORIES.get(category, category), self.counts[category],
+                ' (e.g. {})'.format(', '.join(str(e) for e in examples))
+                if examples else ''))
+        return lines
+
+    def log(self, level=logging.WARNING):
+        for line in self.summary():
+            logging.log(level, line)
+
+    def dumps(self):
+        """The counts and examples as CSV."""
+        file = io.StringIO()
+        writer = csv.writer(file, lineterminator='\n')
+        writer.writerow(['category', 'count', 'examples'])
+        for category in self._categories():
+            writer.writerow([category, self.counts[category],
+                             ' '.join(str(e) for e in
+                                      self.examples.get(category, []))])
+        return file.getvalue()
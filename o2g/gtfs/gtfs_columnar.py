@@ -0,0 +1,211 @@
+"""Columnar output of GTFS tables.
+
+Tables are written as Parquet files if pyarrow is installed and as NumPy
+`.npz` archives otherwise. Consumers load typed columns directly instead
+of parsing CSV.
+"""
+import os
+import shutil
+import zipfile
+import tempfile
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+from o2g.gtfs.gtfs_writer import GTFSWriter, zip_file, copy_file
+from o2g.gtfs.gtfs_reader import COLUMN_TYPES
+
+
+BACKENDS = ('parquet', 'npz')
+
+# Rows per Parquet row group
+BATCH_ROWS = 64 * 1024
+
+# Suffix of the validity mask of a column in `.npz` archives
+NPZ_MASK_SUFFIX = '__valid'
+
+
+def column_type(name):
+    """Type of a column: 'float64', 'int64' or 'string'.
+
+    Ids are strings, as they are in GTFS. Missing numbers are stored as
+    nulls in Parquet and with a validity mask in `.npz` archives.
+    """
+    converter = COLUMN_TYPES.get(name)
+    if converter is float:
+        return 'float64'
+    if converter is int:
+        return 'int64'
+    return 'string'
+
+
+def default_backend():
+    if pa is not None:
+        return 'parquet'
+    if np is not None:
+        return 'npz'
+    return None
+
+
+class _Column(object):
+    """Values of one column in a typed buffer."""
+    def __init__(self, kind):
+        self.kind = kind
+        self.valid = bytearray()
+        self.missing = 0
+        if kind == 'float64':
+            self.values = array('d')
+        elif kind == 'int64':
+            self.values = array('q')
+        else:
+            self.values = []
+
+    def append(self, value):
+        missing = value is None or value == ''
+        self.valid.append(not missing)
+        self.missing += missing
+        if self.kind == 'float64':
+            self.values.append(float('nan') if missing else float(value))
+        elif self.kind == 'int64':
+            self.values.append(0 if missing else int(value))
+        else:
+            self.values.append('' if value is None else str(value))
+
+    def to_numpy(self):
+        if self.kind == 'string':
+            return np.array(self.values, dtype=str)
+        # Shares the buffer of the array instead of copying it.
+        return np.frombuffer(self.values, dtype=self.kind)
+
+    def mask(self):
+        """Validity of the values or None if none is missing."""
+        if not self.missing:
+            return None
+        return np.frombuffer(self.valid, dtype=np.bool_)
+
+    def to_arrow(self):
+        if self.kind == 'string':
+            return pa.array(self.values, type=pa.string())
+        mask = self.mask()
+        return pa.array(self.to_numpy(),
+                        mask=None if mask is None else ~mask)
+
+
+class ColumnarGTFSWriter(GTFSWriter):
+    """GTFS writer storing every table as typed columns.
+
+    Same `add_*` interface and `headers` schema as GTFSWriter. Values are
+    converted as they are added, so tables are held as typed buffers and
+    handed to NumPy or Arrow without copying. Feeds are written at once,
+    streaming and changesets are left to CSV feeds.
+    """
+    def __init__(self, tables=None, backend=None, sort_keys=None):
+        """
+        :param tables: names of the tables to write. Defaults to all.
+        :param backend: 'parquet' or 'npz'. Defaults to Parquet if pyarrow
+            is installed.
+        :param sort_keys: as for GTFSWriter. Columns are held in memory
+            anyway, so tables are sorted in memory.
+        """
+        backend = backend or default_backend()
+        if backend not in BACKENDS:
+            raise ValueError('Unknown columnar backend: {}'.format(backend))
+        if backend == 'parquet' and pa is None:
+            raise ImportError('pyarrow is needed for Parquet output.')
+        if np is None:
+            raise ImportError('numpy is needed for columnar output.')
+
+        self.backend = backend
+        self.sort_keys = self._sort_keys(sort_keys)
+        self.previous = None
+        self.changes = None
+        self._files = {}
+        self._columns = OrderedDict()
+        for name, csv_headers in self.headers.items():
+            if tables and name not in tables:
+                continue
+            self._columns[name] = OrderedDict(
+                (header, _Column(column_type(header))) for header in csv_headers)
+
+    def _add_records(self, name, records):
+        columns = self._columns.get(name)
+        if columns is None:
+            # Not requested
+            return
+        headers = self.headers[name]
+        rows = (self._row(headers, rec) for rec in records)
+        if self.sort_keys.get(name):
+            rows = sorted(rows, key=self.sort_keys[name])
+        columns = list(columns.values())
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    def _write_table(self, name, destination):
+        columns = self._columns[name]
+        if self.backend == 'parquet':
+            table = pa.Table.from_arrays(
+                [column.to_arrow() for column in columns.values()],
+                names=list(columns))
+            path = os.path.join(destination, '{}.parquet'.format(name))
+            pq.write_table(table, path, row_group_size=BATCH_ROWS)
+            return path
+
+        arrays = OrderedDict()
+        for header, column in columns.items():
+            arrays[header] = column.to_numpy()
+            mask = column.mask()
+            if mask is not None:
+                arrays[header + NPZ_MASK_SUFFIX] = mask
+        path = os.path.join(destination, '{}.npz'.format(name))
+        np.savez(path, **arrays)
+        return path
+
+    def write_unzipped(self, destination):
+        """Write one file per table in the given path."""
+        for name in self._columns:
+            self._write_table(name, destination)
+        for name, source in self._files.items():
+            copy_file(source, os.path.join(destination, name))
+
+    def stream_zipped(self, fileobj):
+        raise ValueError('Columnar feeds can not be streamed.')
+
+    def close(self):
+        """Nothing to finish, columnar feeds are never streamed."""
+
+    def abort(self):
+        """Nothing to abort, columnar feeds are never streamed."""
+
+    def write_changeset(self, destination):
+        raise ValueError('Changesets are only written for CSV feeds.')
+
+    def write_zipped(self, filepath):
+        """Write the tables into the given zip file.
+
+        Tables are stored without compression: Parquet compresses its
+        columns itself, and stored `.npz` archives can be loaded without
+        inflating them first.
+        """
+        workdir = tempfile.mkdtemp(prefix='o2g_columnar_')
+        try:
+            with zipfile.ZipFile(filepath, mode='w') as zfile:
+                for name in self._columns:
+                    path = self._write_table(name, workdir)
+                    zfile.write(path, arcname=os.path.basename(path))
+                    os.remove(path)
+                for name, source in self._files.items():
+                    zip_file(zfile, name, source,
+                             compress_type=zipfile.ZIP_DEFLATED)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
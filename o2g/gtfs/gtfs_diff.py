@@ -0,0 +1,102 @@
+"""Row level differences between two GTFS feeds."""
+import os
+import csv
+import hashlib
+import logging
+from collections import OrderedDict, Counter
+
+from o2g.gtfs.gtfs_reader import GTFSReader
+
+
+# Columns identifying a row of each table
+KEY_COLUMNS = {
+    'agency': ('agency_id',),
+    'stops': ('stop_id',),
+    'routes': ('route_id',),
+    'trips': ('trip_id',),
+    'calendar': ('service_id',),
+    'stop_times': ('trip_id', 'stop_sequence'),
+    'shapes': ('shape_id', 'shape_pt_sequence'),
+    'frequencies': ('trip_id', 'start_time'),
+    # A single row, which is replaced as a whole
+    'feedinfo': (),
+}
+
+ADDED = 'added'
+REMOVED = 'removed'
+CHANGED = 'changed'
+
+
+def _digest(row):
+    return hashlib.sha1('\x1f'.join(row).encode('utf-8')).digest()
+
+
+def _project(reader, headers):
+    """Yield rows of a csv reader with the columns in `headers` order."""
+    columns = next(reader, None)
+    if columns is None:
+        return
+    positions = [columns.index(h) if h in columns else None for h in headers]
+    for row in reader:
+        yield [row[p] if p is not None and p < len(row) else ''
+               for p in positions]
+
+
+def diff_table(old_rows, new_rows, headers, key_columns):
+    """Compare two streams of rows of one table.
+
+    Only a digest per old row is kept in memory, and every row is looked
+    at once, so the comparison takes time linear in the number of rows.
+
+    :param old_rows: csv rows including the header row
+    :param new_rows: csv rows including the header row
+    :return: generator of (change, row) pairs. Removed rows only carry
+        their key columns.
+    """
+    key_positions = [headers.index(k) for k in key_columns]
+
+    digests = {}
+    for row in _project(old_rows, headers):
+        digests[tuple(row[p] for p in key_positions)] = _digest(row)
+
+    for row in _project(new_rows, headers):
+        key = tuple(row[p] for p in key_positions)
+        old_digest = digests.pop(key, None)
+        if old_digest is None:
+            yield ADDED, row
+        elif old_digest != _digest(row):
+            yield CHANGED, row
+
+    for key in digests:
+        row = [''] * len(headers)
+        for position, value in zip(key_positions, key):
+            row[position] = value
+        yield REMOVED, row
+
+
+def write_changeset(previous, tables, destination):
+    """Write the changes of `tables` against the `previous` feed.
+
+    Every table gets a file in `destination` with a `change` column in
+    front of its own columns.
+
+    :param previous: path of the previous feed directory or zip
+    :param tables: map of table name to (headers, text file object)
+    :return: map of table name to a Counter of changes
+    """
+    reader = GTFSReader(previous)
+    summary = OrderedDict()
+    for name, (headers, new_file) in tables.items():
+        counts = Counter()
+        path = os.path.join(destination, '{}.txt'.format(name))
+        with open(path, 'w', encoding='utf-8', newline='') as out:
+            writer = csv.writer(out, lineterminator='\n')
+            writer.writerow(['change'] + list(headers))
+            for change, row in diff_table(reader.rows(name), csv.reader(new_file),
+                                          headers, KEY_COLUMNS[name]):
+                counts[change] += 1
+                writer.writerow([change] + row)
+        summary[name] = counts
+        logging.info('%s: %d added, %d removed, %d changed.', name,
+                     counts[ADDED], counts[REMOVED], counts[CHANGED])
+    return summary
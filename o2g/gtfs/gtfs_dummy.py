@@ -1,7 +1,7 @@
 """Tools to generate dummy GTFS feeds."""
 import datetime
 from math import radians, cos, sin, asin, sqrt
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, Counter
 
 from o2g.osm.models import Agency
 
@@ -10,20 +10,34 @@ from o2g.osm.models import Agency
 DummyData = namedtuple('DummyData',
                        ['calendar', 'stop_times', 'trips', 'frequencies'])
 
+# Trips per route and service day
+TRIPS_PER_SERVICE = 3
 
-def create_dummy_data(routes, stops):
+
+def create_dummy_data(routes, stops, stop_routes=None, shape_ids=None,
+                      template_trips=False):
     """Create `calendar`, `stop_times`, `trips` and `shapes`.
 
+    :param stop_routes: a StopRouteIndex giving the ordered stops of every
+        route. Without it stops are grouped by their `route_id` only, which
+        misses stops shared between routes.
+    :param shape_ids: map of route id to the id of its shape, for shapes
+        shared between routes. Defaults to the route id.
+    :param template_trips: create one trip per route and service instead
+        of TRIPS_PER_SERVICE. Its frequencies cover the whole day anyway,
+        so the feed describes the same service with a third of the stop
+        times.
     :return: DummyData namedtuple
     """
     # Build stops per route auxiliary map
-    stops_per_route = defaultdict(lambda: [])
-    stops_map = {}
-    for s in stops:
-        if not s.route_id:
-            continue
-        stops_per_route[s.route_id].append(s)
-        stops_map[s.stop_id] = s
+    if stop_routes is not None:
+        stops_per_route = _stops_per_route(stops, stop_routes)
+    else:
+        stops_per_route = defaultdict(lambda: [])
+        for s in stops:
+            if not s.route_id:
+                continue
+            stops_per_route[s.route_id].append(s)
 
     calendar = _create_dummy_calendar()
 
@@ -31,7 +45,9 @@ def create_dummy_data(routes, stops):
         _create_dummy_trips(
             routes,
             stops_per_route,
-            calendar)
+            calendar,
+            shape_ids or {},
+            1 if template_trips else TRIPS_PER_SERVICE)
 
     stop_times = _create_dummy_stoptimes(trips, stops_per_route)
     frequencies = _create_dummy_frequencies(trips)
@@ -39,18 +55,36 @@ def create_dummy_data(routes, stops):
     return DummyData(calendar, stop_times, trips, frequencies)
 
 
+def _stops_per_route(stops, stop_routes):
+    # Stations are no stops of trips, even if their node is a route member.
+    stops_map = {s.stop_id: s for s in stops if s.location_type != 1}
+    stops_per_route = {}
+    for route_id in stop_routes.route_ids:
+        stops_per_route[route_id] = [
+            stops_map[stop_id]
+            for stop_id in stop_routes.stops_of_route(route_id)
+            if stop_id in stops_map]
+    return stops_per_route
+
+
 def patch_agencies(agencies):
     """Fill the fields that are necessary for passing transitfeed checks."""
+    agencies = list(agencies)
+
+    # Agencies without a resolved timezone get the most common one.
+    timezones = Counter(a.agency_timezone for a in agencies if a.agency_timezone)
+    default_timezone = \
+        timezones.most_common(1)[0][0] if timezones else 'Europe/Berlin'
+
     # First return the unknown agency entry
-    yield Agency(-1, 'http://hiposfer.com', 'Unknown agency', 'Europe/Berlin')
+    yield Agency(-1, 'http://hiposfer.com', 'Unknown agency', default_timezone)
 
     # Then return the rest.
     for agency_id, agency_url, agency_name, agency_timezone in agencies:
         if not agency_url:
             agency_url = 'http://hiposfer.com'
         if not agency_timezone:
-            # Set everything to one time zone to get rid of transitfeeds error.
-            agency_timezone = 'Europe/Berlin'
+            agency_timezone = default_timezone
         yield Agency(agency_id, agency_url, agency_name, agency_timezone)
 
 
@@ -65,7 +99,8 @@ def _create_dummy_calendar():
              'end_date': 20190101}]
 
 
-def _create_dummy_trips(routes, stops_per_route, calendar):
+def _create_dummy_trips(routes, stops_per_route, calendar, shape_ids,
+                        trips_per_service):
     trips = []
 
     for route in routes:
@@ -75,8 +110,7 @@ def _create_dummy_trips(routes, stops_per_route, calendar):
             continue
 
         for cal_idx, cal in enumerate(calendar):
-            # For the sake of simplicity, we assume 3 trips per service day.
-            for idx in range(3):
+            for idx in range(trips_per_service):
 
                 trip_id = \
                     '{sequence}{cal_idx}.{route_id}'.format(
@@ -90,7 +124,7 @@ def _create_dummy_trips(routes, stops_per_route, calendar):
                         'trip_headsign':
                             '[Dummy]{}'.format(route.route_long_name),
                         # Use route_id, i.e. relation_id as shape_id
-                        'shape_id': route_id,
+                        'shape_id': shape_ids.get(route_id, route_id),
                         # Used for generating stop times.
                         'sequence': idx}
                 trips.append(trip)
@@ -100,16 +134,23 @@ def _create_dummy_trips(routes, stops_per_route, calendar):
 
 def _create_dummy_stoptimes(trips, stops_per_route):
     stoptimes = []
+    # Times of a stop pattern by its stops and start. Routes sharing their
+    # stops and the trips of every service share them.
+    patterns = {}
     for trip in trips:
-        # One service every 20 minutes from the base station
-        first_service_time = \
-            datetime.datetime(2017, 1, 1, 5, 0, 0) + \
-            datetime.timedelta(minutes=20) * trip['sequence']
-        stoptimes.extend(
-            _create_dummy_trip_stoptimes(
-                trip['trip_id'],
-                stops_per_route.get(trip['route_id'], []),
-                first_service_time))
+        stops = stops_per_route.get(trip['route_id'], [])
+        key = (tuple(s.stop_id for s in stops), trip['sequence'])
+        pattern = patterns.get(key)
+        if pattern is None:
+            # One service every 20 minutes from the base station
+            first_service_time = \
+                datetime.datetime(2017, 1, 1, 5, 0, 0) + \
+                datetime.timedelta(minutes=20) * trip['sequence']
+            pattern = patterns[key] = list(
+                _create_dummy_trip_stoptimes(None, stops, first_service_time))
+        trip_id = trip['trip_id']
+        stoptimes.extend(dict(stop_time, trip_id=trip_id)
+                         for stop_time in pattern)
 
     return stoptimes
 
@@ -2,6 +2,14 @@
 import enum
 
 
+# Every table o2g can write
+GTFS_TABLES = ('agency', 'stops', 'routes', 'trips', 'calendar', 'stop_times',
+               'shapes', 'frequencies', 'feedinfo')
+
+# Tables which only --dummy can fill
+DUMMY_TABLES = ('trips', 'calendar', 'stop_times', 'frequencies')
+
+
 class GTFSRouteType(enum.Enum):
     """Route types according to the GTFS specification."""
     Tram = 0
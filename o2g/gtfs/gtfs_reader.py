@@ -0,0 +1,160 @@
+"""Read GTFS feeds written by o2g or anyone else."""
+import os
+import io
+import csv
+import zipfile
+
+from o2g.osm.models import Agency, Route, Stop, Shape
+
+
+def _id(value):
+    # o2g writes OSM ids, other feeds use any string.
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+# Converters of typed columns. Other columns are kept as strings.
+COLUMN_TYPES = {
+    'agency_id': _id,
+    'stop_id': _id,
+    'route_id': _id,
+    'shape_id': _id,
+    'parent_station': _id,
+    'stop_lat': float,
+    'stop_lon': float,
+    'shape_pt_lat': float,
+    'shape_pt_lon': float,
+    'shape_pt_sequence': int,
+    'shape_dist_traveled': float,
+    'stop_sequence': int,
+    'route_type': int,
+    'location_type': int,
+    'wheelchair_boarding': int,
+    'headway_secs': int,
+    'monday': int,
+    'tuesday': int,
+    'wednesday': int,
+    'thursday': int,
+    'friday': int,
+    'saturday': int,
+    'sunday': int,
+    'start_date': int,
+    'end_date': int,
+    'feed_version': _id,
+}
+
+
+class GTFSReader(object):
+    """Read the tables of a feed directory or zip.
+
+    Nothing is read up front. Every table is streamed row by row when it
+    is asked for, so memory use does not grow with its size. Empty values
+    are kept as ''.
+    """
+    def __init__(self, feed):
+        self.feed = feed
+
+    @property
+    def tables(self):
+        """Names of the tables in the feed."""
+        if os.path.isdir(self.feed):
+            names = os.listdir(self.feed)
+        else:
+            with zipfile.ZipFile(self.feed) as archive:
+                names = archive.namelist()
+        return sorted(name[:-len('.txt')] for name in names
+                      if name.endswith('.txt') and '/' not in name)
+
+    def open(self, name):
+        """Open a table for reading.
+
+        :return: text file object or None if the feed lacks the table
+        """
+        filename = '{}.txt'.format(name)
+        if os.path.isdir(self.feed):
+            path = os.path.join(self.feed, filename)
+            if not os.path.exists(path):
+                return None
+            return open(path, encoding='utf-8-sig', newline='')
+
+        archive = zipfile.ZipFile(self.feed)
+        try:
+            raw = archive.open(filename)
+        except KeyError:
+            archive.close()
+            return None
+        # The archive is closed along with the last file opened from it.
+        archive.close()
+        return io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+
+    def rows(self, name):
+        """Yield the rows of a table as lists of strings, header first."""
+        file = self.open(name)
+        if file is None:
+            return
+        with file:
+            for row in csv.reader(file):
+                yield row
+
+    def records(self, name):
+        """Yield the rows of a table as dicts with typed values."""
+        rows = self.rows(name)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [column.strip() for column in header]
+        # Look converters up once per table instead of once per value.
+        converters = [COLUMN_TYPES.get(column) for column in header]
+        typed = [(idx, converter) for idx, converter in enumerate(converters)
+                 if converter]
+        for row in rows:
+            if not row:
+                continue
+            for idx, converter in typed:
+                if idx < len(row) and row[idx]:
+                    row[idx] = converter(row[idx])
+            yield dict(zip(header, row))
+
+    def agencies(self):
+        for rec in self.records('agency'):
+            yield Agency(rec.get('agency_id', ''), rec.get('agency_url', ''),
+                         rec.get('agency_name', ''),
+                         rec.get('agency_timezone', ''))
+
+    def stops(self):
+        # Which route visits a stop is not part of GTFS.
+        for rec in self.records('stops'):
+            yield Stop(rec['stop_id'], rec.get('stop_name', ''),
+                       rec.get('stop_lon', ''), rec.get('stop_lat', ''), None,
+                       rec.get('wheelchair_boarding', ''),
+                       rec.get('location_type', ''),
+                       rec.get('parent_station', ''))
+
+    def routes(self):
+        for rec in self.records('routes'):
+            yield Route(rec['route_id'], rec.get('route_short_name', ''),
+                        rec.get('route_long_name', ''),
+                        rec.get('route_type', ''), rec.get('route_url', ''),
+                        rec.get('route_color', ''), rec.get('agency_id', ''))
+
+    def shapes(self):
+        for rec in self.records('shapes'):
+            yield Shape(rec['shape_id'], rec['shape_pt_lat'],
+                        rec['shape_pt_lon'], rec['shape_pt_sequence'])
+
+    def trips(self):
+        return self.records('trips')
+
+    def stop_times(self):
+        return self.records('stop_times')
+
+    def calendar(self):
+        return self.records('calendar')
+
+    def frequencies(self):
+        return self.records('frequencies')
+
+    def feedinfo(self):
+        return self.records('feedinfo')
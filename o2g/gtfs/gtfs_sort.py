@@ -0,0 +1,116 @@
+"""Sorting of table rows within a memory budget.
+
+Rows are sorted in memory while they fit into the budget. Larger tables
+are cut into sorted runs that are spilled to temporary files and merged
+back with heapq.merge, so memory use stays around the budget however
+large the table is.
+"""
+import sys
+import heapq
+import pickle
+import logging
+import tempfile
+
+
+# Columns the writers sort tables by unless told otherwise. Loaders
+# prefer stop times grouped by trip and shape points grouped by shape.
+SORT_KEYS = {
+    'routes': ('route_id',),
+    'stop_times': ('trip_id', 'stop_sequence'),
+    'shapes': ('shape_id', 'shape_pt_sequence'),
+}
+
+SORT_MEMORY_BUDGET = 64 * 2**20
+
+# Rows pickled at once into a spilled run
+RUN_CHUNK_ROWS = 4096
+
+# Only every this many rows is measured, rows of a table are much alike.
+SIZE_SAMPLE_ROWS = 64
+
+
+def column_key(headers, columns):
+    """Sort key of rows with `headers` by the values of `columns`.
+
+    Ids are ints or strings depending on where they come from. Numbers go
+    first, in numerical order, then everything else as strings. Keys are
+    flat tuples of (rank, value) per column, which compare fastest.
+    """
+    unknown = [c for c in columns if c not in headers]
+    if unknown:
+        raise ValueError('Unknown sort columns: {}'.format(', '.join(unknown)))
+    positions = [headers.index(c) for c in columns]
+    numbers = (int, float)
+
+    def key(row):
+        values = []
+        for position in positions:
+            value = row[position]
+            if isinstance(value, numbers):
+                values.append(0)
+                values.append(value)
+            else:
+                values.append(1)
+                values.append('' if value is None else str(value))
+        return tuple(values)
+    return key
+
+
+def row_size(row):
+    """Approximate memory held by a row of values."""
+    return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+
+
+def _spill(run):
+    file = tempfile.TemporaryFile(prefix='o2g_sort_')
+    for start in range(0, len(run), RUN_CHUNK_ROWS):
+        pickle.dump(run[start:start + RUN_CHUNK_ROWS], file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    file.seek(0)
+    return file
+
+
+def _read_run(file):
+    while True:
+        try:
+            chunk = pickle.load(file)
+        except EOFError:
+            return
+        for row in chunk:
+            yield row
+
+
+def sort_rows(rows, key, memory_budget=SORT_MEMORY_BUDGET):
+    """Yield `rows` sorted by `key`. The sort is stable.
+
+    :param rows: iterable of lists or tuples of picklable values
+    :param memory_budget: bytes of rows held in memory at once. Their
+        sort keys take about as much again while a run is sorted.
+    """
+    runs = []
+    run = []
+    size = 0
+    try:
+        for row in rows:
+            if not len(run) % SIZE_SAMPLE_ROWS:
+                size += row_size(row) * SIZE_SAMPLE_ROWS
+            run.append(row)
+            if size >= memory_budget:
+                run.sort(key=key)
+                runs.append(_spill(run))
+                run = []
+                size = 0
+        run.sort(key=key)
+
+        if not runs:
+            for row in run:
+                yield row
+            return
+
+        logging.debug('Merging %d sorted runs spilled to disk.', len(runs) + 1)
+        # Ties go to the earlier run, which keeps the sort stable.
+        for row in heapq.merge(*[_read_run(f) for f in runs] + [run], key=key):
+            yield row
+    finally:
+        for file in runs:
+            file.close()
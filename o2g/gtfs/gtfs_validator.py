@@ -0,0 +1,408 @@
+"""Check GTFS feeds for errors without leaving the process."""
+import logging
+from array import array
+from operator import itemgetter
+from collections import namedtuple, Counter
+
+from o2g.gtfs.gtfs_reader import GTFSReader
+
+
+# One problem found in a feed. `row` is the line number in the table.
+Problem = namedtuple('Problem', ['severity', 'table', 'row', 'message'])
+
+ERROR = 'error'
+WARNING = 'warning'
+
+# Services are defined by calendar.txt, calendar_dates.txt or both.
+REQUIRED_TABLES = ('agency', 'stops', 'routes', 'trips', 'stop_times')
+
+REQUIRED_COLUMNS = {
+    'agency': ('agency_name', 'agency_url', 'agency_timezone'),
+    'stops': ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'),
+    'routes': ('route_id', 'route_type'),
+    'trips': ('route_id', 'service_id', 'trip_id'),
+    'stop_times': ('trip_id', 'arrival_time', 'departure_time', 'stop_id',
+                   'stop_sequence'),
+    'calendar': ('service_id', 'monday', 'tuesday', 'wednesday', 'thursday',
+                 'friday', 'saturday', 'sunday', 'start_date', 'end_date'),
+    'calendar_dates': ('service_id', 'date', 'exception_type'),
+    'shapes': ('shape_id', 'shape_pt_lat', 'shape_pt_lon',
+               'shape_pt_sequence'),
+    'frequencies': ('trip_id', 'start_time', 'end_time', 'headway_secs'),
+}
+
+
+# Stands for an empty time in the stop time arrays
+MISSING = -1
+
+
+def _grouped_in_order(trips, sequences):
+    """Whether every trip is one run of rows with increasing sequences."""
+    seen = set()
+    for i in range(len(trips)):
+        if i and trips[i] == trips[i - 1]:
+            if sequences[i] <= sequences[i - 1]:
+                return False
+        elif trips[i] in seen:
+            return False
+        else:
+            seen.add(trips[i])
+    return True
+
+
+def parse_time(value):
+    """Seconds of a GTFS time such as 25:10:00. Empty times are MISSING."""
+    if not value:
+        return MISSING
+    hours, minutes, seconds = value.split(':')
+    minutes, seconds = int(minutes), int(seconds)
+    if not (0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError(value)
+    return int(hours) * 3600 + minutes * 60 + seconds
+
+
+class _Table(object):
+    """Rows of one table with the positions of their columns."""
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+        header = next(rows, None) or []
+        self.columns = {column.strip(): idx for idx, column in enumerate(header)}
+        # Rows are padded, so that missing columns and values read as ''.
+        self._width = len(header) + 1
+
+    def getter(self, *columns):
+        """Function returning the values of `columns` of a padded row.
+
+        A tuple for more than one column.
+        """
+        pad = self._width - 1
+        return itemgetter(*[self.columns.get(column, pad) for column in columns])
+
+    def __iter__(self):
+        # Line numbers start after the header.
+        width = self._width
+        for line, row in enumerate(self.rows, 2):
+            if not row:
+                continue
+            if len(row) < width:
+                row.extend([''] * (width - len(row)))
+            yield line, row
+
+
+class GTFSValidator(object):
+    """Validate a feed directory or zip.
+
+    Checks required tables and fields, duplicate ids, references between
+    tables, coordinate ranges and the order of stop times. Trips without
+    stop times are warnings. Every table is
+    read once. Ids are collected in sets, so references are checked with
+    one set lookup per row. Stop times are kept in flat arrays to check
+    their order.
+
+    Every problem is counted, but only `max_examples` of each kind are kept.
+    """
+    def __init__(self, feed, max_examples=10):
+        self.reader = GTFSReader(feed)
+        self.max_examples = max_examples
+        self.problems = []
+        self.counts = Counter()
+
+    @property
+    def errors(self):
+        return sum(count for (severity, _, _), count in self.counts.items()
+                   if severity == ERROR)
+
+    @property
+    def warnings(self):
+        return sum(count for (severity, _, _), count in self.counts.items()
+                   if severity == WARNING)
+
+    def _report(self, severity, table, row, kind, message):
+        key = (severity, table, kind)
+        self.counts[key] += 1
+        if self.counts[key] <= self.max_examples:
+            self.problems.append(Problem(severity, table, row, message))
+
+    def _table(self, name):
+        table = _Table(name, self.reader.rows(name))
+        if not table.columns:
+            if name in REQUIRED_TABLES:
+                self._report(ERROR, name, None, 'missing table',
+                             'Required table {}.txt is missing.'.format(name))
+            return None
+        for column in REQUIRED_COLUMNS.get(name, ()):
+            if column not in table.columns:
+                self._report(ERROR, name, 1, 'missing column',
+                             'Required column {} is missing.'.format(column))
+        return table
+
+    def _required(self, table, line, row, columns):
+        for column, get in columns:
+            if not get(row):
+                self._report(ERROR, table.name, line, 'missing value',
+                             'Required value of {} is empty.'.format(column))
+
+    def _ids(self, table, column, ids):
+        """Collect the ids of a table into `ids` and check required values.
+
+        :return: generator of the line numbers and rows of the table
+        """
+        get_id = table.getter(column)
+        required = [(c, table.getter(c)) for c in REQUIRED_COLUMNS[table.name]]
+        for line, row in table:
+            self._required(table, line, row, required)
+            value = get_id(row)
+            if value in ids:
+                self._report(ERROR, table.name, line, 'duplicate id',
+                             'Duplicate {} {}.'.format(column, value))
+            ids.add(value)
+            yield line, row
+
+    def _reference(self, table, line, value, ids, column, target):
+        if value not in ids:
+            self._report(ERROR, table.name, line, 'unknown ' + column,
+                         '{} {} is not in {}.txt.'.format(column, value, target))
+
+    def _coordinates(self, table, line, lat, lon):
+        try:
+            if -90 <= float(lat) <= 90 and -180 <= float(lon) <= 180:
+                return
+        except ValueError:
+            pass
+        self._report(ERROR, table.name, line, 'invalid coordinates',
+                     'Invalid coordinates {}, {}.'.format(lat, lon))
+
+    def validate(self):
+        """Run all checks.
+
+        :return: self
+        """
+        agency_ids = self._validate_agencies()
+        stop_ids = self._validate_stops()
+        route_ids = self._validate_routes(agency_ids)
+        service_ids = self._validate_calendar()
+        shape_ids = self._validate_shapes()
+        trip_ids = self._validate_trips(route_ids, service_ids, shape_ids)
+        served_trip_ids = self._validate_stop_times(trip_ids, stop_ids)
+        self._validate_served(trip_ids, served_trip_ids)
+        self._validate_frequencies(trip_ids)
+        return self
+
+    def _validate_agencies(self):
+        table = self._table('agency')
+        if table is None:
+            return set()
+        agency_ids = set()
+        for _ in self._ids(table, 'agency_id', agency_ids):
+            pass
+        if len(agency_ids) > 1 and '' in agency_ids:
+            self._report(ERROR, 'agency', None, 'missing value',
+                         'agency_id is required with more than one agency.')
+        return agency_ids
+
+    def _validate_stops(self):
+        table = self._table('stops')
+        if table is None:
+            return set()
+        get_lat = table.getter('stop_lat')
+        get_lon = table.getter('stop_lon')
+        get_parent = table.getter('parent_station')
+        stop_ids = set()
+        parents = []
+        for line, row in self._ids(table, 'stop_id', stop_ids):
+            self._coordinates(table, line, get_lat(row), get_lon(row))
+            parent = get_parent(row)
+            if parent:
+                parents.append((line, parent))
+        for line, parent in parents:
+            self._reference(table, line, parent, stop_ids, 'parent_station', 'stops')
+        return stop_ids
+
+    def _validate_routes(self, agency_ids):
+        table = self._table('routes')
+        if table is None:
+            return set()
+        get_agency = table.getter('agency_id')
+        get_short = table.getter('route_short_name')
+        get_long = table.getter('route_long_name')
+        get_type = table.getter('route_type')
+        route_ids = set()
+        for line, row in self._ids(table, 'route_id', route_ids):
+            agency_id = get_agency(row)
+            if agency_id or len(agency_ids) > 1:
+                self._reference(table, line, agency_id, agency_ids, 'agency_id', 'agency')
+            if not get_short(row) and not get_long(row):
+                self._report(ERROR, 'routes', line, 'missing name',
+                             'Either route_short_name or route_long_name is required.')
+            if not get_type(row).isdigit():
+                self._report(ERROR, 'routes', line, 'invalid route_type',
+                             'Invalid route_type {}.'.format(get_type(row)))
+        return route_ids
+
+    def _validate_calendar(self):
+        service_ids = set()
+        table = self._table('calendar')
+        if table is not None:
+            for _ in self._ids(table, 'service_id', service_ids):
+                pass
+        dates = self._table('calendar_dates')
+        if dates is not None:
+            # A service has a row per added or removed date.
+            get_service = dates.getter('service_id')
+            required = [(c, dates.getter(c))
+                        for c in REQUIRED_COLUMNS['calendar_dates']]
+            for line, row in dates:
+                self._required(dates, line, row, required)
+                service_ids.add(get_service(row))
+        if table is None and dates is None:
+            self._report(ERROR, 'calendar', None, 'missing table',
+                         'Either calendar.txt or calendar_dates.txt is required.')
+        return service_ids
+
+    def _validate_shapes(self):
+        table = self._table('shapes')
+        if table is None:
+            return set()
+        shape_ids = set()
+        get_values = table.getter(*REQUIRED_COLUMNS['shapes'])
+        required = [(c, table.getter(c)) for c in REQUIRED_COLUMNS['shapes']]
+        for line, row in table:
+            shape_id, lat, lon, _ = values = get_values(row)
+            if not all(values):
+                self._required(table, line, row, required)
+            self._coordinates(table, line, lat, lon)
+            shape_ids.add(shape_id)
+        return shape_ids
+
+    def _validate_trips(self, route_ids, service_ids, shape_ids):
+        table = self._table('trips')
+        if table is None:
+            return set()
+        get_route = table.getter('route_id')
+        get_service = table.getter('service_id')
+        get_shape = table.getter('shape_id')
+        trip_ids = set()
+        for line, row in self._ids(table, 'trip_id', trip_ids):
+            self._reference(table, line, get_route(row), route_ids, 'route_id', 'routes')
+            self._reference(table, line, get_service(row), service_ids,
+                            'service_id', 'calendar')
+            shape_id = get_shape(row)
+            if shape_id:
+                self._reference(table, line, shape_id, shape_ids, 'shape_id', 'shapes')
+        return trip_ids
+
+    def _validate_stop_times(self, trip_ids, stop_ids):
+        table = self._table('stop_times')
+        if table is None:
+            return set()
+        get_values = table.getter('trip_id', 'stop_id', 'stop_sequence',
+                                  'arrival_time', 'departure_time')
+        # Times may be left empty between timepoints.
+        required = [(c, table.getter(c))
+                    for c in ('trip_id', 'stop_id', 'stop_sequence')]
+
+        # Flat columns of the rows with valid values, trips as small ints
+        trip_codes = {}
+        trips, sequences = array('l'), array('l')
+        arrivals, departures, lines = array('l'), array('l'), array('l')
+        # Feeds reuse few distinct times
+        times = {}
+        for line, row in table:
+            trip_id, stop_id, sequence, arrival, departure = get_values(row)
+            if not (trip_id and stop_id and sequence):
+                self._required(table, line, row, required)
+            if trip_id not in trip_ids:
+                self._reference(table, line, trip_id, trip_ids, 'trip_id', 'trips')
+            if stop_id not in stop_ids:
+                self._reference(table, line, stop_id, stop_ids, 'stop_id', 'stops')
+            try:
+                sequence = int(sequence)
+                if arrival not in times:
+                    times[arrival] = parse_time(arrival)
+                if departure not in times:
+                    times[departure] = parse_time(departure)
+            except ValueError:
+                self._report(ERROR, table.name, line, 'invalid value',
+                             'Invalid stop_sequence or time.')
+                continue
+            trips.append(trip_codes.setdefault(trip_id, len(trip_codes)))
+            sequences.append(sequence)
+            arrivals.append(times[arrival])
+            departures.append(times[departure])
+            lines.append(line)
+
+        self._check_order(table, trips, sequences, arrivals, departures, lines)
+        return set(trip_codes)
+
+    def _validate_served(self, trip_ids, served_trip_ids):
+        for trip_id in sorted(trip_ids - served_trip_ids):
+            self._report(WARNING, 'trips', None, 'trip without stop times',
+                         'Trip {} has no stop times.'.format(trip_id))
+
+    def _check_order(self, table, trips, sequences, arrivals, departures, lines):
+        """Stop times must move forward along every trip."""
+        order = range(len(trips))
+        # Feeds usually list the stops of a trip in order. Sort otherwise.
+        if not _grouped_in_order(trips, sequences):
+            order = sorted(order, key=lambda i: (trips[i], sequences[i]))
+
+        previous = None
+        # Departure at the last stop with times. Times are optional
+        # between timepoints.
+        last_departure = MISSING
+        for i in order:
+            line = lines[i]
+            if previous is None or trips[previous] != trips[i]:
+                last_departure = MISSING
+            elif sequences[previous] == sequences[i]:
+                self._report(ERROR, table.name, line, 'duplicate stop_sequence',
+                             'Duplicate stop_sequence {}.'.format(sequences[i]))
+
+            if departures[i] != MISSING and departures[i] < arrivals[i]:
+                self._report(ERROR, table.name, line, 'time travel',
+                             'Departure before arrival.')
+            if arrivals[i] != MISSING:
+                if last_departure != MISSING and arrivals[i] < last_departure:
+                    self._report(ERROR, table.name, line, 'time travel',
+                                 'Arrival before the departure at the previous stop.')
+                last_departure = max(departures[i], arrivals[i])
+            previous = i
+
+    def _validate_frequencies(self, trip_ids):
+        table = self._table('frequencies')
+        if table is None:
+            return
+        get_trip = table.getter('trip_id')
+        get_start = table.getter('start_time')
+        get_end = table.getter('end_time')
+        required = [(c, table.getter(c)) for c in REQUIRED_COLUMNS['frequencies']]
+        for line, row in table:
+            self._required(table, line, row, required)
+            self._reference(table, line, get_trip(row), trip_ids, 'trip_id', 'trips')
+            start, end = get_start(row), get_end(row)
+            # Missing times were reported as such already.
+            if not (start and end):
+                continue
+            try:
+                if parse_time(end) <= parse_time(start):
+                    self._report(ERROR, table.name, line, 'time travel',
+                                 'end_time is not after start_time.')
+            except ValueError:
+                self._report(ERROR, table.name, line, 'invalid value',
+                             'Invalid start_time or end_time.')
+
+    def summary(self):
+        """Lines describing the problems found."""
+        lines = ['{} errors, {} warnings.'.format(self.errors, self.warnings)]
+        for (severity, table, kind), count in sorted(self.counts.items()):
+            lines.append('{}: {}.txt: {} ({})'.format(severity, table, kind, count))
+        for problem in self.problems:
+            lines.append('  {}.txt:{}: {}'.format(
+                problem.table, problem.row or '-', problem.message))
+        return lines
+
+    def log(self):
+        level = logging.ERROR if self.errors else logging.INFO
+        for line in self.summary():
+            logging.log(level, 'Validation: %s', line)
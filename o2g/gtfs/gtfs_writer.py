@@ -4,35 +4,102 @@ import io
 import csv
 import shutil
 import zipfile
+import tempfile
 from collections import OrderedDict
 
+from o2g.gtfs.gtfs_diff import write_changeset
+from o2g.gtfs.gtfs_sort import SORT_KEYS, SORT_MEMORY_BUDGET, column_key,\
+    sort_rows
+
+
+def zip_file(zfile, name, source, **kwargs):
+    """Add a file given by its path or by its contents as bytes to a zip."""
+    if isinstance(source, bytes):
+        zfile.writestr(name, source, **kwargs)
+    else:
+        zfile.write(source, arcname=name, **kwargs)
+
+
+def copy_file(source, destination):
+    """Copy a file given by its path or by its contents as bytes."""
+    if isinstance(source, bytes):
+        with open(destination, 'wb') as file:
+            file.write(source)
+    else:
+        shutil.copy(source, destination)
+
 
 class GTFSWriter(object):
     """GTFS feed writer."""
-    def __init__(self):
+    def __init__(self, spool=False, tables=None, previous=None,
+                 sort_keys=None, sort_memory=SORT_MEMORY_BUDGET):
+        """
+        :param spool: write tables to temporary files instead of memory
+        :param tables: names of the tables to write. Defaults to all.
+        :param previous: path of the previous feed directory or zip. If
+            given, a changeset against it is written along with the feed.
+        :param sort_keys: map of table name to the columns to sort it by,
+            on top of SORT_KEYS. No columns leave a table unsorted.
+        :param sort_memory: bytes of rows sorted in memory. Larger tables
+            are sorted with runs spilled to disk.
+        """
+        self.previous = previous
+        self.sort_keys = self._sort_keys(sort_keys)
+        self.sort_memory = sort_memory
+        self.changes = None
+        self._zip = None
+        self._written = set()
         self._buffers = {}
         self._csv_writers = {}
         self._files = {}
 
         for name, csv_headers in self.headers.items():
-            self._buffers[name] = io.StringIO()
+            if tables and name not in tables:
+                continue
+            if spool:
+                self._buffers[name] = tempfile.NamedTemporaryFile(
+                    mode='w+', encoding='utf-8', newline='', suffix='.txt')
+            else:
+                self._buffers[name] = io.StringIO()
             self._csv_writers[name] =\
                 csv.writer(self._buffers[name], lineterminator='\n')
             self._csv_writers[name].writerow(csv_headers)
 
-    def _add_records(self, name, records, sortkey=None):
-        if sortkey:
-            records = sorted(records, key=lambda x: x[sortkey])
-        for rec in records:
-            if not isinstance(rec, dict):
-                record = rec._asdict()
-            else:
-                record = rec
-            csv_record = OrderedDict.fromkeys(self.headers[name])
-            # Update csv with keys present in headers. Skip anything else.
-            csv_record.update(
-                {k: v for k, v in record.items() if k in self.headers[name]})
-            self._csv_writers[name].writerow([v for v in csv_record.values()])
+    def _sort_keys(self, sort_keys):
+        """Sort keys of the tables by name, checking the columns."""
+        columns = dict(SORT_KEYS, **(sort_keys or {}))
+        unknown = [name for name in columns if name not in self.headers]
+        if unknown:
+            raise ValueError('Unknown tables to sort: {}'.format(
+                ', '.join(unknown)))
+        return {name: column_key(self.headers[name], columns[name])
+                for name in columns if columns[name]}
+
+    @staticmethod
+    def _row(headers, rec):
+        if not isinstance(rec, dict):
+            record = rec._asdict()
+        else:
+            record = rec
+        csv_record = OrderedDict.fromkeys(headers)
+        # Update csv with keys present in headers. Skip anything else.
+        csv_record.update({k: v for k, v in record.items() if k in headers})
+        return list(csv_record.values())
+
+    def _add_records(self, name, records):
+        if name in self._written:
+            raise ValueError('{} was streamed already.'.format(name))
+        if name not in self._csv_writers:
+            # Not requested
+            return
+        headers = self.headers[name]
+        rows = (self._row(headers, rec) for rec in records)
+        if self.sort_keys.get(name):
+            rows = sort_rows(rows, self.sort_keys[name], self.sort_memory)
+        self._csv_writers[name].writerows(rows)
+
+        if self._zip is not None:
+            self._stream_table(name)
 
     @property
     def headers(self):
@@ -83,7 +150,7 @@ class GTFSWriter(object):
         self._add_records('stops', stops)
 
     def add_routes(self, routes):
-        self._add_records('routes', routes, sortkey=0)
+        self._add_records('routes', routes)
 
     def add_calendar(self, weekly_schedules):
         self._add_records('calendar', weekly_schedules)
@@ -106,22 +173,123 @@ class GTFSWriter(object):
     def add_file(self, name, path):
         self._files[name] = path
 
+    def add_file_data(self, name, data):
+        """Add a file with the given contents, str or bytes."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._files[name] = data
+
+    def changeset_path(self, feed_path):
+        """Where the changeset of a feed written to `feed_path` goes."""
+        if feed_path.endswith('.zip'):
+            return feed_path[:-len('.zip')] + '.changes.zip'
+        return os.path.join(feed_path, 'changes')
+
+    def write_changeset(self, destination):
+        """Write the row changes against the previous feed to a directory.
+
+        Tables are read back from their buffers one at a time.
+
+        :return: map of table name to a Counter of changes
+        """
+        for buffer in self._buffers.values():
+            buffer.seek(0)
+        try:
+            self.changes = write_changeset(
+                self.previous,
+                OrderedDict((name, (self.headers[name], buffer))
+                            for name, buffer in self._buffers.items()),
+                destination)
+        finally:
+            for buffer in self._buffers.values():
+                buffer.seek(0, io.SEEK_END)
+        return self.changes
+
+    def _write_zipped_changeset(self, filepath):
+        workdir = tempfile.mkdtemp(prefix='o2g_changes_')
+        try:
+            self.write_changeset(workdir)
+            with zipfile.ZipFile(filepath, mode='w',
+                                 compression=zipfile.ZIP_DEFLATED) as zfile:
+                for name in sorted(os.listdir(workdir)):
+                    zfile.write(os.path.join(workdir, name), arcname=name)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _write_table(self, zfile, name):
+        buffer = self._buffers[name]
+        if not isinstance(buffer, io.StringIO):
+            # Spooled tables are streamed from disk.
+            buffer.flush()
+            zfile.write(buffer.name, arcname='{}.txt'.format(name))
+            return
+        encoded_values = io.BytesIO(buffer.getvalue().encode('utf-8'))
+        zfile.writestr('{}.txt'.format(name),
+                       encoded_values.getbuffer())
+
     def write_zipped(self, filepath):
         """Write the GTFS feed in the given file."""
+        # The changeset goes first, the previous feed may be overwritten.
+        if self.previous:
+            self._write_zipped_changeset(self.changeset_path(filepath))
+
         with zipfile.ZipFile(filepath, mode='w', compression=zipfile.ZIP_DEFLATED) as zfile:
-            for name, buffer in self._buffers.items():
-                encoded_values = io.BytesIO(buffer.getvalue().encode('utf-8'))
-                zfile.writestr('{}.txt'.format(name),
-                               encoded_values.getbuffer())
-            for name, path in self._files.items():
-                zfile.write(path, arcname=name)
+            for name in self._buffers:
+                self._write_table(zfile, name)
+            for name, source in self._files.items():
+                zip_file(zfile, name, source)
+
+    def stream_zipped(self, fileobj):
+        """Write each table to a zip on `fileobj` as soon as it is added.
+
+        `fileobj` may be unseekable, e.g. a pipe or a socket. Streamed
+        tables are dropped from memory, so each of them has to be added in
+        one call. `close` writes the tables never added and the files.
+        """
+        self._zip = zipfile.ZipFile(fileobj, mode='w',
+                                    compression=zipfile.ZIP_DEFLATED)
+
+    def _stream_table(self, name):
+        self._write_table(self._zip, name)
+        self._buffers.pop(name).close()
+        del self._csv_writers[name]
+        self._written.add(name)
+
+    def close(self):
+        """Finish a zip started with `stream_zipped`."""
+        if self._zip is None:
+            return
+        for name in list(self._buffers):
+            self._stream_table(name)
+        for name, source in self._files.items():
+            zip_file(self._zip, name, source)
+        self._zip.close()
+        self._zip = None
+
+    def abort(self):
+        """Leave a zip started with `stream_zipped` unfinished."""
+        if self._zip is None:
+            return
+        # Closing, also when collected, writes the central directory.
+        self._zip.fp = None
+        self._zip = None
 
     def write_unzipped(self, destination):
         """Write GTFS text files in the given path."""
+        if self.previous:
+            changes_dir = self.changeset_path(destination)
+            os.makedirs(changes_dir, exist_ok=True)
+            self.write_changeset(changes_dir)
+
         for name, buffer in self._buffers.items():
             with open(os.path.join(destination,
                                    '{}.txt'.format(name)),
                       'w', encoding='utf-8') as file:
-                file.write(buffer.getvalue())
-        for name, path in self._files.items():
-            shutil.copy(path, os.path.join(destination, name))
+                if isinstance(buffer, io.StringIO):
+                    file.write(buffer.getvalue())
+                else:
+                    buffer.seek(0)
+                    shutil.copyfileobj(buffer, file)
+                    buffer.seek(0, io.SEEK_END)
+        for name, source in self._files.items():
+            copy_file(source, os.path.join(destination, name))
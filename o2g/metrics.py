@@ -0,0 +1,214 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+A small stand-in for prometheus_client, enough for the web app to serve
+`/metrics`. Updates take a lock and a dict lookup, values are only
+formatted when scraped.
+"""
+import os
+import bisect
+import resource
+import threading
+
+
+# Seconds, from a quick request to a conversion of a large extract
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300)
+
+# Bytes, from a small Overpass result to a country extract
+SIZE_BUCKETS = tuple(2 ** exp for exp in range(10, 34, 2))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"')\
+        .replace('\n', r'\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('{} needs the labels {}, got {}'.format(
+                self.name, ', '.join(self.labels), ', '.join(sorted(labels))))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """(name, label pairs, value) of every sample."""
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, list(zip(self.labels, key)), value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, pairs, value in self.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(pairs),
+                                          _format_value(value)))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters only go up.')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    :param function: called for the value when scraped, for gauges
+        without labels like the memory of the process
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        if self.function:
+            return self.function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self.function:
+            yield self.name, [], self.function()
+            return
+        for sample in super(Gauge, self).samples():
+            yield sample
+
+
+class Histogram(_Metric):
+    """Counts of observations by upper bound, with their sum."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        if 'le' in labels:
+            raise ValueError('le is reserved for the buckets.')
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Counts per bucket, the last for values above all bounds,
+                # and the sum.
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total))
+                            for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       pairs + [('le', _format_value(float(bound)))],
+                       cumulative)
+            yield self.name + '_sum', pairs, total
+            yield self.name + '_count', pairs, cumulative
+
+
+class Registry(object):
+    """Metrics served together, in the order they were added."""
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+
+    def register(self, metric):
+        if metric.name in self._names:
+            raise ValueError('{} is registered already.'.format(metric.name))
+        self._names.add(metric.name)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Metrics of this process
+REGISTRY = Registry()
+
+# Content type of `Registry.render`
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def resident_memory():
+    """Resident set size of this process in bytes.
+
+    Read from /proc where available, otherwise the peak size is the best
+    getrusage has to offer.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
@@ -1,7 +1,8 @@
 from .agency_builder import build_agencies
 from .route_builder import build_routes
 from .stop_builder import build_stops
-from .shape_builder import build_shapes
+from .shape_builder import build_shapes, ShapeDeduplicator
 
 
-__all__ = ['build_agencies', 'build_routes', 'build_stops', 'build_shapes']
\ No newline at end of file
+__all__ = ['build_agencies', 'build_routes', 'build_stops', 'build_shapes',
+           'ShapeDeduplicator']
\ No newline at end of file
@@ -1,24 +1,42 @@
 """Functionality to build a list of agencies."""
-import hashlib
-
-# from timezonefinder import TimezoneFinder
-
+from o2g.diagnostics import Diagnostics
 from o2g.osm.models import Agency
-
-
-# TZ_FINDER = TimezoneFinder()
-
-
-def build_agencies(relations, nodes, ways):
-    extracted = []
-    for rel in relations.values():
-        agency = build_agency(rel, nodes)
-        if agency and agency.agency_id not in extracted:
-            extracted.append(agency.agency_id)
-            yield agency#._replace(agency_timezone=_guess_timezone(rel, nodes, ways))
-
-
-def build_agency(relation, nodes):
+from o2g.osm.store import prefetch
+
+
+def build_agencies(index, nodes, ways, timezones=None, diagnostics=None):
+    """Build one agency per operator.
+
+    :param timezones: a TimezoneResolver. Agencies get an empty timezone
+        without one that is available.
+    :param diagnostics: Diagnostics counting the issues found
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    if timezones is not None and not timezones.available:
+        timezones = None
+    agencies = []
+    points = []
+    extracted = set()
+    for agency_id, rel in index.operators.values():
+        if agency_id in extracted:
+            # Two operator names with the same hash
+            continue
+        extracted.add(agency_id)
+        agencies.append(build_agency(rel, agency_id))
+        if timezones:
+            points.append(_get_first_coordinate(rel, index.members[rel.id],
+                                                nodes, ways, diagnostics))
+
+    if not timezones:
+        return agencies
+
+    # One representative coordinate per agency, resolved in one batch.
+    return [agency._replace(agency_timezone=timezone)
+            for agency, timezone in zip(agencies, timezones.timezones_at(points))]
+
+
+def build_agency(relation, agency_id):
     """Extract agency information."""
     # TODO: find out the operator for routes without operator tag.
     # See: http://wiki.openstreetmap.org/wiki/Key:operator
@@ -35,30 +53,17 @@ def build_agency(relation, nodes):
     if not op:
         return
 
-    agency_id = int(hashlib.sha256(op.encode('utf8')).hexdigest(), 16) % 10**8
-
     return Agency(agency_id, agency_url, op, '')
 
 
-# def _guess_timezone(relation, nodes, ways):
-#     """Guess timezone of the relation by looking at it's nodes."""
-#     lon, lat = _get_first_coordinate(relation, nodes, ways)
-#     timezone = TZ_FINDER.timezone_at(lng=lon, lat=lat)
-#     if not timezone:
-#         logging.debug('No timezone found for (%s, %s)', lon, lat)
-#     return timezone
-
-
-# def _get_first_coordinate(relation, nodes, ways):
-#     for member_id, member_role in relation.member_info:
-#         if member_id in nodes:
-#             return nodes[member_id].lon, nodes[member_id].lat
-#         elif member_id in ways:
-#             return _get_first_way_coordinate(member_id, ways)
-#     logging.debug('No node found for relation %s', relation.id)
-#     return 0, 0
-
-
-# def _get_first_way_coordinate(way_id, ways):
-#     # Pick the first node
-#     return ways[way_id].points[0]
+def _get_first_coordinate(relation, members, nodes, ways, diagnostics):
+    nodes = prefetch(nodes, members.nodes)
+    ways = prefetch(ways, members.ways)
+    for member_id in members.nodes:
+        if member_id in nodes:
+            return nodes[member_id].lon, nodes[member_id].lat
+    for member_id in members.ways:
+        if member_id in ways and ways[member_id].points:
+            # Pick the first node
+            return tuple(ways[member_id].points[0])
+    diagnostics.add('route_without_nodes', relation.id, 'relation/{}')
@@ -1,18 +1,16 @@
 """Functionality to build a list of routes."""
-import hashlib
-
 from o2g.osm.models import Route
 from o2g.gtfs.gtfs_misc import map_osm_route_type_to_gtfs
 
 
-def build_routes(relations):
-    for rel in relations.values():
-        route = build_route(rel)
+def build_routes(index):
+    for rel in index.routes:
+        route = build_route(rel, index.agency_id(rel))
         if route:
             yield route
 
 
-def build_route(relation):
+def build_route(relation, agency_id):
     """Extract information of one route."""
     if relation.tags.get('type') != 'route':
         # Build route only for relations of type `route`
@@ -27,7 +25,7 @@ def build_route(relation):
               map_osm_route_type_to_gtfs(relation.tags.get('route')),
               'https://www.openstreetmap.org/relation/{}'.format(relation.id),
               color.strip('#') if color else '',
-              get_agency_id(relation))
+              agency_id)
 
 
 def create_route_short_name(relation):
@@ -50,10 +48,3 @@ def create_route_long_name(relation, short_name):
         return name[len(short_name):]
     return name
 
-
-def get_agency_id(relation):
-    """Construct an id for agency using its tags."""
-    op = relation.tags.get('operator')
-    if op:
-        return int(hashlib.sha256(op.encode('utf-8')).hexdigest(), 16) % 10**8
-    return -1
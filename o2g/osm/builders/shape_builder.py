@@ -1,21 +1,33 @@
 """Functionality to build a list of shapes."""
-import logging
+import hashlib
+from itertools import groupby
+from operator import attrgetter
 
+from o2g.diagnostics import Diagnostics
 from o2g.osm.models import Shape
+from o2g.osm.store import prefetch
 
 
-def build_shapes(relations, nodes, ways):
-    for rel in relations.values():
-        for record in build_shape(rel, nodes, ways):
+def build_shapes(index, nodes, ways, way_shapes=False, diagnostics=None):
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    for rel in index.routes:
+        members = index.members[rel.id]
+        if way_shapes:
+            records = build_way_shape(rel, members, nodes, ways, diagnostics)
+        else:
+            records = build_shape(rel, members, nodes, ways)
+        for record in records:
             if record:
                 yield record
 
 
-def build_shape(relation, nodes, ways):
+def build_shape(relation, members, nodes, ways):
     """Extract shape of one route."""
     sequence_index = 0
+    nodes = prefetch(nodes, members.nodes)
 
-    for member_type, member_id, member_role in relation.member_info:
+    for member_id in members.nodes:
 
         if member_id in nodes:
             yield Shape(
@@ -26,25 +38,98 @@ def build_shape(relation, nodes, ways):
 
             sequence_index += 1
 
-        # Do we need to consider ways too? It dramatically increases the number of shapes.
-        elif member_id in ways:
-            continue
-        #     for point in ways[member_id].points:
-        #         shape = Shape(
-        #             relation.id,
-        #             point.lat,
-        #             point.lon,
-        #             sequence_index)
-        #         sequence_index += 1
-
         else:
             # Ignore excessive logging for now.
             pass
-            # if member_type == 'n':
-            #     member_osm_type = 'node'
-            # elif member_type == 'w':
-            #     member_osm_type = 'way'
-            # else:
-            #     member_osm_type = member_type
-            # logging.warning('[no data] https://osm.org/relation/%s missing https://osm.org/%s/%s.',
-            #                 relation.id, member_osm_type, member_id)
+            # logging.warning('[no data] https://osm.org/relation/%s missing https://osm.org/node/%s.',
+            #                 relation.id, member_id)
+
+
+def build_way_shape(relation, members, nodes, ways, diagnostics):
+    """Extract shape of one route out of its ways.
+
+    It dramatically increases the number of shapes, but follows the streets.
+    Routes without usable ways fall back to their member nodes.
+    """
+    sequence_index = 0
+    last_point = None
+    ways = prefetch(ways, members.ways)
+    way_points = [ways[member_id].points for member_id in members.ways
+                  if member_id in ways and ways[member_id].points]
+
+    for points in _oriented(way_points):
+        for point in points:
+            # Consecutive ways share their end nodes.
+            if point == last_point:
+                continue
+            last_point = point
+            yield Shape(
+                relation.id,
+                point.lat,
+                point.lon,
+                sequence_index)
+            sequence_index += 1
+
+    if not sequence_index:
+        diagnostics.add('route_without_way_points', relation.id, 'relation/{}')
+        for record in build_shape(relation, members, nodes, ways):
+            yield record
+
+
+def _oriented(way_points):
+    """Turn the point lists of consecutive ways into the driving direction.
+
+    Route members are ordered, but each way keeps the direction it was
+    drawn in. A way continues where the previous one ended. The first way,
+    and the first after a gap, is turned towards the way after it.
+    """
+    end = None
+    for position, points in enumerate(way_points):
+        if end is not None and points[-1] == end and points[0] != end:
+            points = points[::-1]
+        elif end is None or end not in (points[0], points[-1]):
+            following = way_points[position + 1:position + 2]
+            if following and points[0] in (following[0][0], following[0][-1]) \
+                    and points[-1] not in (following[0][0], following[0][-1]):
+                points = points[::-1]
+        end = points[-1]
+        yield points
+
+
+class ShapeDeduplicator(object):
+    """Drop shapes whose point sequence was already written.
+
+    Shapes are read one at a time and only a digest of every written one
+    is kept. `shape_ids` maps the id of every shape seen to the id of the
+    shape written for its geometry.
+    """
+    def __init__(self):
+        self.shape_ids = {}
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self._digests = {}
+
+    def deduplicate(self, shapes):
+        """Yield the records of `shapes` that are not duplicates.
+
+        :param shapes: Shape records grouped by shape_id
+        """
+        for shape_id, records in groupby(shapes, key=attrgetter('shape_id')):
+            records = list(records)
+            digest = hashlib.sha1()
+            for record in records:
+                digest.update('{},{};'.format(
+                    record.shape_pt_lat, record.shape_pt_lon).encode('utf-8'))
+
+            shared_id = self._digests.setdefault(digest.digest(), shape_id)
+            self.shape_ids[shape_id] = shared_id
+            if shared_id != shape_id:
+                self.duplicates += 1
+                # Size of the rows in shapes.txt
+                self.bytes_saved += sum(
+                    len(','.join(str(v) for v in record)) + 1
+                    for record in records)
+                continue
+
+            for record in records:
+                yield record
@@ -1,43 +1,64 @@
 """Functionality to build a list of stops."""
 import logging
+from collections import Counter
 
+from o2g.diagnostics import Diagnostics
 from o2g.osm.models import Stop
+from o2g.osm.spatial import PointGrid, cluster_points
+from o2g.osm.store import prefetch
 
 
-def build_stops(relations, nodes):
-    visited_stops_ids = set()
-    stop_to_station_map = {}
+def build_stops(index, nodes, snap_radius=0, cluster_radius=0,
+                diagnostics=None):
+    """Build stations of stop_areas followed by stops of routes.
 
-    # First gsocess all stop_areas
-    for rel in relations.values():
-        if rel.tags.get('public_transport') != 'stop_area':
-            continue
+    :param snap_radius: attach stops outside of any stop_area to the nearest
+        station within this many meters. Zero disables it.
+    :param cluster_radius: group remaining stops closer than this many meters
+        under a generated parent station. Zero disables it.
+    :param diagnostics: Diagnostics counting the issues found
+    """
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+    stops = _build_stops(index, nodes, diagnostics)
+    if snap_radius or cluster_radius:
+        stops = assign_stations(list(stops), snap_radius, cluster_radius)
+    return stops
 
-        station = build_parent_stop(rel, nodes)
+
+def _build_stops(index, nodes, diagnostics):
+    visited_stops_ids = set()
+    station_of_stop_area = {}
+
+    # First process all stop_areas
+    for rel in index.stop_areas:
+        station = build_parent_stop(rel, index.members[rel.id], nodes,
+                                    diagnostics)
         if not station:
             continue
 
-        for _, member_id, _ in rel.member_info:
-            stop_to_station_map[member_id] = station.stop_id
-
+        station_of_stop_area[rel.id] = station.stop_id
         visited_stops_ids.add(station.stop_id)
         yield station
 
+    def parent_station(stop_id):
+        stop_area_id = index.stop_area_of.get(stop_id)
+        return station_of_stop_area.get(stop_area_id, '')
 
-    for rel in relations.values():
-        if rel.tags.get('public_transport') == 'stop_area':
-            continue
-
-        for stop in extract_stops(rel, nodes, visited_stops_ids, stop_to_station_map):
+    for rel in index.routes:
+        for stop in extract_stops(rel, index.members[rel.id], nodes,
+                                  visited_stops_ids, parent_station,
+                                  diagnostics):
             if stop:
                 yield stop
 
 
-def build_parent_stop(relation, nodes):
+def build_parent_stop(relation, members, nodes, diagnostics):
     # One stop per stop_area is necessary.
     station_node = None
     some_node = None
-    for member_type, member_id, member_role in relation.member_info:
+    nodes = prefetch(nodes, members.nodes)
+    for member_id in members.nodes:
         if member_id not in nodes:
             continue
         some_node = nodes[member_id]
@@ -48,13 +69,12 @@ def build_parent_stop(relation, nodes):
             station_node = some_node
 
     if not station_node and not some_node:
-        logging.debug('No parent node found: https://osm.org/relation/%s' % relation.id)
+        diagnostics.add('stop_area_without_nodes', relation.id, 'relation/{}')
         return
 
     if not station_node:
-        logging.warning(
-            'stop_area without station: https://osm.org/relation/%s.'\
-            ' Using node https://osm.org/node/%s instead.' % (relation.id, some_node.id))
+        # Use some member node instead.
+        diagnostics.add('stop_area_without_station', relation.id, 'relation/{}')
         station_node = some_node
 
     return Stop(
@@ -63,19 +83,19 @@ def build_parent_stop(relation, nodes):
         station_node.lon,
         station_node.lat,
         None,
-        _map_wheelchair(station_node.tags.get('wheelchair')),
+        _map_wheelchair(station_node.tags.get('wheelchair'), diagnostics),
         1,  # A station in GTFS terms
         '')  # Blank values since stations can't contain other stations.
 
 
-def extract_stops(relation, nodes, visited_stop_ids, stop_to_station_map):
+def extract_stops(relation, members, nodes, visited_stop_ids, parent_station,
+                  diagnostics):
     """Extract stops in a relation."""
-    # member_role: stop, halt, platform, terminal, etc.
-    for member_type, member_id, member_role in relation.member_info:
+    nodes = prefetch(nodes, members.stops)
+    # members.stops holds nodes with the stop and halt roles.
+    for member_id in members.stops:
 
-        if member_id not in visited_stop_ids and \
-            member_id in nodes and\
-                member_role in ('stop', 'halt'):
+        if member_id not in visited_stop_ids and member_id in nodes:
 
             location_type = ''
 
@@ -84,15 +104,77 @@ def extract_stops(relation, nodes, visited_stop_ids, stop_to_station_map):
                 member_id,
                 nodes[member_id].tags.get('name') or
                 "Unnamed {} stop.".format(relation.tags.get('route')),
-                nodes[member_id].lon if member_id in nodes else '',
-                nodes[member_id].lat if member_id in nodes else '',
+                nodes[member_id].lon,
+                nodes[member_id].lat,
                 relation.id,
-                _map_wheelchair(nodes[member_id].tags.get('wheelchair')),
+                _map_wheelchair(nodes[member_id].tags.get('wheelchair'),
+                                diagnostics),
                 location_type,
-                stop_to_station_map.get(member_id, ''))
+                parent_station(member_id))
+
+
+def assign_stations(stops, snap_radius, cluster_radius):
+    """Give orphan stops a parent station.
+
+    Orphans are first snapped to the nearest existing station, then the
+    rest are clustered. Clusters of two or more stops, e.g. a platform and
+    its stop_position, get a generated station placed at their centroid.
+    Generated stations use the negated smallest member id as stop_id.
+    """
+    stations = [s for s in stops if s.location_type == 1]
+    orphans = [s for s in stops if s.location_type != 1 and not s.parent_station]
+    parents = {}
+
+    if snap_radius and stations:
+        grid = PointGrid(snap_radius)
+        for station in stations:
+            grid.add(station.stop_id, station.stop_lon, station.stop_lat)
+        for stop in orphans:
+            station_id = grid.nearest(stop.stop_lon, stop.stop_lat)
+            if station_id is not None:
+                parents[stop.stop_id] = station_id
+        orphans = [s for s in orphans if s.stop_id not in parents]
+
+    generated = []
+    if cluster_radius and orphans:
+        by_id = {s.stop_id: s for s in orphans}
+        clusters = cluster_points(
+            [(s.stop_id, s.stop_lon, s.stop_lat) for s in orphans],
+            cluster_radius)
+        for cluster in clusters:
+            if len(cluster) < 2:
+                continue
+            station = _build_cluster_station([by_id[sid] for sid in cluster])
+            generated.append(station)
+            for stop_id in cluster:
+                parents[stop_id] = station.stop_id
+
+    logging.info('Snapped or clustered %d orphan stops, generated %d stations.',
+                 len(parents), len(generated))
+
+    for station in generated:
+        yield station
+    for stop in stops:
+        if stop.stop_id in parents:
+            yield stop._replace(parent_station=parents[stop.stop_id])
+        else:
+            yield stop
+
+
+def _build_cluster_station(stops):
+    names = Counter(s.stop_name for s in stops if not s.stop_name.startswith('Unnamed'))
+    return Stop(
+        -min(s.stop_id for s in stops),
+        names.most_common(1)[0][0] if names else stops[0].stop_name,
+        sum(s.stop_lon for s in stops) / len(stops),
+        sum(s.stop_lat for s in stops) / len(stops),
+        None,
+        0,
+        1,  # A station in GTFS terms
+        '')
 
 
-def _map_wheelchair(osm_value):
+def _map_wheelchair(osm_value, diagnostics):
     if not osm_value:
         return 0
     elif osm_value == 'limited':
@@ -102,5 +184,5 @@ def _map_wheelchair(osm_value):
     elif osm_value == 'no':
         return 2
     else:
-        logging.warning('Unknown OSM wheelchair value %s', osm_value)
+        diagnostics.add('unknown_wheelchair_value', osm_value)
         return 0
@@ -0,0 +1,105 @@
+"""Clip extracted data to a polygon."""
+import json
+from bisect import bisect_right
+
+
+class Polygon(object):
+    """A (multi)polygon with holes, given as a list of closed rings.
+
+    Inclusion uses the even-odd rule, so holes need no special treatment.
+    Edges are bucketed into latitude bands, so a test only crosses the
+    edges of one band instead of every edge of the polygon.
+    """
+    def __init__(self, rings):
+        self.rings = [ring for ring in rings if len(ring) >= 3]
+        if not self.rings:
+            raise ValueError('A polygon needs at least one ring with three points.')
+
+        lons = [lon for ring in self.rings for lon, _ in ring]
+        lats = [lat for ring in self.rings for _, lat in ring]
+        self.bbox = (min(lons), min(lats), max(lons), max(lats))
+
+        edges = []
+        for ring in self.rings:
+            for idx in range(len(ring)):
+                (x1, y1), (x2, y2) = ring[idx - 1], ring[idx]
+                if y1 != y2:
+                    edges.append((x1, y1, x2, y2))
+
+        # About as many bands as there are edges along one side.
+        band_count = max(int(len(edges) ** 0.5), 1)
+        south, north = self.bbox[1], self.bbox[3]
+        self._band_height = (north - south) / band_count or 1.0
+        self._band_starts = [south + idx * self._band_height for idx in range(band_count)]
+        self._bands = [[] for _ in range(band_count)]
+        for edge in edges:
+            low, high = sorted((edge[1], edge[3]))
+            for band in range(self._band(low), self._band(high) + 1):
+                self._bands[band].append(edge)
+
+    def _band(self, lat):
+        return min(max(bisect_right(self._band_starts, lat) - 1, 0), len(self._bands) - 1)
+
+    def contains(self, lon, lat):
+        west, south, east, north = self.bbox
+        if not (west <= lon <= east and south <= lat <= north):
+            return False
+
+        inside = False
+        for x1, y1, x2, y2 in self._bands[self._band(lat)]:
+            if (y1 > lat) != (y2 > lat):
+                if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+    def contains_many(self, points):
+        """Test a batch of (lon, lat) points.
+
+        :return: list of booleans
+        """
+        contains = self.contains
+        return [contains(lon, lat) for lon, lat in points]
+
+
+def load_polygon(path):
+    """Load a polygon from an osmosis `.poly` or a GeoJSON file."""
+    with open(path, encoding='utf-8') as file:
+        content = file.read()
+    if str(path).lower().endswith(('.json', '.geojson')):
+        return Polygon(_geojson_rings(json.loads(content)))
+    return Polygon(_poly_rings(content))
+
+
+def _poly_rings(content):
+    # https://wiki.openstreetmap.org/wiki/Osmosis/Polygon_Filter_File_Format
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    rings = []
+    ring = None
+    # The first line is the name of the polygon.
+    for line in lines[1:]:
+        if ring is None:
+            if line == 'END':
+                break
+            # Section name. Holes start with "!" and are handled by even-odd.
+            ring = []
+        elif line == 'END':
+            rings.append(ring)
+            ring = None
+        else:
+            lon, lat = line.split()[:2]
+            ring.append((float(lon), float(lat)))
+    return rings
+
+
+def _geojson_rings(data):
+    kind = data.get('type')
+    if kind == 'FeatureCollection':
+        return [ring for feature in data['features'] for ring in _geojson_rings(feature)]
+    if kind == 'Feature':
+        return _geojson_rings(data['geometry'])
+    if kind == 'Polygon':
+        return [[tuple(p[:2]) for p in ring] for ring in data['coordinates']]
+    if kind == 'MultiPolygon':
+        return [[tuple(p[:2]) for p in ring]
+                for polygon in data['coordinates'] for ring in polygon]
+    raise ValueError('Unsupported GeoJSON type: {}'.format(kind))
@@ -0,0 +1,156 @@
+"""Conversion of OSM XML inputs to PBF."""
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import subprocess
+
+import osmium as o
+
+
+XML_SUFFIXES = ('.osm', '.osm.bz2', '.osm.gz', '.osm.xml', '.xml')
+
+# Directory of the cached PBF files. O2G_PBF_CACHE replaces it.
+CACHE_DIR = os.getenv('O2G_PBF_CACHE',
+                      os.path.join(tempfile.gettempdir(), 'o2g_pbf_cache'))
+
+# Cached files older than this many seconds are removed.
+CACHE_MAX_AGE = 24 * 3600
+
+# Beyond this many bytes the least recently used files are removed.
+CACHE_MAX_BYTES = int(os.getenv('O2G_PBF_CACHE_BYTES', 4 * 2**30))
+
+# Hits and misses of the PBF cache since the start of the process
+CACHE_STATS = {'hits': 0, 'misses': 0}
+
+
+def is_xml(filename):
+    return str(filename).lower().endswith(XML_SUFFIXES)
+
+
+def worth_converting(filename, passes):
+    """Whether converting to PBF first is cheaper than `passes` XML reads.
+
+    Conversion costs about one XML read. With osmium-tool available it is
+    paid back from the second pass on. The pure Python fallback copies
+    every object through Python and needs one more pass to pay off.
+    """
+    if not is_xml(filename):
+        return False
+    if shutil.which('osmium'):
+        return passes >= 2
+    return passes >= 3
+
+
+class _Copier(o.SimpleHandler):
+    def __init__(self, writer):
+        super(_Copier, self).__init__()
+        self.writer = writer
+
+    def node(self, n):
+        self.writer.add_node(n)
+
+    def way(self, w):
+        self.writer.add_way(w)
+
+    def relation(self, r):
+        self.writer.add_relation(r)
+
+
+def convert_to_pbf(src, dst):
+    """Convert any osmium-readable file to PBF.
+
+    Uses the multithreaded osmium-tool if it is on the PATH and falls back
+    to copying through pyosmium otherwise.
+    """
+    osmium_tool = shutil.which('osmium')
+    if osmium_tool:
+        subprocess.check_call(
+            [osmium_tool, 'cat', '--overwrite', '--no-progress',
+             '--output-format', 'pbf', '-o', dst, src])
+        return
+
+    writer = o.SimpleWriter(dst)
+    try:
+        _Copier(writer).apply_file(src)
+    finally:
+        writer.close()
+
+
+def cached_pbf(filename, cache_dir=None, max_bytes=None):
+    """PBF version of `filename`, converted once and cached.
+
+    Files are keyed by path, size and modification time.
+
+    :param cache_dir: defaults to CACHE_DIR
+    :param max_bytes: size of the cache, defaults to CACHE_MAX_BYTES
+    :return: path of the PBF file and the seconds spent converting
+    """
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+    os.makedirs(cache_dir, exist_ok=True)
+
+    stat = os.stat(filename)
+    key = hashlib.sha1('{}:{}:{}'.format(
+        os.path.abspath(filename), stat.st_size, stat.st_mtime).encode('utf-8'))
+    target = os.path.join(cache_dir, '{}.osm.pbf'.format(key.hexdigest()))
+
+    if os.path.exists(target):
+        CACHE_STATS['hits'] += 1
+        # Keep it from being pruned while in use
+        os.utime(target)
+        _prune(cache_dir, max_bytes, target)
+        logging.debug('Using cached PBF %s for %s', target, filename)
+        return target, 0.0
+
+    CACHE_STATS['misses'] += 1
+    start = time.time()
+    # osmium does not overwrite files, so the partial file must not exist.
+    partial = '{}.{}.partial.osm.pbf'.format(target[:-len('.osm.pbf')], os.getpid())
+    try:
+        convert_to_pbf(filename, partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    elapsed = time.time() - start
+    _prune(cache_dir, max_bytes, target)
+
+    logging.info('Converted %s to PBF in %.2f seconds.', filename, elapsed)
+    return target, elapsed
+
+
+def _prune(cache_dir, max_bytes, keep):
+    """Remove expired files and the least recently used beyond `max_bytes`.
+
+    `keep` and conversions in progress are left alone.
+    """
+    now = time.time()
+    files = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+            if now - stat.st_mtime > CACHE_MAX_AGE:
+                os.remove(path)
+            elif path != keep and '.partial.' not in name:
+                files.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            # Removed by a concurrent process
+            pass
+
+    size = sum(file_size for _, file_size, _ in files)
+    if keep is not None and os.path.exists(keep):
+        size += os.path.getsize(keep)
+    for _, file_size, path in sorted(files):
+        if size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        size -= file_size
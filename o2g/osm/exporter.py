@@ -1,92 +1,335 @@
+import os
+import time
+import shutil
 import logging
+import tempfile
+from collections import OrderedDict
 
+from o2g.diagnostics import Diagnostics
+from o2g.gtfs.gtfs_misc import GTFS_TABLES
+from o2g.osm.index import RelationIndex
+from o2g.osm.extract import is_transit_extract
+from o2g.osm.convert import worth_converting, cached_pbf
+from o2g.osm.formats import sniff_format
+from o2g.osm.store import SqliteStore, prefetch_keys
+from o2g.osm.timezones import TimezoneResolver
 from o2g.osm.handlers import RelationHandler, NodeHandler, WayHandler
 from o2g.osm.builders import build_routes, build_stops, build_agencies,\
     build_shapes
 
 
+# The out-of-core memory budget is split evenly between the relation, node
+# and way stores and the sort of the tables while they are written.
+MEMORY_SHARES = 4
+
+
 class TransitDataExporter(object):
-    def __init__(self, filename):
+    def __init__(self, filename, snap_radius=0, cluster_radius=0,
+                 timezones=True, out_of_core=False, memory_budget=256 * 2**20,
+                 convert_xml=True, tables=None, way_shapes=False,
+                 clip=None, clip_fraction=0.5, stream=None,
+                 inline_way_locations=False, data_format=None):
+        """
+        :param filename: path of the OSM file, or the OSM data itself as
+            bytes or a readable binary file object. Data is read from
+            memory in every pass and never written to disk.
+        :param tables: names of the GTFS tables the caller needs. Passes
+            and builders no requested table depends on are skipped.
+            Defaults to all tables.
+        :param timezones: resolve agency timezones. True creates a
+            TimezoneResolver, which may also be passed in.
+        :param way_shapes: build shapes out of member ways instead of
+            member nodes. Needs the way pass.
+        :param clip: a Polygon. Stops and shape points outside of it are
+            dropped, and so are routes with less than `clip_fraction` of
+            their stops inside.
+        :param out_of_core: keep extracted objects and the node location
+            index on disk, so that memory use stays around `memory_budget`
+            bytes regardless of the size of the input.
+        :param inline_way_locations: ways carry their node locations, as
+            in Overpass `out geom` output. The way pass reads them instead
+            of building a location index.
+        :param data_format: osmium format of in-memory data, e.g. 'pbf'
+            or 'osm.bz2'. Detected from the data by default.
+        :param convert_xml: convert XML inputs to a cached PBF file first
+            when that is cheaper than reading the XML in every pass.
+        """
+        # OSM data passed in memory
+        self.buffer = None
+        if hasattr(filename, 'read'):
+            filename = filename.read()
+        if isinstance(filename, (bytes, bytearray, memoryview)):
+            self.buffer = bytes(filename)
+            data_format = data_format or sniff_format(self.buffer)
+            filename = '<{} buffer>'.format(data_format)
+        self.data_format = data_format
         self.filename = filename
+        self.tables = set(tables or GTFS_TABLES)
+        self.way_shapes = way_shapes
+        self.clip = clip
+        self.clip_fraction = clip_fraction
+        self.stream = stream
+        self.inline_way_locations = inline_way_locations
+        # File actually read by the passes
+        self.source = filename
+        self.convert_xml = convert_xml
+        # Seconds spent per stage
+        self.timings = OrderedDict()
+        # Issues found in the data of this exporter
+        self.diagnostics = Diagnostics()
+        self.snap_radius = snap_radius
+        self.cluster_radius = cluster_radius
+        if timezones is True:
+            timezones = TimezoneResolver()
+        self.timezones = timezones or None
+        self.out_of_core = out_of_core
+        self.memory_budget = memory_budget
+        self.workdir = None
         self.rh = None
         self.nh = None
         self.wh = None
+        self.index = None
+
+    @property
+    def nodes(self):
+        return self.nh.nodes if self.nh else {}
+
+    @property
+    def ways(self):
+        return self.wh.ways if self.wh else {}
 
     @property
     def agencies(self):
-        return build_agencies(self.rh.relations, self.nh.nodes, self.wh.ways)
+        return build_agencies(self.index, self.nodes, self.ways,
+                              self.timezones, self.diagnostics)
 
     @property
     def routes(self):
-        return build_routes(self.rh.relations)
+        return build_routes(self.index)
 
     @property
     def stops(self):
-        return build_stops(self.rh.relations, self.nh.nodes)
+        return build_stops(self.index, self.nodes,
+                           self.snap_radius, self.cluster_radius,
+                           self.diagnostics)
+
+    @property
+    def stop_routes(self):
+        return self.index.stop_routes
 
     @property
     def shapes(self):
-        return build_shapes(self.rh.relations, self.nh.nodes, self.wh.ways)
+        return build_shapes(self.index, self.nodes, self.ways,
+                            self.way_shapes, self.diagnostics)
+
+    def _store(self, name):
+        if not self.out_of_core:
+            return None
+        return SqliteStore(os.path.join(self.workdir, '{}.sqlite'.format(name)),
+                           self.memory_budget // MEMORY_SHARES)
+
+    @property
+    def sort_memory(self):
+        """Bytes of the memory budget the stores leave for sorting tables."""
+        return self.memory_budget - 3 * (self.memory_budget // MEMORY_SHARES)
+
+    def _location_index(self, name):
+        if not self.out_of_core:
+            return 'flex_mem'
+        return 'sparse_file_array,{}'.format(
+            os.path.join(self.workdir, '{}_locations.idx'.format(name)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Remove on-disk stores of the out-of-core mode."""
+        for handler, attr in ((self.rh, 'relations'), (self.nh, 'nodes'),
+                              (self.wh, 'ways')):
+            store = getattr(handler, attr, None)
+            if isinstance(store, SqliteStore):
+                store.close()
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def _apply(self, stage, handler, source=None, **kwargs):
+        start = time.time()
+        if self.buffer is not None and source is None:
+            handler.apply_buffer(self.buffer, self.data_format, **kwargs)
+        else:
+            handler.apply_file(source or self.source, **kwargs)
+        self.timings[stage] = time.time() - start
+
+    def _convert(self, passes):
+        """Switch to a PBF copy of the input if that pays off for `passes`."""
+        # PBF drops the locations on ways unless told otherwise.
+        if self.inline_way_locations or self.buffer is not None:
+            return
+        if self.convert_xml and worth_converting(self.filename, passes):
+            self.source, conversion_time = cached_pbf(self.filename)
+            self.timings['convert'] = conversion_time
+            return conversion_time
+
+    def _process_relations_from_stream(self):
+        """Run the relation pass over the data as it is being downloaded."""
+        start = time.time()
+        try:
+            self.rh.apply_file(self.stream.pipe_path)
+        except Exception:
+            # A failed download shows up as broken data. Report the cause.
+            self.stream.wait()
+            raise
+        self.timings['relations'] = time.time() - start
+
+        start = time.time()
+        self.stream.wait()
+        self.timings['download'] = time.time() - start
+
+    @property
+    def needs_nodes(self):
+        """Whether any requested table needs the node pass."""
+        # Routes are clipped by the share of their stops found inside.
+        if self.clip:
+            return True
+        # Everything but routes, calendar and feedinfo refers to stops or
+        # coordinates. Agencies only need them to resolve timezones.
+        tables = self.tables - {'routes', 'calendar', 'feedinfo'}
+        if not (self.timezones and self.timezones.available):
+            tables.discard('agency')
+        return bool(tables)
+
+    @property
+    def needs_ways(self):
+        """Whether any requested table needs the way pass."""
+        return self.way_shapes and 'shapes' in self.tables
 
     def process(self):
         """Process the files and collect necessary data."""
+        if self.out_of_core and not self.workdir:
+            self.workdir = tempfile.mkdtemp(prefix='o2g_')
+            logging.debug('Out-of-core mode. Working directory: %s', self.workdir)
+
+        passes = 1 + self.needs_nodes + self.needs_ways
+        logging.debug('Tables: %s. Passes: %d.', ', '.join(sorted(self.tables)), passes)
 
         # Extract relations
-        self.rh = RelationHandler()
-        self.rh.apply_file(self.filename)
+        self.rh = RelationHandler(self._store('relations'))
+        if self.stream:
+            self._process_relations_from_stream()
+            passes -= 1
+            conversion_time = self._convert(passes)
+        else:
+            conversion_time = self._convert(passes)
+            self._apply('relations', self.rh)
 
         logging.debug('Found %d public transport relations.', len(self.rh.relations))
 
-        # Collect ids of interest
-        node_ids, stop_node_ids, way_ids, reverse_map = self.__collect_ids()
+        # Index relations once. Ids of interest are collected on the way.
+        self.index = RelationIndex(self.rh.relations)
 
-        # Extract nodes
-        self.nh = NodeHandler(node_ids)
-        self.nh.apply_file(self.filename, locations=True)
+        if self.needs_nodes:
+            self._process_nodes_and_ways()
 
-        count = 0
-        for idx, missing_node_id in enumerate(self.nh.missing_node_ids):
-            count += 1
-            logging.warning(
-                '[no data] missing stop node. rel: https://osm.org/relation/%s node: https://osm.org/node/%s.',
-                reverse_map[missing_node_id], missing_node_id)
+        if conversion_time is not None:
+            self._report_conversion(conversion_time, passes)
+
+    def _process_nodes_and_ways(self):
+        # Transit-only extracts are small and contain every node of their
+        # ways, so node locations are collected in the node pass instead
+        # of building osmium's location index.
+        # Headers of in-memory data are not checked. PBF copies of the
+        # input have headers of their own.
+        transit_extract = (self.needs_ways and self.buffer is None
+                           and is_transit_extract(self.filename))
+        if transit_extract:
+            logging.debug('%s is a transit extract.', self.filename)
+
+        # Extract nodes. Nodes carry their own locations, so this pass
+        # never needs a location index.
+        self.nh = NodeHandler(self.index.node_ids, self._store('nodes'),
+                              keep_locations=transit_extract, clip=self.clip,
+                              diagnostics=self.diagnostics)
+        self._apply('nodes', self.nh)
 
-        if count:
+        missing_node_ids = list(self.nh.missing_node_ids)
+        # Only the examples are looked up in the relations.
+        examples = missing_node_ids[:self.diagnostics.max_examples]
+        reverse_map = self.index.relations_of_nodes(examples)
+        self.diagnostics.add_many(
+            'missing_node', len(missing_node_ids),
+            ['node/{} in relation/{}'.format(node_id, reverse_map[node_id])
+             for node_id in examples])
+
+        if missing_node_ids:
             logging.warning(
                 '%d nodes that appear in relations are missing.',
-                count)
+                len(missing_node_ids))
         else:
             logging.debug('Lucky you! All relation member nodes were found.')
 
+        if self.clip:
+            self._clip_routes()
+
+        if not self.needs_ways:
+            return
+
         # Extract ways
-        self.wh = WayHandler(way_ids)
-        self.wh.apply_file(self.filename, locations=True)
-
-    def __collect_ids(self):
-        node_ids = set()
-        stop_node_ids = set()
-        way_ids = set()
-        reverse_map = {}
-
-        for rel in self.rh.relations.values():
-            for mtype, ref, role in rel.member_info:
-                reverse_map[ref] = rel.id
-
-                if mtype in ['n', 'node']:
-                    node_ids.add(ref)
-                    if role in ['stop', 'halt', 'platform']:
-                        stop_node_ids.add(ref)
-
-                elif mtype in ['w', 'way']:
-                    way_ids.add(ref)
-
-                elif mtype in ['r', 'relation']:
-                    logging.warning(
-                        '[Rel: %s]: super-relations are not supported yet. ref: %s',
-                        rel.id, ref)
-                else:
-                    logging.warning(
-                        '[Rel: %s]: unknown member type %s, ref: %s',
-                        rel.id, mtype, ref)
-
-        return node_ids, stop_node_ids, way_ids, reverse_map
+        self.wh = WayHandler(self.index.way_ids, self._store('ways'),
+                             locations=self.nh.locations, clip=self.clip,
+                             diagnostics=self.diagnostics)
+        if transit_extract or self.inline_way_locations:
+            self._apply('ways', self.wh)
+        else:
+            self._apply('ways', self.wh, locations=True,
+                        idx=self._location_index('ways'))
+
+    def _clip_routes(self):
+        """Drop routes mostly outside of the clip polygon.
+
+        Stops outside of the polygon never made it into the node store, so
+        the share of a route's stops found there is the share inside.
+        """
+        nodes = self.nh.nodes
+        found = prefetch_keys(nodes, self.index.node_ids)
+        dropped = set()
+        for rel in self.index.routes:
+            members = self.index.members[rel.id]
+            refs = members.stops or members.nodes
+            inside = sum(1 for ref in refs if ref in found)
+            if not refs or inside < self.clip_fraction * len(refs):
+                dropped.add(rel.id)
+
+        # Re-index without them, so that their ways are never read.
+        self.index = RelationIndex(self.rh.relations, exclude=dropped)
+
+        # Forget nodes only the dropped routes referred to.
+        if isinstance(nodes, dict):
+            for node_id in [nid for nid in nodes if nid not in self.index.node_ids]:
+                del nodes[node_id]
+
+        logging.info('Clipping dropped %d nodes and %d of %d routes.',
+                     len(self.nh.clipped_node_ids), len(dropped),
+                     len(dropped) + len(self.index.routes))
+
+    def _report_conversion(self, conversion_time, passes):
+        """Log the time the PBF conversion took and saved.
+
+        Reading the XML once costs about as much as converting it, so the
+        XML passes we avoided are estimated with the conversion time.
+        """
+        stages = ('nodes', 'ways') if self.stream else ('relations', 'nodes', 'ways')
+        pbf_time = sum(self.timings[stage] for stage in stages
+                       if stage in self.timings)
+        if not conversion_time:
+            logging.info('PBF cache hit. %d passes took %.2f seconds.',
+                         passes, pbf_time)
+            return
+        saved = conversion_time * passes - pbf_time - conversion_time
+        logging.info('Converting to PBF took %.2f seconds, %d passes over PBF '
+                     'took %.2f seconds. Estimated time saved: %.2f seconds.',
+                     conversion_time, passes, pbf_time, saved)
+
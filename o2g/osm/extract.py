@@ -0,0 +1,89 @@
+"""Write transit-only OSM extracts."""
+import logging
+
+import osmium as o
+
+from o2g import __version__
+from o2g.osm.index import RelationIndex
+from o2g.osm.handlers import RelationHandler
+
+
+# Start of the generator in the header of files written by
+# `extract_transit`. PBF headers drop options other than the generator.
+TRANSIT_EXTRACT_GENERATOR = 'o2g transit extract'
+
+
+class WayNodeCollector(o.SimpleHandler):
+    """Collect node references of the given ways."""
+    def __init__(self, way_ids):
+        super(WayNodeCollector, self).__init__()
+        self.way_ids = way_ids
+        self.node_ids = set()
+
+    def way(self, w):
+        if w.id in self.way_ids:
+            self.node_ids.update(n.ref for n in w.nodes)
+
+
+class TransitCopier(o.SimpleHandler):
+    """Copy the objects with the given ids to a writer."""
+    def __init__(self, writer, node_ids, way_ids, relation_ids):
+        super(TransitCopier, self).__init__()
+        self.writer = writer
+        self.node_ids = node_ids
+        self.way_ids = way_ids
+        self.relation_ids = relation_ids
+
+    def node(self, n):
+        if n.id in self.node_ids:
+            self.writer.add_node(n)
+
+    def way(self, w):
+        if w.id in self.way_ids:
+            self.writer.add_way(w)
+
+    def relation(self, r):
+        if r.id in self.relation_ids:
+            self.writer.add_relation(r)
+
+
+def extract_transit(infile, outfile):
+    """Write transit relations of `infile` and their members to `outfile`.
+
+    Relations are selected with the criteria of RelationHandler. All member
+    nodes, member ways and the nodes of those ways are kept, nodes with
+    their locations. The output is marked in its header so that
+    TransitDataExporter can tell it apart from a full extract.
+
+    :return: number of selected nodes, ways and relations as a tuple
+    """
+    rh = RelationHandler()
+    rh.apply_file(infile)
+    index = RelationIndex(rh.relations)
+
+    collector = WayNodeCollector(index.way_ids)
+    collector.apply_file(infile)
+    node_ids = index.node_ids | collector.node_ids
+
+    header = o.io.Header()
+    header.set('generator', '{} {}'.format(TRANSIT_EXTRACT_GENERATOR, __version__))
+
+    writer = o.SimpleWriter(outfile, bufsz=4096 * 1024, header=header)
+    try:
+        copier = TransitCopier(writer, node_ids, index.way_ids, set(rh.relations.keys()))
+        copier.apply_file(infile)
+    finally:
+        writer.close()
+
+    logging.info('Wrote %d relations, %d ways and %d nodes to %s.',
+                 len(rh.relations), len(index.way_ids), len(node_ids), outfile)
+    return len(node_ids), len(index.way_ids), len(rh.relations)
+
+
+def is_transit_extract(filename):
+    """Whether the file was written by `extract_transit`."""
+    reader = o.io.Reader(filename, o.osm.osm_entity_bits.NOTHING)
+    try:
+        return reader.header().get('generator').startswith(TRANSIT_EXTRACT_GENERATOR)
+    finally:
+        reader.close()
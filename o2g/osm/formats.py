@@ -0,0 +1,25 @@
+"""Detection of the format of OSM data held in memory."""
+
+
+# A PBF file starts with the length of the first blob header, followed by
+# the header itself with the type of its blob: field 1, a string of length 9.
+PBF_HEADER = b'\n\tOSMHeader'
+
+# Compressed XML by magic number
+COMPRESSED_XML = ((b'\x1f\x8b', 'osm.gz'),
+                  (b'BZh', 'osm.bz2'))
+
+
+def sniff_format(data):
+    """osmium format string of the OSM data in `data`.
+
+    Recognizes PBF and plain, gzipped or bzip2ed XML. Anything else is
+    taken for XML and left for osmium to complain about.
+    """
+    head = bytes(data[:16])
+    if head[4:].startswith(PBF_HEADER):
+        return 'pbf'
+    for magic, data_format in COMPRESSED_XML:
+        if head.startswith(magic):
+            return data_format
+    return 'osm'
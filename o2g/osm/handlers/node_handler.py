@@ -1,34 +1,55 @@
-import logging
-
 import osmium as o
 
-from o2g.osm.models import Node
+from o2g.diagnostics import Diagnostics
+from o2g.osm.models import Node, Point
+from o2g.osm.store import prefetch_keys
 
 
 class NodeHandler(o.SimpleHandler):
-    def __init__(self, node_ids):
+    def __init__(self, node_ids, store=None, keep_locations=False, clip=None,
+                 diagnostics=None):
+        """
+        :param keep_locations: remember the location of every node, not only
+            of those in `node_ids`. Meant for small transit-only files, where
+            it replaces osmium's location index for the way pass.
+        :param clip: a Polygon. Nodes outside of it are dropped.
+        :param diagnostics: Diagnostics counting the issues found
+        """
         super(NodeHandler, self).__init__()
         self.node_ids = node_ids
-        self.nodes = {}
+        self.nodes = store if store is not None else {}
+        self.locations = {} if keep_locations else None
+        self.clip = clip
+        self.clipped_node_ids = set()
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
 
     @property
     def missing_node_ids(self):
         """Get a list of nodes not found in OSM data."""
-        present_node_ids = self.nodes.keys()
+        found = prefetch_keys(self.nodes, self.node_ids)
         for nid in self.node_ids:
-            if nid not in present_node_ids:
+            if nid not in found and nid not in self.clipped_node_ids:
                 yield nid
 
     def node(self, n):
         """Process each node."""
+        if self.locations is not None:
+            try:
+                self.locations[n.id] = Point(n.location.lon, n.location.lat)
+            except o.InvalidLocationError:
+                pass
+
         if n.id not in self.node_ids:
             return
 
         try:
+            if self.clip and not self.clip.contains(n.location.lon, n.location.lat):
+                self.clipped_node_ids.add(n.id)
+                return
             self.nodes[n.id] =\
               Node(n.id,
                    n.location.lon,
                    n.location.lat,
                    {t.k: t.v for t in n.tags})
         except o.InvalidLocationError:
-            logging.debug('InvalidLocationError at node %s', n.id)
+            self.diagnostics.add('invalid_node_location', n.id, 'node/{}')
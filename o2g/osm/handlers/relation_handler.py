@@ -4,9 +4,9 @@ from o2g.osm.models import Relation
 
 
 class RelationHandler(o.SimpleHandler):
-    def __init__(self):
+    def __init__(self, store=None):
         super(RelationHandler, self).__init__()
-        self.relations = {}
+        self.relations = store if store is not None else {}
         self.versions = {}
 
     @property
@@ -1,14 +1,24 @@
-import logging
 import osmium as o
 
+from o2g.diagnostics import Diagnostics
 from o2g.osm.models import Way, Point
 
 
 class WayHandler(o.SimpleHandler):
-    def __init__(self, way_ids):
+    def __init__(self, way_ids, store=None, locations=None, clip=None,
+                 diagnostics=None):
+        """
+        :param locations: map of node id to Point used instead of the node
+            locations osmium attaches to ways.
+        :param clip: a Polygon. Way points outside of it are dropped.
+        :param diagnostics: Diagnostics counting the issues found
+        """
         super(WayHandler, self).__init__()
         self.way_ids = way_ids
-        self.ways = {}
+        self.ways = store if store is not None else {}
+        self.locations = locations
+        self.clip = clip
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
 
     def way(self, w):
         """Process each way."""
@@ -16,10 +26,27 @@ class WayHandler(o.SimpleHandler):
             return
 
         way_points = []
+        if self.locations is not None:
+            for n in w.nodes:
+                point = self.locations.get(n.ref)
+                if point:
+                    way_points.append(point)
+                else:
+                    self.diagnostics.add('missing_way_location', w.id, 'way/{}')
+            self._add_way(w.id, way_points)
+            return
+
         for n in w.nodes:
             try:
                 way_points.append(Point(n.location.lon, n.location.lat))
             except o.InvalidLocationError:
-                logging.debug('InvalidLocationError at way %s node %s', w.id, n.ref)
+                self.diagnostics.add('missing_way_location', w.id, 'way/{}')
+
+        self._add_way(w.id, way_points)
 
-        self.ways[w.id] = Way(w.id, way_points)
+    def _add_way(self, way_id, way_points):
+        if self.clip:
+            way_points = [point for point, inside in
+                          zip(way_points, self.clip.contains_many(way_points))
+                          if inside]
+        self.ways[way_id] = Way(way_id, way_points)
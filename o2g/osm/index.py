@@ -0,0 +1,193 @@
+"""Lookups over extracted relations shared by all builders."""
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+
+
+# Members of one relation grouped by type and role. Every field is a tuple
+# of member ids in the order they appear in the relation.
+RelationMembers = namedtuple('RelationMembers', [
+    'nodes',
+    'ways',
+    'stops',
+    'platforms'])
+
+
+STOP_ROLES = ('stop', 'halt')
+PLATFORM_ROLES = ('platform',)
+
+
+def agency_id_from_operator(operator):
+    """Construct an agency id out of an operator name."""
+    return int(hashlib.sha256(operator.encode('utf-8')).hexdigest(), 16) % 10**8
+
+
+class RelationIndex(object):
+    """Index built once after the relation pass.
+
+    Partitions route relations from stop_area relations, groups members by
+    type and role and resolves operators to agency ids, so that builders
+    do not have to walk `member_info` over and over again.
+    """
+    def __init__(self, relations, exclude=()):
+        """
+        :param exclude: ids of relations to leave out of the index
+        """
+        self.relations = relations
+        self.routes = []
+        self.stop_areas = []
+        self.members = {}
+        self.node_ids = set()
+        self.way_ids = set()
+
+        # operator -> (agency_id, first relation with that operator)
+        self.operators = OrderedDict()
+        # stop node id -> id of the stop_area relation containing it
+        self.stop_area_of = {}
+
+        for rel in relations.values():
+            if rel.id not in exclude:
+                self._add(rel)
+
+        # Many-to-many stop <-> route lookups
+        self.stop_routes = StopRouteIndex(
+            (rel.id, self.members[rel.id].stops) for rel in self.routes)
+
+    def _add(self, rel):
+        nodes = []
+        ways = []
+        stops = []
+        platforms = []
+
+        for mtype, ref, role in rel.member_info:
+            if mtype in ['n', 'node']:
+                nodes.append(ref)
+                if role in STOP_ROLES:
+                    stops.append(ref)
+                elif role in PLATFORM_ROLES:
+                    platforms.append(ref)
+
+            elif mtype in ['w', 'way']:
+                ways.append(ref)
+
+            elif mtype in ['r', 'relation']:
+                logging.warning(
+                    '[Rel: %s]: super-relations are not supported yet. ref: %s',
+                    rel.id, ref)
+            else:
+                logging.warning(
+                    '[Rel: %s]: unknown member type %s, ref: %s',
+                    rel.id, mtype, ref)
+
+        self.members[rel.id] = \
+            RelationMembers(tuple(nodes), tuple(ways), tuple(stops), tuple(platforms))
+        self.node_ids.update(nodes)
+        self.way_ids.update(ways)
+
+        op = rel.tags.get('operator')
+        if op and op not in self.operators:
+            self.operators[op] = (agency_id_from_operator(op), rel)
+
+        if rel.tags.get('public_transport') == 'stop_area':
+            self.stop_areas.append(rel)
+            for ref in nodes:
+                self.stop_area_of[ref] = rel.id
+        elif rel.tags.get('type') == 'route':
+            self.routes.append(rel)
+
+    def agency_id(self, relation):
+        """Agency id of the given relation or -1 if it has no operator."""
+        op = relation.tags.get('operator')
+        if op:
+            return self.operators[op][0]
+        return -1
+
+    def routes_of_stop(self, stop_id):
+        """Ids of the route relations visiting the given stop."""
+        return self.stop_routes.routes_of_stop(stop_id)
+
+    def relations_of_nodes(self, node_ids):
+        """Map each of the given node ids to a relation containing it.
+
+        This walks all members once and is meant for reporting only.
+        """
+        node_ids = set(node_ids)
+        found = {}
+        for rel_id, members in self.members.items():
+            for ref in members.nodes:
+                if ref in node_ids:
+                    found[ref] = rel_id
+        return found
+
+
+class StopRouteIndex(object):
+    """Compact many-to-many index between stops and routes.
+
+    Stops of every route are kept in their original order in one flat array
+    with per-route offsets. The inverse direction is stored the same way: a
+    sorted array of stop ids with offsets into a flat array of route
+    positions. Dense networks, where dozens of routes share a stop, cost
+    a few machine words per visit instead of a list per stop.
+    """
+    def __init__(self, route_stops):
+        """Build the index.
+
+        :param route_stops: iterable of (route_id, stop ids in visiting order)
+        """
+        self.route_ids = array('q')
+        self._route_pos = {}
+        self._stop_offsets = array('q', [0])
+        self._stops = array('q')
+
+        for route_id, stop_ids in route_stops:
+            self._route_pos[route_id] = len(self.route_ids)
+            self.route_ids.append(route_id)
+            self._stops.extend(stop_ids)
+            self._stop_offsets.append(len(self._stops))
+
+        # Inverted index, filled with a counting sort over the stop ids.
+        self.stop_ids = array('q', sorted(set(self._stops)))
+        counts = array('q', bytes(8 * (len(self.stop_ids) + 1)))
+        positions = array('q', bytes(8 * len(self._stops)))
+        for idx, stop_id in enumerate(self._stops):
+            pos = bisect_left(self.stop_ids, stop_id)
+            positions[idx] = pos
+            counts[pos + 1] += 1
+        for pos in range(len(self.stop_ids)):
+            counts[pos + 1] += counts[pos]
+        self._route_offsets = array('q', counts)
+
+        self._routes = array('q', bytes(8 * len(self._stops)))
+        fill = counts
+        for route_pos in range(len(self.route_ids)):
+            start, end = self._stop_offsets[route_pos], self._stop_offsets[route_pos + 1]
+            for idx in range(start, end):
+                pos = positions[idx]
+                # Routes visiting a stop more than once are listed once.
+                first = self._route_offsets[pos]
+                if fill[pos] > first and self._routes[fill[pos] - 1] == route_pos:
+                    continue
+                self._routes[fill[pos]] = route_pos
+                fill[pos] += 1
+        # Slots left by skipped revisits stay unused; remember the real ends.
+        self._route_ends = fill
+
+    def __len__(self):
+        return len(self.route_ids)
+
+    def stops_of_route(self, route_id):
+        """Stop ids of the given route in visiting order."""
+        route_pos = self._route_pos.get(route_id)
+        if route_pos is None:
+            return array('q')
+        return self._stops[self._stop_offsets[route_pos]:self._stop_offsets[route_pos + 1]]
+
+    def routes_of_stop(self, stop_id):
+        """Ids of the routes visiting the given stop."""
+        pos = bisect_left(self.stop_ids, stop_id)
+        if pos == len(self.stop_ids) or self.stop_ids[pos] != stop_id:
+            return []
+        return [self.route_ids[route_pos] for route_pos in
+                self._routes[self._route_offsets[pos]:self._route_ends[pos]]]
@@ -28,7 +28,7 @@ Stop = namedtuple('Stop', [
     'stop_name',
     'stop_lon',
     'stop_lat',
-    'route_id',  # TODO: remove route_id. A stop could belong to many routes.
+    'route_id',  # First route visiting the stop. See StopRouteIndex for all of them.
     'wheelchair_boarding',
     'location_type',
     'parent_station'])
@@ -0,0 +1,97 @@
+"""Spatial lookups over stop coordinates."""
+from math import cos, floor, radians, sqrt
+
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111320.0
+
+
+def distance(lon1, lat1, lon2, lat2):
+    """Equirectangular distance in meters. Accurate enough for short ranges."""
+    x = radians(lon2 - lon1) * cos(radians((lat1 + lat2) / 2))
+    y = radians(lat2 - lat1)
+    return sqrt(x * x + y * y) * 6371000
+
+
+class PointGrid(object):
+    """Uniform grid of points, roughly `cell_size` meters per cell.
+
+    Rows are bands of constant latitude. Every row uses a longitude width
+    wide enough for its most poleward edge, so the 3x3 block of cells
+    around a point covers at least `cell_size` meters in all directions.
+    Insertion and queries are constant time on average, which avoids
+    pairwise comparisons between all points.
+    """
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._dlat = cell_size / METERS_PER_DEGREE
+        self._cells = {}
+        self._dlons = {}
+
+    def _dlon(self, row):
+        dlon = self._dlons.get(row)
+        if dlon is None:
+            edge_lat = max(abs(row * self._dlat), abs((row + 1) * self._dlat))
+            dlon = min(self._dlat / max(cos(radians(min(edge_lat, 90))), 1e-6), 360)
+            self._dlons[row] = dlon
+        return dlon
+
+    def _cell(self, lon, lat):
+        row = int(floor(lat / self._dlat))
+        return row, int(floor(lon / self._dlon(row)))
+
+    def add(self, key, lon, lat):
+        self._cells.setdefault(self._cell(lon, lat), []).append((key, lon, lat))
+
+    def neighbours(self, lon, lat, radius=None):
+        """Yield (key, distance) of every point within `radius` meters.
+
+        `radius` may not exceed the cell size and defaults to it.
+        """
+        if radius is None:
+            radius = self.cell_size
+        row = int(floor(lat / self._dlat))
+        for r in (row - 1, row, row + 1):
+            col = int(floor(lon / self._dlon(r)))
+            for c in (col - 1, col, col + 1):
+                for key, other_lon, other_lat in self._cells.get((r, c), ()):
+                    dist = distance(lon, lat, other_lon, other_lat)
+                    if dist <= radius:
+                        yield key, dist
+
+    def nearest(self, lon, lat, radius=None):
+        """Key of the nearest point within `radius` meters or None."""
+        best = None
+        best_dist = None
+        for key, dist in self.neighbours(lon, lat, radius):
+            if best_dist is None or dist < best_dist:
+                best, best_dist = key, dist
+        return best
+
+
+def cluster_points(points, radius):
+    """Group points within `radius` meters of a seed point.
+
+    Points are taken in order. The first one not in a cluster yet seeds a
+    new cluster of every free point within `radius` meters of it, so no
+    cluster spans more than twice the radius. Merging transitively would
+    chain a row of evenly spaced stops into one cluster.
+
+    :param points: list of (key, lon, lat)
+    :return: list of clusters, each a list of keys, singletons included
+    """
+    grid = PointGrid(radius)
+    for idx, (_, lon, lat) in enumerate(points):
+        grid.add(idx, lon, lat)
+
+    clustered = [False] * len(points)
+    clusters = []
+    for idx, (key, lon, lat) in enumerate(points):
+        if clustered[idx]:
+            continue
+        members = [other for other, _ in grid.neighbours(lon, lat)
+                   if not clustered[other]]
+        for other in members:
+            clustered[other] = True
+        clusters.append([points[other][0] for other in sorted(members)])
+    return clusters
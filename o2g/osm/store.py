@@ -0,0 +1,175 @@
+"""Keyed stores for extracted OSM objects."""
+import pickle
+import sqlite3
+from collections import OrderedDict
+
+
+# Rough size of one pickled node, way or relation including overhead.
+# Used to turn a memory budget in bytes into a number of objects.
+APPROX_OBJECT_SIZE = 512
+
+# Number of ids per SELECT when reading in batches
+BATCH_SIZE = 500
+
+
+class SqliteStore(object):
+    """On-disk store with the mapping interface of the handlers' dicts.
+
+    Writes are buffered and flushed in sorted batches. Reads go through a
+    bounded LRU cache. Together they keep memory use within `memory_budget`
+    bytes no matter how many objects are stored.
+    """
+    def __init__(self, path, memory_budget=64 * 2**20):
+        self.path = path
+        self.memory_budget = memory_budget
+        self._max_items = max(memory_budget // APPROX_OBJECT_SIZE // 2, BATCH_SIZE)
+        self._pending = {}
+        self._cache = OrderedDict()
+
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS objects (id INTEGER PRIMARY KEY, value BLOB)')
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._db.executemany(
+            'INSERT OR REPLACE INTO objects VALUES (?, ?)',
+            ((key, pickle.dumps(self._pending[key], pickle.HIGHEST_PROTOCOL))
+             for key in sorted(self._pending)))
+        self._db.commit()
+        self._pending.clear()
+
+    def close(self):
+        self._pending.clear()
+        self._cache.clear()
+        self._db.close()
+
+    def _remember(self, key, value):
+        self._cache[key] = value
+        if len(self._cache) > self._max_items:
+            self._cache.popitem(last=False)
+
+    def __setitem__(self, key, value):
+        self._pending[key] = value
+        self._cache.pop(key, None)
+        if len(self._pending) >= self._max_items:
+            self.flush()
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        row = self._db.execute(
+            'SELECT value FROM objects WHERE id = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value = pickle.loads(row[0])
+        self._remember(key, value)
+        return value
+
+    def __contains__(self, key):
+        if key in self._pending or key in self._cache:
+            return True
+        return self._db.execute(
+            'SELECT 1 FROM objects WHERE id = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        self.flush()
+        return self._db.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+
+    def __iter__(self):
+        return self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_many(self, keys):
+        """Fetch the given keys in sorted batches. Missing keys are skipped.
+
+        :return: dict of key to value
+        """
+        self.flush()
+        found = {}
+        wanted = sorted(set(keys))
+        for start in range(0, len(wanted), BATCH_SIZE):
+            batch = wanted[start:start + BATCH_SIZE]
+            rows = self._db.execute(
+                'SELECT id, value FROM objects WHERE id IN ({})'.format(
+                    ','.join('?' * len(batch))), batch)
+            for key, value in rows:
+                found[key] = pickle.loads(value)
+        return found
+
+    def contains_many(self, keys):
+        """The given keys that are stored, looked up in sorted batches.
+
+        :return: set of keys
+        """
+        self.flush()
+        found = set()
+        wanted = sorted(set(keys))
+        for start in range(0, len(wanted), BATCH_SIZE):
+            batch = wanted[start:start + BATCH_SIZE]
+            rows = self._db.execute(
+                'SELECT id FROM objects WHERE id IN ({})'.format(
+                    ','.join('?' * len(batch))), batch)
+            found.update(row[0] for row in rows)
+        return found
+
+    def keys(self):
+        self.flush()
+        for row in self._db.execute('SELECT id FROM objects ORDER BY id'):
+            yield row[0]
+
+    def items(self):
+        """Iterate over all objects sorted by id, one batch at a time."""
+        self.flush()
+        last = None
+        while True:
+            if last is None:
+                rows = self._db.execute(
+                    'SELECT id, value FROM objects ORDER BY id LIMIT ?',
+                    (BATCH_SIZE,)).fetchall()
+            else:
+                rows = self._db.execute(
+                    'SELECT id, value FROM objects WHERE id > ? ORDER BY id LIMIT ?',
+                    (last, BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for key, value in rows:
+                yield key, pickle.loads(value)
+            last = rows[-1][0]
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+
+def prefetch(store, keys):
+    """Mapping of the given keys for random access by the builders.
+
+    Plain dicts are returned as they are. On-disk stores are read in one
+    sorted batch instead of one query per key.
+    """
+    if isinstance(store, dict):
+        return store
+    return store.get_many(keys)
+
+
+def prefetch_keys(store, keys):
+    """Container of the given keys that are stored, to test membership.
+
+    Like `prefetch`, without reading the values.
+    """
+    if isinstance(store, dict):
+        return store
+    return store.contains_many(keys)
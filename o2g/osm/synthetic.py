@@ -0,0 +1,162 @@
+"""Generate synthetic OSM transit networks for scaling tests."""
+import random
+from collections import namedtuple
+
+import osmium as o
+from osmium.osm.mutable import Node, Way, Relation
+
+
+# Size of a synthetic network. Every route relation visits `stops_per_route`
+# stop nodes and `ways_per_route` ways with `nodes_per_way` nodes each.
+NetworkSize = namedtuple('NetworkSize', [
+    'routes',
+    'stop_areas',
+    'stops',
+    'stops_per_route',
+    'ways_per_route',
+    'nodes_per_way',
+    'background_nodes',
+    'background_ways'])
+
+
+ROUTE_TYPES = ['bus', 'tram', 'light_rail', 'subway', 'rail']
+
+
+def network_size(routes, background_factor=10):
+    """Derive a plausible network size from the number of routes.
+
+    The background is scaled so that transit data stays a small fraction
+    of the file, as it is in real extracts.
+    """
+    stops = max(routes * 8, 2)
+    ways_per_route = 10
+    nodes_per_way = 8
+    transit_nodes = stops + routes * ways_per_route * nodes_per_way
+    return NetworkSize(
+        routes=routes,
+        stop_areas=max(stops // 4, 1),
+        stops=stops,
+        stops_per_route=min(20, stops),
+        ways_per_route=ways_per_route,
+        nodes_per_way=nodes_per_way,
+        background_nodes=transit_nodes * background_factor,
+        background_ways=transit_nodes * background_factor // 10)
+
+
+def write_network(filename, size, seed=0, bbox=(7.7066, 47.9485, 8.0049, 48.1161)):
+    """Write a synthetic transit network to `filename`.
+
+    The output format is deduced from the file extension by osmium, so both
+    `.osm` and `.osm.pbf` work. Objects are written sorted by type and id.
+
+    :param size: a NetworkSize namedtuple
+    :param bbox: west, south, east, north bounds of generated coordinates
+    :return: number of written nodes, ways and relations as a tuple
+    """
+    rnd = random.Random(seed)
+    west, south, east, north = bbox
+
+    def location():
+        return (rnd.uniform(west, east), rnd.uniform(south, north))
+
+    next_id = [1]
+
+    def new_id():
+        next_id[0] += 1
+        return next_id[0]
+
+    writer = o.SimpleWriter(filename)
+    nodes = ways = relations = 0
+    try:
+        # Stop nodes. The first stop of every stop_area is the station.
+        stop_ids = []
+        for idx in range(size.stops):
+            nid = new_id()
+            stop_ids.append(nid)
+            tags = {'public_transport': 'stop_position',
+                    'name': 'Stop {}'.format(idx)}
+            if idx % 4 == 0:
+                tags['public_transport'] = 'station'
+                tags['wheelchair'] = rnd.choice(['yes', 'no', 'limited'])
+            writer.add_node(Node(id=nid, version=1, visible=True,
+                                 location=location(), tags=tags))
+            nodes += 1
+
+        # Way nodes of route ways, kept in memory only as ids.
+        route_ways = []
+        for _ in range(size.routes * size.ways_per_route):
+            way_node_ids = []
+            lon, lat = location()
+            for _ in range(size.nodes_per_way):
+                nid = new_id()
+                lon += rnd.uniform(-0.001, 0.001)
+                lat += rnd.uniform(-0.001, 0.001)
+                writer.add_node(Node(id=nid, version=1, visible=True,
+                                     location=(lon, lat)))
+                way_node_ids.append(nid)
+                nodes += 1
+            route_ways.append(way_node_ids)
+
+        # Unrelated background nodes, e.g. buildings and street furniture.
+        background_node_ids = []
+        for _ in range(size.background_nodes):
+            nid = new_id()
+            writer.add_node(Node(id=nid, version=1, visible=True,
+                                 location=location(),
+                                 tags={'amenity': 'bench'}))
+            background_node_ids.append(nid)
+            nodes += 1
+
+        route_way_ids = []
+        for way_node_ids in route_ways:
+            wid = new_id()
+            writer.add_way(Way(id=wid, version=1, visible=True,
+                               nodes=way_node_ids,
+                               tags={'highway': 'primary'}))
+            route_way_ids.append(wid)
+            ways += 1
+
+        for _ in range(size.background_ways):
+            if len(background_node_ids) < 2:
+                break
+            start = rnd.randrange(len(background_node_ids) - 1)
+            writer.add_way(Way(id=new_id(), version=1, visible=True,
+                               nodes=background_node_ids[start:start + 5],
+                               tags={'highway': 'residential'}))
+            ways += 1
+
+        # Route relations visit a contiguous run of stops, so neighbouring
+        # routes share stops just like lines through a city centre do.
+        for idx in range(size.routes):
+            start = rnd.randrange(max(size.stops - size.stops_per_route, 0) + 1)
+            members = [('n', sid, 'stop')
+                       for sid in stop_ids[start:start + size.stops_per_route]]
+            first_way = idx * size.ways_per_route
+            members.extend(
+                ('w', wid, '')
+                for wid in route_way_ids[first_way:first_way + size.ways_per_route])
+            writer.add_relation(Relation(
+                id=new_id(), version=1, visible=True, members=members,
+                tags={'type': 'route',
+                      'route': rnd.choice(ROUTE_TYPES),
+                      'ref': str(idx),
+                      'name': 'Line {}'.format(idx),
+                      'from': 'Stop {}'.format(start),
+                      'to': 'Stop {}'.format(start + size.stops_per_route - 1),
+                      'operator': 'Operator {}'.format(idx % 7)}))
+            relations += 1
+
+        for idx in range(size.stop_areas):
+            members = [('n', sid, '') for sid in stop_ids[idx * 4:idx * 4 + 4]]
+            if not members:
+                break
+            writer.add_relation(Relation(
+                id=new_id(), version=1, visible=True, members=members,
+                tags={'type': 'public_transport',
+                      'public_transport': 'stop_area',
+                      'name': 'Stop area {}'.format(idx)}))
+            relations += 1
+    finally:
+        writer.close()
+
+    return nodes, ways, relations
@@ -0,0 +1,71 @@
+"""Offline timezone lookups."""
+import logging
+from math import floor
+
+try:
+    from timezonefinder import TimezoneFinder
+except ImportError:
+    TimezoneFinder = None
+
+
+class TimezoneResolver(object):
+    """Resolve coordinates to timezone names without network access.
+
+    Lookups go to timezonefinder's precomputed polygon index and are
+    memoized per grid cell of `cell_size` degrees, so a whole city costs a
+    handful of polygon tests. A cell is only memoized if its corners are in
+    the same timezone. Points in cells on a border are looked up one by
+    one. Without timezonefinder every lookup yields ''.
+
+    The index is only loaded by the first lookup.
+    """
+    def __init__(self, cell_size=0.05, finder=None):
+        self.cell_size = cell_size
+        self.hits = 0
+        self.misses = 0
+        # Cell to timezone, None for cells on a border
+        self._cells = {}
+        self._finder = finder
+
+        if not self.available:
+            logging.info('timezonefinder is not installed. '
+                         'Agency timezones will be left empty.')
+
+    @property
+    def available(self):
+        """Whether lookups can find timezones at all."""
+        return self._finder is not None or TimezoneFinder is not None
+
+    def _lookup(self, lon, lat):
+        if self._finder is None:
+            self._finder = TimezoneFinder(in_memory=True)
+        return self._finder.timezone_at(lng=lon, lat=lat) or ''
+
+    def _corners_agree(self, cell, timezone):
+        west, south = cell[0] * self.cell_size, cell[1] * self.cell_size
+        east, north = west + self.cell_size, south + self.cell_size
+        return all(self._lookup(lon, lat) == timezone
+                   for lon, lat in ((west, south), (east, south),
+                                    (west, north), (east, north)))
+
+    def timezone_at(self, lon, lat):
+        if not self.available:
+            return ''
+
+        cell = (int(floor(lon / self.cell_size)), int(floor(lat / self.cell_size)))
+        timezone = self._cells.get(cell)
+        if timezone is not None:
+            self.hits += 1
+            return timezone
+
+        self.misses += 1
+        timezone = self._lookup(lon, lat)
+        if not timezone:
+            logging.debug('No timezone found for (%s, %s)', lon, lat)
+        if cell not in self._cells:
+            self._cells[cell] = timezone if self._corners_agree(cell, timezone) else None
+        return timezone
+
+    def timezones_at(self, points):
+        """Resolve a batch of (lon, lat) points. None resolves to ''."""
+        return [self.timezone_at(*point) if point else '' for point in points]
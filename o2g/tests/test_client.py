@@ -0,0 +1,159 @@
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from o2g.client import HTTPClient
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers with the status scripted for the path, then 200."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            script = server.scripts.setdefault(self.path, [])
+            status = script.pop(0) if script else 200
+        try:
+            time.sleep(server.delay)
+            body = b'answer' if status == 200 else b'busy'
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            if status == 302:
+                self.send_header('Location', '/moved')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(delay=0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.connections = set()
+    server.scripts = {}
+    server.requests = 0
+    server.active = 0
+    server.max_active = 0
+    server.delay = delay
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    threading.Thread(target=server.serve_forever, args=(0.05,),
+                     daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = _serve()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _get(client, urls, method='GET'):
+    with client.request(method, urls) as resp:
+        return resp.status, resp.read()
+
+
+def test_keep_alive_and_redirects(server):
+    client = HTTPClient(backoff=0)
+    server.scripts['/old'] = [302]
+    for path in ('/a', '/b', '/old'):
+        assert _get(client, server.url + path) == (200, b'answer')
+    # One connection served all requests, the redirect included.
+    assert server.requests == 4
+    assert len(server.connections) == 1
+    client.close()
+
+
+def test_retry_with_backoff(server):
+    client = HTTPClient(retries=2, backoff=0)
+    server.scripts['/busy'] = [429, 503]
+    assert _get(client, server.url + '/busy', 'POST') == (200, b'answer')
+    assert server.requests == 3
+
+    server.scripts['/down'] = [500, 500, 500, 500]
+    assert _get(client, server.url + '/down')[0] == 500
+    assert server.requests == 6
+
+    server.scripts['/bad'] = [404]
+    assert _get(client, server.url + '/bad')[0] == 404
+    assert server.requests == 7
+
+
+def test_failover_between_mirrors(server):
+    mirror = _serve()
+    try:
+        client = HTTPClient(retries=1, backoff=10)
+        server.scripts['/api'] = [503]
+        urls = [server.url + '/api', mirror.url + '/api']
+        start = time.time()
+        assert _get(client, urls) == (200, b'answer')
+        # Failing over does not wait for the backoff.
+        assert time.time() - start < 5
+        assert (server.requests, mirror.requests) == (1, 1)
+
+        # The mirror that answered is asked first from now on.
+        assert _get(client, urls) == (200, b'answer')
+        assert (server.requests, mirror.requests) == (1, 2)
+    finally:
+        mirror.shutdown()
+        mirror.server_close()
+
+
+def test_connection_errors_fail_over(server):
+    # Nothing listens on a port that was just closed.
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    dead = 'http://127.0.0.1:{}/api'.format(sock.getsockname()[1])
+    sock.close()
+
+    client = HTTPClient(retries=1, backoff=0)
+    assert _get(client, [dead, server.url + '/api']) == (200, b'answer')
+    with pytest.raises(OSError):
+        _get(HTTPClient(retries=1, backoff=0), dead)
+
+
+def test_timeout():
+    slow = _serve(delay=1)
+    try:
+        client = HTTPClient(timeout=0.1, retries=0)
+        with pytest.raises(socket.timeout):
+            _get(client, slow.url)
+    finally:
+        slow.shutdown()
+        slow.server_close()
+
+
+def test_concurrency_cap_per_host():
+    slow = _serve(delay=0.05)
+    try:
+        client = HTTPClient(max_per_host=2)
+        threads = [threading.Thread(target=_get, args=(client, slow.url))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert slow.requests == 6
+        assert slow.max_active == 2
+        assert len(slow.connections) == 2
+    finally:
+        slow.shutdown()
+        slow.server_close()
@@ -0,0 +1,62 @@
+import math
+import random
+
+import pytest
+
+from o2g.osm.clip import Polygon, load_polygon
+
+
+def _brute_force(rings, lon, lat):
+    inside = False
+    for ring in rings:
+        for idx in range(len(ring)):
+            (x1, y1), (x2, y2) = ring[idx - 1], ring[idx]
+            if (y1 > lat) != (y2 > lat):
+                if lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+    return inside
+
+
+def _circle(lon, lat, radius, count):
+    return [(lon + radius * math.cos(2 * math.pi * idx / count),
+             lat + radius * math.sin(2 * math.pi * idx / count))
+            for idx in range(count)]
+
+
+def test_square_with_hole():
+    polygon = Polygon([[(0, 0), (4, 0), (4, 4), (0, 4)],
+                       [(1, 1), (3, 1), (3, 3), (1, 3)]])
+    assert polygon.contains(0.5, 0.5)
+    assert not polygon.contains(2, 2)
+    assert not polygon.contains(5, 2)
+    assert polygon.contains_many([(0.5, 3.5), (2, 2), (-1, 0)]) ==\
+        [True, False, False]
+
+
+def test_bands_agree_with_all_edges():
+    rings = [_circle(7.8, 48.0, 0.1, 400), _circle(7.8, 48.0, 0.05, 100)]
+    polygon = Polygon(rings)
+    random.seed(1)
+    points = [(random.uniform(7.65, 7.95), random.uniform(47.85, 48.15))
+              for _ in range(2000)]
+    # Points on the edges between bands and on vertices
+    points += [(lon, lat) for lat in polygon._band_starts
+               for lon in (7.72, 7.76, 7.8, 7.84, 7.88)]
+    points += [point for ring in rings for point in ring]
+
+    expected = [_brute_force(rings, lon, lat) for lon, lat in points]
+    assert polygon.contains_many(points) == expected
+    assert any(expected) and not all(expected)
+
+
+def test_needs_a_ring():
+    with pytest.raises(ValueError):
+        Polygon([[(0, 0), (1, 1)]])
+
+
+def test_load_poly(tmpdir):
+    poly = tmpdir.join('area.poly')
+    poly.write('area\n1\n 0 0\n 4 0\n 4 4\n 0 4\nEND\n!2\n 1 1\n 3 1\n'
+               ' 3 3\n 1 3\nEND\nEND\n')
+    polygon = load_polygon(str(poly))
+    assert polygon.contains(0.5, 0.5) and not polygon.contains(2, 2)
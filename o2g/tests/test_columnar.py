@@ -0,0 +1,48 @@
+import io
+
+import pytest
+
+from o2g.osm.models import Stop
+
+np = pytest.importorskip('numpy')
+
+from o2g.gtfs.gtfs_columnar import ColumnarGTFSWriter, NPZ_MASK_SUFFIX  # noqa: E402
+
+
+def test_npz_tables(tmpdir):
+    writer = ColumnarGTFSWriter(tables={'stops'}, backend='npz')
+    writer.add_stops([Stop(1, 'A', 7.8, 48.0, 10, 1, 1, ''),
+                      Stop(2, 'B', 7.81, 48.01, 10, 0, '', 1)])
+    writer.write_unzipped(str(tmpdir))
+
+    with np.load(str(tmpdir.join('stops.npz'))) as stops:
+        assert list(stops['stop_id']) == ['1', '2']
+        assert stops['stop_lat'].dtype == np.float64
+        assert list(stops['stop_lon']) == [7.8, 7.81]
+        assert list(stops['location_type']) == [1, 0]
+        assert list(stops['location_type' + NPZ_MASK_SUFFIX]) == [True, False]
+        assert 'wheelchair_boarding' + NPZ_MASK_SUFFIX not in stops.files
+
+
+def test_parquet_tables(tmpdir):
+    pq = pytest.importorskip('pyarrow.parquet')
+    writer = ColumnarGTFSWriter(tables={'stops'}, backend='parquet')
+    writer.add_stops([Stop(1, 'A', 7.8, 48.0, 10, 1, 1, ''),
+                      Stop(2, 'B', 7.81, 48.01, 10, 0, '', 1)])
+    writer.write_unzipped(str(tmpdir))
+
+    stops = pq.read_table(str(tmpdir.join('stops.parquet'))).to_pydict()
+    assert stops['stop_id'] == ['1', '2']
+    assert stops['stop_lon'] == [7.8, 7.81]
+    assert stops['location_type'] == [1, None]
+    assert stops['parent_station'] == ['', '1']
+
+
+def test_unsupported_outputs(tmpdir):
+    writer = ColumnarGTFSWriter(tables={'stops'}, backend='npz')
+    with pytest.raises(ValueError):
+        writer.stream_zipped(io.BytesIO())
+    with pytest.raises(ValueError):
+        writer.write_changeset(str(tmpdir))
+    writer.close()
+    writer.abort()
@@ -0,0 +1,56 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('osmium')
+
+from o2g.osm.convert import cached_pbf, CACHE_STATS  # noqa: E402
+
+
+OSM_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="{}" version="1" lat="48.0" lon="7.80"><tag k="name" v="A"/></node>
+</osm>
+"""
+
+
+def _osm(tmpdir, name, node_id=1):
+    path = tmpdir.join(name)
+    path.write(OSM_XML.format(node_id))
+    return str(path)
+
+
+def test_cache_hits_and_misses(tmpdir):
+    cache = str(tmpdir.mkdir('cache'))
+    osm = _osm(tmpdir, 'a.osm')
+    stats = dict(CACHE_STATS)
+
+    pbf, seconds = cached_pbf(osm, cache)
+    assert os.path.exists(pbf) and pbf.startswith(cache)
+    assert cached_pbf(osm, cache) == (pbf, 0.0)
+    assert CACHE_STATS['misses'] - stats['misses'] == 1
+    assert CACHE_STATS['hits'] - stats['hits'] == 1
+
+    # A changed input is converted again.
+    os.utime(osm, (time.time() + 10, time.time() + 10))
+    changed, _ = cached_pbf(osm, cache)
+    assert changed != pbf
+    assert CACHE_STATS['misses'] - stats['misses'] == 2
+
+
+def test_cache_size_is_bounded(tmpdir):
+    cache = str(tmpdir.mkdir('cache'))
+    first, _ = cached_pbf(_osm(tmpdir, 'a.osm'), cache)
+    os.utime(first, (time.time() - 60, time.time() - 60))
+    second, _ = cached_pbf(_osm(tmpdir, 'b.osm', 2), cache)
+
+    # Room for one file: the least recently used one goes.
+    room = os.path.getsize(second) + 1
+    osm = _osm(tmpdir, 'c.osm', 3)
+    third, _ = cached_pbf(osm, cache, max_bytes=room)
+    assert os.listdir(cache) == [os.path.basename(third)]
+
+    # The file in use stays even if it does not fit.
+    assert cached_pbf(osm, cache, max_bytes=0)[0] == third
+    assert os.path.exists(third)
@@ -0,0 +1,86 @@
+import io
+import logging
+import zipfile
+import threading
+
+import pytest
+
+from o2g.diagnostics import Diagnostics
+
+
+def test_counts_and_bounded_examples():
+    diagnostics = Diagnostics(max_examples=2)
+    for node_id in range(1000):
+        diagnostics.add('invalid_node_location', node_id, 'node/{}')
+    diagnostics.add('unknown_wheelchair_value', 'maybe')
+    diagnostics.add('unknown_wheelchair_value', 'maybe')
+    diagnostics.add_many('missing_node', 5, ['node/1', 'node/2', 'node/3'])
+
+    assert diagnostics.counts['invalid_node_location'] == 1000
+    assert diagnostics.examples['invalid_node_location'] == ['node/0', 'node/1']
+    assert diagnostics.examples['unknown_wheelchair_value'] == ['maybe']
+    assert diagnostics.examples['missing_node'] == ['node/1', 'node/2']
+    assert diagnostics.summary() == [
+        'Relation member nodes missing in the input: 5 (e.g. node/1, node/2)',
+        'Nodes with an invalid location: 1000 (e.g. node/0, node/1)',
+        'Unknown values of the wheelchair tag: 2 (e.g. maybe)']
+
+    lines = diagnostics.dumps().splitlines()
+    assert lines[:2] == ['category,count,examples',
+                         'missing_node,5,node/1 node/2']
+
+
+BROKEN_OSM = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="48.0" lon="7.80"><tag k="name" v="A"/></node>
+  <relation id="10" version="1">
+    <member type="node" ref="1" role="stop"/>
+    <member type="node" ref="2" role="stop"/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+  </relation>
+</osm>
+"""
+
+
+def test_conversions_count_their_own_issues():
+    pytest.importorskip('osmium')
+    from o2g.cli import convert
+
+    feeds = {}
+
+    def run(name, data):
+        feeds[name] = convert(data, timezones=False)
+
+    threads = [threading.Thread(target=run, args=(name, BROKEN_OSM))
+               for name in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for feed in feeds.values():
+        with zipfile.ZipFile(io.BytesIO(feed)) as zfile:
+            diagnostics = zfile.read('diagnostics.txt').decode('utf-8')
+        assert diagnostics.splitlines()[1] == 'missing_node,1,node/2 in relation/10'
+
+
+def test_logs_are_captured_per_thread():
+    from o2g.cli import capture_logs
+
+    barrier = threading.Barrier(2)
+    logs = {}
+
+    def run(name):
+        with capture_logs() as captured:
+            barrier.wait()
+            logging.warning('from %s', name)
+            barrier.wait()
+        logs[name] = captured.getvalue()
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in 'ab']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert logs == {'a': 'from a\n', 'b': 'from b\n'}
@@ -0,0 +1,65 @@
+import os
+import csv
+import zipfile
+
+import pytest
+
+from o2g.osm.models import Stop, Shape
+from o2g.gtfs.gtfs_writer import GTFSWriter
+
+
+def _write_feed(stops, shapes, previous=None, zipname=None, destination=None):
+    writer = GTFSWriter(tables={'stops', 'shapes'}, previous=previous)
+    writer.add_stops(stops)
+    writer.add_shapes(shapes)
+    if zipname:
+        writer.write_zipped(zipname)
+    else:
+        writer.write_unzipped(destination)
+    return writer
+
+
+def _read_changes(path):
+    with open(path, encoding='utf-8') as file:
+        return [(row['change'], row['stop_id'], row['stop_name'])
+                for row in csv.DictReader(file)]
+
+
+STOPS = [Stop(1, 'A', 7.80, 48.0, 10, 0, '', ''),
+         Stop(2, 'B', 7.81, 48.0, 10, 0, '', ''),
+         Stop(3, 'C', 7.82, 48.0, 10, 0, '', '')]
+SHAPES = [Shape(10, 48.0, 7.80, 0), Shape(10, 48.0, 7.81, 1)]
+
+
+@pytest.mark.parametrize('zipped', [False, True])
+def test_changeset_against_previous_feed(tmpdir, zipped):
+    new_stops = [STOPS[0], STOPS[1]._replace(stop_name='B2'),
+                 Stop(4, 'D', 7.83, 48.0, 10, 0, '', '')]
+
+    if zipped:
+        feed = str(tmpdir.join('feed.zip'))
+        _write_feed(STOPS, SHAPES, zipname=feed)
+        # Overwrites the previous feed
+        writer = _write_feed(new_stops, SHAPES, previous=feed, zipname=feed)
+        with zipfile.ZipFile(str(tmpdir.join('feed.changes.zip'))) as changes:
+            changes.extractall(str(tmpdir.join('changes')))
+        changes_dir = str(tmpdir.join('changes'))
+    else:
+        feed = str(tmpdir)
+        _write_feed(STOPS, SHAPES, destination=feed)
+        writer = _write_feed(new_stops, SHAPES, previous=feed, destination=feed)
+        changes_dir = os.path.join(feed, 'changes')
+
+    assert sorted(_read_changes(os.path.join(changes_dir, 'stops.txt'))) == [
+        ('added', '4', 'D'), ('changed', '2', 'B2'), ('removed', '3', '')]
+    assert writer.changes['shapes'] == {}
+    assert writer.changes['stops'] == {'added': 1, 'changed': 1, 'removed': 1}
+
+
+def test_missing_previous_table_is_all_added(tmpdir):
+    previous = tmpdir.mkdir('previous')
+    current = tmpdir.mkdir('current')
+    writer = _write_feed(STOPS, SHAPES, previous=str(previous),
+                         destination=str(current))
+    assert writer.changes['stops'] == {'added': 3}
+    assert writer.changes['shapes'] == {'added': 2}
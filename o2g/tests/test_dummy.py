@@ -0,0 +1,58 @@
+from o2g.osm.models import Route, Stop
+from o2g.gtfs import gtfs_dummy
+
+
+STOPS = [Stop(1, 'A', 7.80, 48.0, '', 0, '', ''),
+         Stop(2, 'B', 7.81, 48.0, '', 0, '', ''),
+         Stop(3, 'C', 7.82, 48.0, '', 0, '', '')]
+
+
+class StopRoutes(object):
+    # Routes 10 and 11 serve the same stops, route 12 the reverse.
+    route_ids = [10, 11, 12]
+
+    def stops_of_route(self, route_id):
+        return [3, 2, 1] if route_id == 12 else [1, 2, 3]
+
+
+def _times(stop_times, trip_id):
+    return [(st['stop_id'], st['arrival_time'], st['departure_time'])
+            for st in stop_times if st['trip_id'] == trip_id]
+
+
+def test_template_trips():
+    routes = [Route(route_id, str(route_id), '', 3, '', '', 1)
+              for route_id in StopRoutes.route_ids]
+    full = gtfs_dummy.create_dummy_data(routes, STOPS, StopRoutes())
+    compact = gtfs_dummy.create_dummy_data(routes, STOPS, StopRoutes(),
+                                           template_trips=True)
+
+    # One trip per route and service, with the times of the first trip.
+    assert len(full.trips) == 3 * 2 * gtfs_dummy.TRIPS_PER_SERVICE
+    assert len(compact.trips) == 3 * 2
+    assert len(compact.stop_times) * gtfs_dummy.TRIPS_PER_SERVICE ==\
+        len(full.stop_times)
+    assert _times(compact.stop_times, '10.10') ==\
+        _times(full.stop_times, '10.10')
+
+    # Frequencies cover the whole day for every template trip.
+    frequencies = list(compact.frequencies)
+    assert {f['trip_id'] for f in frequencies} ==\
+        {t['trip_id'] for t in compact.trips}
+    assert (frequencies[0]['start_time'], frequencies[2]['end_time']) ==\
+        ('04:30:00', '25:30:00')
+
+    # Routes with the same stops share their times, rows are not shared.
+    assert _times(compact.stop_times, '10.10') ==\
+        _times(compact.stop_times, '10.11')
+    assert [t[0] for t in _times(compact.stop_times, '10.12')] == [3, 2, 1]
+    assert compact.stop_times[0] is not compact.stop_times[3]
+
+
+def test_stations_are_not_served():
+    # Node 2 is the station of its stop_area and a stop of the routes.
+    stops = [Stop(2, 'B', 7.81, 48.0, None, 0, 1, '')] + \
+        [stop for stop in STOPS if stop.stop_id != 2]
+    routes = [Route(10, '10', '', 3, '', '', 1)]
+    dummy = gtfs_dummy.create_dummy_data(routes, stops, StopRoutes())
+    assert [t[0] for t in _times(dummy.stop_times, '10.10')] == [1, 3]
@@ -0,0 +1,172 @@
+import os
+import pathlib
+
+import pytest
+
+pytest.importorskip('osmium')
+
+from o2g.osm.exporter import TransitDataExporter  # noqa: E402
+
+
+OSM_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="48.0" lon="7.80"><tag k="name" v="A"/></node>
+  <node id="2" version="1" lat="48.0" lon="7.81"><tag k="name" v="B"/></node>
+  <node id="3" version="1" lat="48.0" lon="7.82"/>
+  <way id="20" version="1"><nd ref="1"/><nd ref="3"/><nd ref="2"/></way>
+  <relation id="10" version="1">
+    <member type="node" ref="1" role="stop"/>
+    <member type="node" ref="2" role="stop"/>
+    <member type="way" ref="20" role=""/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+    <tag k="ref" v="1"/>
+  </relation>
+</osm>
+"""
+
+
+def _exporter(**options):
+    return TransitDataExporter(OSM_XML, timezones=False, **options)
+
+
+@pytest.mark.parametrize('tables, way_shapes, nodes, ways', [
+    (['routes', 'calendar', 'feedinfo'], False, False, False),
+    (['agency'], False, False, False),
+    (['stops'], False, True, False),
+    (['shapes'], False, True, False),
+    (['shapes'], True, True, True),
+    (['stops', 'trips'], True, True, False),
+])
+def test_passes_are_planned_by_tables(tables, way_shapes, nodes, ways):
+    exporter = _exporter(tables=tables, way_shapes=way_shapes)
+    assert exporter.needs_nodes == nodes
+    assert exporter.needs_ways == ways
+
+    exporter.process()
+    passes = ['relations'] + ['nodes'] * nodes + ['ways'] * ways
+    assert list(exporter.timings) == passes
+
+
+def test_way_pass_builds_way_shapes():
+    exporter = _exporter(tables=['shapes'], way_shapes=True)
+    exporter.process()
+    assert [shape.shape_pt_lon for shape in exporter.shapes] == [7.80, 7.82, 7.81]
+
+
+FREIBURG = str(pathlib.Path(__file__).parents[2].joinpath(
+    'resources', 'osm', 'freiburg.osm.bz2'))
+
+
+def _tables(exporter):
+    return (list(exporter.agencies), list(exporter.routes),
+            list(exporter.stops), list(exporter.shapes))
+
+
+def test_out_of_core_gives_same_result():
+    with TransitDataExporter(FREIBURG, timezones=False) as in_memory:
+        in_memory.process()
+        expected = _tables(in_memory)
+    with TransitDataExporter(FREIBURG, timezones=False, out_of_core=True,
+                             memory_budget=2**20) as out_of_core:
+        out_of_core.process()
+        workdir = out_of_core.workdir
+        assert _tables(out_of_core) == expected
+    assert not os.path.exists(workdir)
+
+
+def test_stores_are_removed_on_errors():
+    with pytest.raises(RuntimeError):
+        with _exporter(out_of_core=True) as exporter:
+            exporter.process()
+            workdir = exporter.workdir
+            raise RuntimeError()
+    assert not os.path.exists(workdir)
+
+
+def test_transit_extract_gives_same_result(tmpdir):
+    from o2g.osm.extract import extract_transit, is_transit_extract
+
+    extract = str(tmpdir.join('transit.osm.pbf'))
+    nodes, ways, relations = extract_transit(FREIBURG, extract)
+    assert nodes and ways and relations
+    assert is_transit_extract(extract)
+    assert not is_transit_extract(FREIBURG)
+
+    with TransitDataExporter(FREIBURG, timezones=False) as full:
+        full.process()
+        expected = _tables(full)
+    with TransitDataExporter(extract, timezones=False) as transit:
+        transit.process()
+        assert _tables(transit) == expected
+
+    # The fixture lists ways before nodes, which leaves osmium's location
+    # index empty. Extracts get the locations from the node pass.
+    with TransitDataExporter(extract, timezones=False, way_shapes=True) as transit:
+        transit.process()
+        assert transit.nh.locations
+        list(transit.shapes)
+        assert not transit.diagnostics.counts['route_without_way_points']
+
+
+CLIP_OSM = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="48.0" lon="7.80"/>
+  <node id="2" version="1" lat="48.0" lon="7.81"/>
+  <node id="3" version="1" lat="48.0" lon="7.90"/>
+  <node id="4" version="1" lat="48.0" lon="7.91"/>
+  <relation id="10" version="1">
+    <member type="node" ref="1" role="stop"/>
+    <member type="node" ref="2" role="stop"/>
+    <member type="node" ref="3" role="stop"/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+  </relation>
+  <relation id="11" version="1">
+    <member type="node" ref="2" role="stop"/>
+    <member type="node" ref="3" role="stop"/>
+    <member type="node" ref="4" role="stop"/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+  </relation>
+</osm>
+"""
+
+
+def test_routes_mostly_outside_are_clipped():
+    from o2g.osm.clip import Polygon
+
+    # Nodes 1 and 2 are inside.
+    clip = Polygon([[(7.75, 47.9), (7.85, 47.9), (7.85, 48.1), (7.75, 48.1)]])
+    exporter = TransitDataExporter(CLIP_OSM, timezones=False, clip=clip,
+                                   clip_fraction=0.5)
+    exporter.process()
+
+    assert [route.route_id for route in exporter.routes] == [10]
+    assert exporter.nh.clipped_node_ids == {3, 4}
+    assert set(exporter.nodes) == {1, 2}
+    assert [stop.stop_id for stop in exporter.stops] == [1, 2]
+
+
+def test_routes_only_export_is_clipped():
+    from o2g.osm.clip import Polygon
+
+    far_away = Polygon([[(0, 0), (1, 0), (1, 1), (0, 1)]])
+    exporter = TransitDataExporter(CLIP_OSM, timezones=False, clip=far_away,
+                                   tables=['routes'])
+    assert exporter.needs_nodes
+    exporter.process()
+    assert list(exporter.routes) == []
+
+
+def test_memory_budget_is_shared():
+    budget = 10 * 2**20 + 3
+    with TransitDataExporter(CLIP_OSM, timezones=False, out_of_core=True,
+                             memory_budget=budget) as exporter:
+        exporter.process()
+        # No way pass without way shapes
+        ways = exporter._store('ways')
+        ways.close()
+        stores = [exporter.rh.relations, exporter.nh.nodes, ways]
+        assert sum(store.memory_budget for store in stores) + \
+            exporter.sort_memory == budget
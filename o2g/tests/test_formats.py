@@ -0,0 +1,17 @@
+import bz2
+import gzip
+
+from o2g.osm.formats import sniff_format
+
+
+XML = b"<?xml version='1.0' encoding='UTF-8'?>\n<osm version=\"0.6\"></osm>"
+# Length of the blob header, then the header starting with its type
+PBF = b'\x00\x00\x00\x0d\n\tOSMHeader\x18\x8a\x01'
+
+
+def test_sniff_format():
+    assert sniff_format(PBF) == 'pbf'
+    assert sniff_format(XML) == 'osm'
+    assert sniff_format(gzip.compress(XML)) == 'osm.gz'
+    assert sniff_format(bz2.compress(XML)) == 'osm.bz2'
+    assert sniff_format(memoryview(PBF)) == 'pbf'
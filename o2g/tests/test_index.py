@@ -0,0 +1,34 @@
+from o2g.osm.models import Relation, Route, Stop
+from o2g.osm.index import RelationIndex, StopRouteIndex
+from o2g.gtfs import gtfs_dummy
+
+
+def test_stop_route_index():
+    index = StopRouteIndex([(100, [5, 3, 5, 7]), (200, [3, 9]), (300, [])])
+
+    assert list(index.stops_of_route(100)) == [5, 3, 5, 7]
+    assert list(index.stops_of_route(300)) == []
+    assert list(index.stops_of_route(400)) == []
+
+    assert index.routes_of_stop(3) == [100, 200]
+    assert index.routes_of_stop(5) == [100]
+    assert index.routes_of_stop(4) == []
+
+
+def test_shared_stops_in_dummy_trips():
+    relations = {
+        1: Relation(1, {'type': 'route', 'route': 'bus'},
+                    [('n', 10, 'stop'), ('w', 5, ''), ('n', 11, 'stop')]),
+        2: Relation(2, {'type': 'route', 'route': 'bus'},
+                    [('n', 11, 'stop'), ('n', 12, 'stop')])}
+    index = RelationIndex(relations)
+    stops = [Stop(10, 'a', 7.80, 48.0, 1, 0, '', ''),
+             Stop(11, 'b', 7.81, 48.0, 1, 0, '', ''),
+             Stop(12, 'c', 7.82, 48.0, 2, 0, '', '')]
+    routes = [Route(1, '1', 'One', 3, '', '', -1),
+              Route(2, '2', 'Two', 3, '', '', -1)]
+
+    dummy = gtfs_dummy.create_dummy_data(routes, stops, index.stop_routes)
+    route_ids = {trip['route_id'] for trip in dummy.trips}
+    # Route 2 only has one stop of its own and used to be skipped.
+    assert route_ids == {1, 2}
@@ -0,0 +1,56 @@
+import pytest
+
+from o2g.metrics import Registry, resident_memory
+
+
+def test_render_text_format():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.',
+                                ('endpoint', 'status'))
+    in_flight = registry.gauge('in_flight', 'Running.')
+    seconds = registry.histogram('seconds', 'Durations.', ('stage',),
+                                 buckets=(0.1, 1))
+    registry.gauge('memory_bytes', 'Memory.', function=lambda: 42)
+
+    requests.inc(endpoint='/o2g', status=200)
+    requests.inc(2, endpoint='/o2g', status=200)
+    requests.inc(endpoint='/"quoted"', status=400)
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    for value in (0.05, 0.1, 0.5, 7):
+        seconds.observe(value, stage='nodes')
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{endpoint="/\\"quoted\\"",status="400"} 1',
+        'requests_total{endpoint="/o2g",status="200"} 3',
+        '# HELP in_flight Running.',
+        '# TYPE in_flight gauge',
+        'in_flight 1',
+        '# HELP seconds Durations.',
+        '# TYPE seconds histogram',
+        'seconds_bucket{stage="nodes",le="0.1"} 2',
+        'seconds_bucket{stage="nodes",le="1"} 3',
+        'seconds_bucket{stage="nodes",le="+Inf"} 4',
+        'seconds_sum{stage="nodes"} 7.65',
+        'seconds_count{stage="nodes"} 4',
+        '# HELP memory_bytes Memory.',
+        '# TYPE memory_bytes gauge',
+        'memory_bytes 42']
+
+
+def test_labels_and_names_are_checked():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests.', ('endpoint',))
+    with pytest.raises(ValueError):
+        requests.inc(status=200)
+    with pytest.raises(ValueError):
+        requests.inc(-1, endpoint='/')
+    with pytest.raises(ValueError):
+        registry.gauge('requests_total', 'Again.')
+
+
+def test_resident_memory():
+    assert resident_memory() > 1024 * 1024
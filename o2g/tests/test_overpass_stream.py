@@ -0,0 +1,181 @@
+import os
+import gzip
+import time
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from o2g.web import OverpassStream, dl_osm_from_overpass, build_overpass_query
+
+
+OSM_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="48.0" lon="7.80"><tag k="name" v="A"/></node>
+  <node id="2" version="1" lat="48.0" lon="7.81"><tag k="name" v="B"/></node>
+  <node id="3" version="1" lat="48.0" lon="7.82"><tag k="name" v="C"/></node>
+  <relation id="10" version="1">
+    <member type="node" ref="1" role="stop"/>
+    <member type="node" ref="2" role="stop"/>
+    <member type="node" ref="3" role="stop"/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+    <tag k="ref" v="1"/>
+    <tag k="operator" v="VAG"/>
+  </relation>
+</osm>
+"""
+
+CHUNK_SIZE = 64
+CHUNK_DELAY = 0.02
+
+
+class SlowOverpassHandler(BaseHTTPRequestHandler):
+    """Overpass stand-in sending its answer in small, delayed chunks."""
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/osm3s+xml')
+        self.send_header('Content-Length', str(len(OSM_XML)))
+        self.end_headers()
+        for start in range(0, len(OSM_XML), CHUNK_SIZE):
+            self.wfile.write(OSM_XML[start:start + CHUNK_SIZE])
+            self.wfile.flush()
+            time.sleep(CHUNK_DELAY)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def overpass_url():
+    server = HTTPServer(('127.0.0.1', 0), SlowOverpassHandler)
+    # osmium holds the GIL while it reads, a server thread would stall.
+    process = multiprocessing.get_context('fork').Process(
+        target=server.serve_forever, daemon=True)
+    process.start()
+    yield 'http://127.0.0.1:{}/api/interpreter'.format(server.server_port)
+    process.terminate()
+    process.join()
+    server.server_close()
+
+
+def test_stream_tees_while_downloading(overpass_url):
+    stream = OverpassStream('Freiburg', None, overpass_url, chunk_size=CHUNK_SIZE)
+    stream.start()
+    try:
+        with open(stream.pipe_path, 'rb') as pipe:
+            first = pipe.read(CHUNK_SIZE)
+            # Data arrives long before the download is over.
+            assert stream.bytes_received < len(OSM_XML)
+            received = first + pipe.read()
+
+        filename, filepath = stream.wait()
+        assert received == OSM_XML
+        with open(filepath, 'rb') as tee:
+            assert tee.read() == OSM_XML
+    finally:
+        stream.close()
+        os.remove(stream.filepath)
+
+
+def test_stream_gives_same_result(overpass_url):
+    pytest.importorskip('osmium')
+    from o2g.osm.exporter import TransitDataExporter
+
+    _, filepath = dl_osm_from_overpass('Freiburg', None, overpass_url)
+    expected = TransitDataExporter(filepath, timezones=False, convert_xml=False)
+    expected.process()
+
+    stream = OverpassStream('Freiburg', None, overpass_url).start()
+    try:
+        streamed = TransitDataExporter(stream.filepath, timezones=False,
+                                       convert_xml=False, stream=stream)
+        streamed.process()
+    finally:
+        stream.close()
+
+    assert list(streamed.routes) == list(expected.routes)
+    assert list(streamed.stops) == list(expected.stops)
+    assert list(streamed.agencies) == list(expected.agencies)
+    assert list(streamed.shapes) == list(expected.shapes)
+
+
+class FailingOverpassHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_error(400, 'Bad query')
+
+    def log_message(self, *args):
+        pass
+
+
+def test_failed_stream_raises():
+    pytest.importorskip('osmium')
+    from o2g.osm.exporter import TransitDataExporter
+
+    server = HTTPServer(('127.0.0.1', 0), FailingOverpassHandler)
+    process = multiprocessing.get_context('fork').Process(
+        target=server.serve_forever, daemon=True)
+    process.start()
+    stream = OverpassStream(
+        'Freiburg', None,
+        'http://127.0.0.1:{}/api/interpreter'.format(server.server_port))
+    try:
+        stream.start()
+        exporter = TransitDataExporter(stream.filepath, timezones=False,
+                                       convert_xml=False, stream=stream)
+        with pytest.raises(IOError, match='400'):
+            exporter.process()
+    finally:
+        stream.close()
+        process.terminate()
+        process.join()
+        server.server_close()
+
+
+def test_query_leaves_out_unused_ways():
+    query = build_overpass_query('Freiburg', None)
+    assert 'way(' not in query
+    assert 'out body' in query
+
+    skel = build_overpass_query('Freiburg', None, way_geometry='skel')
+    assert 'out skel qt' in skel
+    assert '- node.members' in skel
+
+    geom = build_overpass_query(None, '1,2,3,4', way_geometry='geom')
+    assert 'out skel geom' in geom
+
+    with pytest.raises(ValueError):
+        build_overpass_query('Freiburg', None, out_format='json')
+
+
+class GzipOverpassHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = gzip.compress(OSM_XML)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_gzip_responses_are_decompressed():
+    server = HTTPServer(('127.0.0.1', 0), GzipOverpassHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        _, filepath = dl_osm_from_overpass(
+            'Freiburg', None,
+            'http://127.0.0.1:{}/api/interpreter'.format(server.server_port))
+        with open(filepath, 'rb') as osm:
+            assert osm.read() == OSM_XML
+        os.remove(filepath)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,48 @@
+from o2g.osm.models import Agency, Route, Stop, Shape
+from o2g.gtfs.gtfs_writer import GTFSWriter
+from o2g.gtfs.gtfs_reader import GTFSReader
+
+
+AGENCIES = [Agency(12345678, 'http://vag.de', 'VAG', 'Europe/Berlin')]
+ROUTES = [Route(10, '1', 'A => B', 0, 'https://osm.org/relation/10', 'red', 12345678)]
+STOPS = [Stop(1, 'A', 7.8, 48.0, None, 1, 1, ''),
+         Stop(2, 'B, Platform 1', 7.81, 48.01, None, 0, '', 1)]
+SHAPES = [Shape(10, 48.0, 7.8, 0), Shape(10, 48.01, 7.81, 1)]
+
+
+def _write(writer, tmpdir, zipped):
+    if zipped:
+        path = str(tmpdir.join('feed.zip'))
+        writer.write_zipped(path)
+        return path
+    writer.write_unzipped(str(tmpdir))
+    return str(tmpdir)
+
+
+def test_models_round_trip(tmpdir):
+    writer = GTFSWriter(tables={'agency', 'routes', 'stops', 'shapes'})
+    writer.add_agencies(AGENCIES)
+    writer.add_routes(ROUTES)
+    writer.add_stops(STOPS)
+    writer.add_shapes(SHAPES)
+
+    for zipped in (False, True):
+        reader = GTFSReader(_write(writer, tmpdir, zipped))
+        assert reader.tables == ['agency', 'routes', 'shapes', 'stops']
+        assert list(reader.agencies()) == AGENCIES
+        assert list(reader.routes()) == ROUTES
+        assert list(reader.stops()) == STOPS
+        assert list(reader.shapes()) == SHAPES
+        assert list(reader.trips()) == []
+
+
+def test_typed_records(tmpdir):
+    writer = GTFSWriter(tables={'stop_times'})
+    writer.add_stop_times([{'trip_id': '10.10', 'arrival_time': '05:00:00',
+                            'departure_time': '05:00:30', 'stop_id': 1,
+                            'stop_sequence': 0}])
+    writer.write_unzipped(str(tmpdir))
+
+    assert list(GTFSReader(str(tmpdir)).stop_times()) == [
+        {'trip_id': '10.10', 'arrival_time': '05:00:00',
+         'departure_time': '05:00:30', 'stop_id': 1, 'stop_sequence': 0}]
@@ -0,0 +1,54 @@
+from o2g.osm.models import Shape
+from o2g.osm.builders import ShapeDeduplicator
+
+
+def _shape(shape_id, points):
+    return [Shape(shape_id, lat, lon, idx) for idx, (lat, lon) in enumerate(points)]
+
+
+def test_duplicate_shapes_are_written_once():
+    line = [(48.0, 7.80), (48.0, 7.81), (48.1, 7.82)]
+    shapes = _shape(1, line) + _shape(2, [(48.0, 7.80)]) + _shape(3, line)
+
+    dedup = ShapeDeduplicator()
+    written = list(dedup.deduplicate(iter(shapes)))
+
+    assert [r.shape_id for r in written] == [1, 1, 1, 2]
+    assert dedup.shape_ids == {1: 1, 2: 2, 3: 1}
+    assert dedup.duplicates == 1
+    assert dedup.bytes_saved == sum(
+        len(','.join(str(v) for v in r)) + 1 for r in _shape(3, line))
+
+
+def test_reversed_shapes_are_kept():
+    line = [(48.0, 7.80), (48.0, 7.81)]
+    dedup = ShapeDeduplicator()
+    written = list(dedup.deduplicate(_shape(1, line) + _shape(2, line[::-1])))
+
+    assert len(written) == 4
+    assert dedup.duplicates == 0
+
+
+def _way_shape(*ways):
+    from o2g.diagnostics import Diagnostics
+    from o2g.osm.builders.shape_builder import build_way_shape
+    from o2g.osm.index import RelationMembers
+    from o2g.osm.models import Way, Point, Relation
+
+    way_map = {way_id: Way(way_id, [Point(lon, 48.0) for lon in lons])
+               for way_id, lons in enumerate(ways)}
+    members = RelationMembers((), tuple(way_map), (), ())
+    relation = Relation(1, {}, [])
+    return [shape.shape_pt_lon for shape in build_way_shape(
+        relation, members, {}, way_map, Diagnostics())]
+
+
+def test_way_shapes_follow_the_route():
+    # Drawn forwards, backwards, forwards
+    assert _way_shape([1, 2], [4, 3, 2], [4, 5]) == [1, 2, 3, 4, 5]
+    # The first way is drawn backwards
+    assert _way_shape([2, 1], [2, 3]) == [1, 2, 3]
+    assert _way_shape([2, 1], [3, 2]) == [1, 2, 3]
+    # A gap starts over with the next way
+    assert _way_shape([1, 2], [4, 3], [4, 5]) == [1, 2, 3, 4, 5]
+    assert _way_shape([1, 2]) == [1, 2]
@@ -0,0 +1,65 @@
+import random
+
+import pytest
+
+from o2g.osm.models import Shape
+from o2g.gtfs import gtfs_sort
+from o2g.gtfs.gtfs_sort import sort_rows, column_key
+from o2g.gtfs.gtfs_writer import GTFSWriter
+from o2g.gtfs.gtfs_reader import GTFSReader
+
+
+HEADERS = ['trip_id', 'stop_sequence', 'stop_id']
+
+
+def _rows(count):
+    rng = random.Random(1)
+    return [[rng.choice([rng.randrange(50), 'T{}'.format(rng.randrange(50))]),
+             rng.randrange(20), idx] for idx in range(count)]
+
+
+@pytest.mark.parametrize('memory_budget', [10**9, 5000])
+def test_sort_rows_is_stable(monkeypatch, memory_budget):
+    monkeypatch.setattr(gtfs_sort, 'RUN_CHUNK_ROWS', 7)
+    rows = _rows(2000)
+    key = column_key(HEADERS, ['trip_id', 'stop_sequence'])
+
+    spilled = []
+    spill = gtfs_sort._spill
+    monkeypatch.setattr(gtfs_sort, '_spill',
+                        lambda run: spilled.append(len(run)) or spill(run))
+
+    assert list(sort_rows(iter(rows), key, memory_budget)) ==\
+        sorted(rows, key=key)
+    # Numbers go before strings, ties keep their order.
+    assert sorted(rows, key=key)[0][0] == 0
+    assert bool(spilled) == (memory_budget < 10**9)
+
+
+def test_unknown_sort_column():
+    with pytest.raises(ValueError):
+        column_key(HEADERS, ['route_id'])
+    with pytest.raises(ValueError):
+        GTFSWriter(sort_keys={'stops': ['nope']})
+
+
+def test_writer_sorts_tables(tmpdir):
+    shapes = [Shape(2, 48.0, 7.8, 1), Shape(10, 48.0, 7.8, 0),
+              Shape(2, 48.0, 7.8, 0), Shape('a', 48.0, 7.8, 0)]
+    routes = [{'route_id': 'b'}, {'route_id': 'a'}]
+    trips = [{'trip_id': '2', 'route_id': 'b'},
+             {'trip_id': '1', 'route_id': 'a'}]
+
+    writer = GTFSWriter(tables={'shapes', 'routes', 'trips'},
+                        sort_keys={'routes': [], 'trips': ['route_id']},
+                        sort_memory=200)
+    writer.add_shapes(shapes)
+    writer.add_routes(routes)
+    writer.add_trips(trips)
+    writer.write_unzipped(str(tmpdir))
+
+    reader = GTFSReader(str(tmpdir))
+    assert [(s.shape_id, s.shape_pt_sequence) for s in reader.shapes()] ==\
+        [(2, 0), (2, 1), (10, 0), ('a', 0)]
+    assert [r['route_id'] for r in reader.records('routes')] == ['b', 'a']
+    assert [r['trip_id'] for r in reader.records('trips')] == ['1', '2']
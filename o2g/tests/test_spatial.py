@@ -0,0 +1,76 @@
+import pytest
+
+from o2g.osm.models import Stop
+from o2g.osm.spatial import PointGrid, cluster_points, distance
+from o2g.osm.builders.stop_builder import assign_stations
+
+
+# About 74 meters of longitude at 48 degrees north
+STEP = 0.001
+
+
+def test_nearest_within_radius():
+    grid = PointGrid(100)
+    grid.add('a', 7.800, 48.0)
+    grid.add('b', 7.802, 48.0)
+
+    assert grid.nearest(7.8009, 48.0) == 'a'
+    assert grid.nearest(7.8011, 48.0) == 'b'
+    # 112 meters from a, 37 meters beyond the radius
+    assert grid.nearest(7.7985, 48.0) is None
+    assert sorted(key for key, _ in grid.neighbours(7.801, 48.0)) == ['a', 'b']
+
+
+def test_nearest_across_cells_and_latitudes():
+    for lat in (0.0, 48.0, 70.0, 89.9):
+        grid = PointGrid(50)
+        grid.add('a', 7.8, lat)
+        # 30 meters north and 30 meters east, 42 meters away
+        dlat = 30 / 111320.0
+        dlon = 30 / distance(0, lat, 1, lat)
+        assert grid.nearest(7.8 + dlon, lat + dlat) == 'a'
+        assert grid.nearest(7.8 - dlon, lat - dlat) == 'a'
+        assert grid.nearest(7.8, lat + 2 * dlat) is None
+
+
+def test_clusters_stay_within_radius_of_their_seed():
+    points = [('a', 7.800, 48.0), ('b', 7.800 + STEP, 48.0),
+              ('c', 7.800 + 2 * STEP, 48.0), ('d', 7.810, 48.0)]
+    clusters = cluster_points(points, 100)
+    # a and c are 149 meters apart, so b does not link them.
+    assert clusters == [['a', 'b'], ['c'], ['d']]
+
+
+def test_chain_is_not_merged():
+    # 50 points every 74 meters along a street
+    points = [(idx, 7.800 + idx * STEP, 48.0) for idx in range(50)]
+    clusters = cluster_points(points, 100)
+    assert sorted(key for cluster in clusters for key in cluster) ==\
+        list(range(50))
+    for cluster in clusters:
+        lons = [points[key][1] for key in cluster]
+        assert distance(min(lons), 48.0, max(lons), 48.0) <= 200
+    assert max(len(cluster) for cluster in clusters) == 2
+
+
+def _stop(stop_id, lon, name='Stop', location_type='', parent=''):
+    return Stop(stop_id, name, lon, 48.0, None, 0, location_type, parent)
+
+
+def test_assign_stations():
+    station = _stop(1, 7.800, 'Hauptbahnhof', 1)
+    stops = [station,
+             _stop(2, 7.800 + STEP),
+             _stop(7, 7.820, 'Unnamed bus stop.'),
+             _stop(5, 7.820 + STEP, 'Bertoldsbrunnen'),
+             _stop(9, 7.840)]
+    result = list(assign_stations(stops, snap_radius=100, cluster_radius=100))
+
+    generated = result[0]
+    assert generated.stop_id == -5
+    assert generated.stop_name == 'Bertoldsbrunnen'
+    assert generated.location_type == 1
+    assert generated.stop_lon == pytest.approx(7.820 + STEP / 2)
+
+    parents = {stop.stop_id: stop.parent_station for stop in result[1:]}
+    assert parents == {1: '', 2: 1, 7: -5, 5: -5, 9: ''}
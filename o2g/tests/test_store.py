@@ -0,0 +1,33 @@
+from o2g.osm.models import Node
+from o2g.osm.store import SqliteStore, prefetch, prefetch_keys
+
+
+def test_round_trip(tmpdir):
+    # Room for a single batch, so that writes are flushed and reads
+    # evicted from the cache while filling the store.
+    store = SqliteStore(str(tmpdir.join('nodes.sqlite')), memory_budget=1)
+    nodes = {node_id: Node(node_id, 7.8, 48.0 + node_id / 1e4,
+                           {'name': str(node_id)})
+             for node_id in range(2000, 0, -1)}
+    for node_id, node in nodes.items():
+        store[node_id] = node
+
+    assert len(store) == 2000
+    assert store[1] == nodes[1]
+    assert store.get(0) is None
+    assert 2000 in store and 0 not in store
+    assert list(store.keys()) == sorted(nodes)
+    assert list(store.items()) == sorted(nodes.items())
+
+    # Replaced values win over the stored ones.
+    store[1] = nodes[2]
+    assert store[1] == nodes[2]
+    assert prefetch(store, [1, 3, 5000]) == {1: nodes[2], 3: nodes[3]}
+    assert prefetch_keys(store, range(1990, 2010)) == set(range(1990, 2001))
+    store.close()
+
+
+def test_dicts_are_not_copied():
+    nodes = {1: 'a'}
+    assert prefetch(nodes, [1, 2]) is nodes
+    assert prefetch_keys(nodes, [1, 2]) is nodes
@@ -0,0 +1,71 @@
+import io
+import os
+import zipfile
+import threading
+
+import pytest
+
+from o2g.osm.models import Stop, Shape
+from o2g.gtfs.gtfs_writer import GTFSWriter
+
+
+STOPS = [Stop(1, 'A', 7.80, 48.0, 10, 0, '', ''),
+         Stop(2, 'B', 7.81, 48.0, 10, 0, '', '')]
+SHAPES = [Shape(10, 48.0, 7.80, 0), Shape(10, 48.0, 7.81, 1)]
+
+
+def test_stream_zipped_to_pipe(tmpdir):
+    license = tmpdir.join('LICENSE')
+    license.write('ODbL')
+
+    read_fd, write_fd = os.pipe()
+    received = io.BytesIO()
+
+    def read():
+        with open(read_fd, 'rb') as pipe:
+            for chunk in iter(lambda: pipe.read(1024), b''):
+                received.write(chunk)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    with open(write_fd, 'wb') as pipe:
+        writer = GTFSWriter(tables={'stops', 'shapes', 'routes'})
+        writer.stream_zipped(pipe)
+        writer.add_shapes(SHAPES)
+        writer.add_stops(STOPS)
+        # Streamed tables are not kept.
+        assert set(writer._buffers) == {'routes'}
+        writer.add_file('LICENSE', str(license))
+        writer.close()
+    reader.join()
+
+    with zipfile.ZipFile(received) as zfile:
+        assert zfile.namelist() == ['shapes.txt', 'stops.txt', 'routes.txt',
+                                    'LICENSE']
+        stops = zfile.read('stops.txt').decode('utf-8').splitlines()
+        assert [row.split(',')[0] for row in stops[1:]] == ['1', '2']
+        assert zfile.read('LICENSE') == b'ODbL'
+
+
+def test_stream_table_only_once():
+    writer = GTFSWriter(tables={'stops'})
+    writer.stream_zipped(io.BytesIO())
+    writer.add_stops(STOPS)
+    with pytest.raises(ValueError):
+        writer.add_stops(STOPS)
+
+
+def test_file_data_in_memory(tmpdir):
+    feed = io.BytesIO()
+    writer = GTFSWriter(tables={'stops'})
+    writer.stream_zipped(feed)
+    writer.add_stops(STOPS)
+    writer.add_file_data('logs.txt', 'Grüße\n')
+    writer.close()
+    with zipfile.ZipFile(feed) as zfile:
+        assert zfile.read('logs.txt').decode('utf-8') == 'Grüße\n'
+
+    writer = GTFSWriter(tables={'stops'})
+    writer.add_file_data('logs.txt', 'Grüße\n')
+    writer.write_unzipped(str(tmpdir))
+    assert tmpdir.join('logs.txt').read_text('utf-8') == 'Grüße\n'
@@ -0,0 +1,54 @@
+import osmium
+
+from o2g.osm.synthetic import network_size, write_network
+from o2g.osm.exporter import TransitDataExporter
+
+
+class _Counter(osmium.SimpleHandler):
+    def __init__(self):
+        super(_Counter, self).__init__()
+        self.nodes = self.ways = self.relations = 0
+
+    def node(self, n):
+        self.nodes += 1
+
+    def way(self, w):
+        self.ways += 1
+
+    def relation(self, r):
+        self.relations += 1
+
+
+def test_network_size():
+    size = network_size(3, background_factor=1)
+    assert size.stops == 24 and size.stop_areas == 6
+    assert size.background_nodes == 24 + 3 * 10 * 8
+
+
+def test_write_network(tmpdir):
+    size = network_size(3, background_factor=1)
+    filename = str(tmpdir.join('synthetic.osm.pbf'))
+    nodes, ways, relations = write_network(filename, size)
+
+    assert nodes == size.stops + size.routes * size.ways_per_route * \
+        size.nodes_per_way + size.background_nodes
+    assert ways == size.routes * size.ways_per_route + size.background_ways
+    assert relations == size.routes + size.stop_areas
+
+    counter = _Counter()
+    counter.apply_file(filename)
+    assert (counter.nodes, counter.ways, counter.relations) == \
+        (nodes, ways, relations)
+
+    exporter = TransitDataExporter(filename, timezones=False)
+    exporter.process()
+    assert len(list(exporter.routes)) == size.routes
+    assert len({point.shape_id for point in exporter.shapes}) == size.routes
+
+    # Every fourth stop is a station, and a route visits a run of
+    # `stops_per_route` of them.
+    stops = list(exporter.stops)
+    stations = [stop for stop in stops if stop.location_type == 1]
+    assert 0 < len(stations) <= size.stop_areas
+    platforms = len(stops) - len(stations)
+    assert size.stops_per_route * 3 // 4 <= platforms <= size.stops * 3 // 4
@@ -0,0 +1,71 @@
+import pytest
+
+from o2g.osm import timezones as tz
+from o2g.osm.timezones import TimezoneResolver
+
+
+class FakeFinder(object):
+    """Berlin west of 7.825, Paris east of it."""
+    def __init__(self):
+        self.lookups = 0
+
+    def timezone_at(self, lng, lat):
+        self.lookups += 1
+        return 'Europe/Berlin' if lng < 7.825 else 'Europe/Paris'
+
+
+def test_cells_are_cached():
+    finder = FakeFinder()
+    resolver = TimezoneResolver(cell_size=0.05, finder=finder)
+    points = [(7.76, 48.01), (7.77, 48.02), (7.78, 48.03)]
+    assert resolver.timezones_at(points + [None]) == ['Europe/Berlin'] * 3 + ['']
+    assert (resolver.hits, resolver.misses) == (2, 1)
+    # The point and the corners of its cell
+    assert finder.lookups == 5
+
+
+def test_border_cells_are_not_cached():
+    finder = FakeFinder()
+    resolver = TimezoneResolver(cell_size=0.05, finder=finder)
+    # Both in the cell from 7.80 to 7.85
+    assert resolver.timezone_at(7.81, 48.0) == 'Europe/Berlin'
+    assert resolver.timezone_at(7.84, 48.0) == 'Europe/Paris'
+    assert resolver.timezone_at(7.81, 48.0) == 'Europe/Berlin'
+    assert resolver.hits == 0
+
+
+def test_without_finder(monkeypatch):
+    monkeypatch.setattr(tz, 'TimezoneFinder', None)
+    resolver = TimezoneResolver()
+    assert not resolver.available
+    assert resolver.timezone_at(7.8, 48.0) == ''
+
+
+def test_index_is_loaded_lazily(monkeypatch):
+    created = []
+
+    def finder(**kwargs):
+        created.append(kwargs)
+        return FakeFinder()
+    monkeypatch.setattr(tz, 'TimezoneFinder', finder)
+    resolver = TimezoneResolver()
+    assert resolver.available
+    assert not created
+    assert resolver.timezone_at(7.8, 48.0) == 'Europe/Berlin'
+    assert len(created) == 1
+
+
+def test_agencies_need_nodes_only_with_a_finder(monkeypatch):
+    pytest.importorskip('osmium')
+    from o2g.osm.exporter import TransitDataExporter
+
+    tables = ['agency', 'routes']
+    with_finder = TransitDataExporter(
+        'in.osm', tables=tables,
+        timezones=TimezoneResolver(finder=FakeFinder()))
+    assert with_finder.needs_nodes
+
+    monkeypatch.setattr(tz, 'TimezoneFinder', None)
+    assert not TransitDataExporter('in.osm', tables=tables).needs_nodes
+    assert not TransitDataExporter('in.osm', tables=tables,
+                                   timezones=False).needs_nodes
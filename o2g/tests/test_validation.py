@@ -1,12 +1,12 @@
 import os
 import pathlib
 import tempfile
-import subprocess
 
 import pytest
 
 from o2g.osm.exporter import TransitDataExporter
 from o2g.gtfs.gtfs_writer import GTFSWriter
+from o2g.gtfs.gtfs_validator import GTFSValidator
 from o2g.gtfs import gtfs_dummy
 
 
@@ -23,7 +23,8 @@ def transit_data(request):
 def dummy_transit_data(transit_data):
     return \
         gtfs_dummy.create_dummy_data(transit_data.routes,
-                                     transit_data.stops)
+                                     transit_data.stops,
+                                     transit_data.stop_routes)
 
 
 @pytest.fixture
@@ -81,29 +82,11 @@ def test_duplicate_trips(dummy_transit_data):
 
 
 def test_validation(dummy_zipfeed):
-    """Run transitfeed over the generated feed."""
-    # transitfeed is a python2 application. So we need to run it outside
-    # python3 process. Moreover, it is not available in pip repository.
-    # Therefore we have to clone it from git and eventually run it in a
-    # process of its own. Finally we parse the standard output and look
-    # for errors. We ignore the warnings for now.
-    if not os.path.exists('transitfeed'):
-        subprocess.check_call(
-            ['git', 'clone', '-b', '1.2.16', '--single-branch',
-             'https://github.com/google/transitfeed'])
-
-    assert os.path.exists('transitfeed/feedvalidator.py')
-
-    p = subprocess.Popen(['python2.7', 'transitfeed/feedvalidator.py', '-n',
-                         dummy_zipfeed],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    out, err = p.communicate()
-
-    print("Google Transitfeed's output:\n{}".format(out.decode('utf8')))
-
-    assert 'error' not in out.decode('utf8')
-    assert 'errors' not in out.decode('utf8')
+    """Validate the generated feed."""
+    validator = GTFSValidator(dummy_zipfeed).validate()
+    print('\n'.join(validator.summary()))
+
+    assert not validator.errors
 
 
 def test_shape_id_in_trips(transit_data, dummy_transit_data):
@@ -0,0 +1,102 @@
+import pytest
+
+from o2g.osm.models import Agency, Route, Stop, Shape
+from o2g.gtfs.gtfs_writer import GTFSWriter
+from o2g.gtfs.gtfs_validator import GTFSValidator, ERROR
+from o2g.gtfs import gtfs_dummy
+
+
+AGENCIES = [Agency(1, 'http://vag.de', 'VAG', 'Europe/Berlin')]
+ROUTES = [Route(10, '1', 'A => B', 0, '', '', 1)]
+STOPS = [Stop(1, 'A', 7.80, 48.0, 10, 0, '', ''),
+         Stop(2, 'B', 7.81, 48.0, 10, 0, '', ''),
+         Stop(3, 'C', 7.82, 48.0, 10, 0, '', '')]
+SHAPES = [Shape(10, 48.0, 7.80, 0), Shape(10, 48.0, 7.82, 1)]
+
+
+def _feed(tmpdir, agencies=AGENCIES, routes=ROUTES, stops=STOPS,
+          stop_times=None, template_trips=False):
+    dummy = gtfs_dummy.create_dummy_data(routes, stops,
+                                         template_trips=template_trips)
+    # Out of order stop times are written as given.
+    writer = GTFSWriter(sort_keys={'stop_times': ()})
+    writer.add_agencies(agencies)
+    writer.add_routes(routes)
+    writer.add_stops(stops)
+    writer.add_shapes(SHAPES)
+    writer.add_trips(dummy.trips)
+    writer.add_calendar(dummy.calendar)
+    writer.add_frequencies(dummy.frequencies)
+    writer.add_stop_times(dummy.stop_times if stop_times is None else stop_times)
+    writer.write_unzipped(str(tmpdir))
+    return GTFSValidator(str(tmpdir)).validate()
+
+
+def _kinds(validator):
+    return {(table, kind) for (_, table, kind) in validator.counts}
+
+
+@pytest.mark.parametrize('template_trips', [False, True])
+def test_valid_feed(tmpdir, template_trips):
+    validator = _feed(tmpdir, template_trips=template_trips)
+    assert validator.errors == 0, validator.summary()
+
+
+def test_broken_references(tmpdir):
+    validator = _feed(tmpdir, agencies=[AGENCIES[0]._replace(agency_id=2)],
+                      stops=STOPS[:2] + [STOPS[2]._replace(stop_lat=91)])
+    assert _kinds(validator) == {('routes', 'unknown agency_id'),
+                                 ('stops', 'invalid coordinates')}
+
+
+def test_stop_times_order(tmpdir):
+    stop_times = [
+        {'trip_id': '10.10', 'arrival_time': '05:10:00',
+         'departure_time': '05:10:30', 'stop_id': 1, 'stop_sequence': 0},
+        {'trip_id': '10.10', 'arrival_time': '05:05:00',
+         'departure_time': '05:05:30', 'stop_id': 3, 'stop_sequence': 2},
+        {'trip_id': '10.10', 'arrival_time': '', 'departure_time': '',
+         'stop_id': 4, 'stop_sequence': 1}]
+    validator = _feed(tmpdir, stop_times=stop_times)
+    # Only the first of the dummy trips has stop times.
+    assert _kinds(validator) == {('stop_times', 'time travel'),
+                                 ('stop_times', 'unknown stop_id'),
+                                 ('trips', 'trip without stop times')}
+    assert [p.row for p in validator.problems if p.severity == ERROR] ==\
+        [4, 3]
+
+
+def test_calendar_dates_replace_calendar(tmpdir):
+    _feed(tmpdir)
+    service_ids = {line.split(',')[0] for line in
+                   tmpdir.join('calendar.txt').readlines(cr=False)[1:] if line}
+    tmpdir.join('calendar.txt').remove()
+    tmpdir.join('calendar_dates.txt').write(
+        'service_id,date,exception_type\n' +
+        ''.join('{},20260101,1\n{},20260102,1\n'.format(s, s)
+                for s in service_ids))
+    validator = GTFSValidator(str(tmpdir)).validate()
+    assert validator.errors == 0, validator.summary()
+
+    tmpdir.join('calendar_dates.txt').remove()
+    validator = GTFSValidator(str(tmpdir)).validate()
+    assert ('calendar', 'missing table') in _kinds(validator)
+
+
+def test_missing_frequency_times(tmpdir):
+    _feed(tmpdir)
+    frequencies = tmpdir.join('frequencies.txt').readlines(cr=False)
+    header = frequencies[0].split(',')
+    row = frequencies[1].split(',')
+    row[header.index('end_time')] = ''
+    tmpdir.join('frequencies.txt').write(
+        '\n'.join([frequencies[0], ','.join(row)]) + '\n')
+    validator = GTFSValidator(str(tmpdir)).validate()
+    assert _kinds(validator) == {('frequencies', 'missing value')}
+
+
+def test_trips_without_stop_times(tmpdir):
+    validator = _feed(tmpdir, stop_times=[])
+    assert validator.errors == 0
+    assert validator.warnings == 6
+    assert _kinds(validator) == {('trips', 'trip without stop times')}
@@ -0,0 +1,93 @@
+import gc
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+pytest.importorskip('bottle')
+pytest.importorskip('osmium')
+
+# The web app is not part of the package.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'web'))
+import app  # noqa: E402
+
+
+OSM_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+  <node id="1" version="1" lat="48.0" lon="7.80"><tag k="name" v="A"/></node>
+  <node id="2" version="1" lat="48.0" lon="7.81"><tag k="name" v="B"/></node>
+  <relation id="10" version="1">
+    <member type="node" ref="1" role="stop"/>
+    <member type="node" ref="2" role="stop"/>
+    <tag k="type" v="route"/>
+    <tag k="route" v="bus"/>
+    <tag k="ref" v="1"/>
+  </relation>
+</osm>
+"""
+
+
+def _large_osm_xml(count=10000):
+    """An input whose feed does not fit into the buffer of a pipe."""
+    nodes = ''.join(
+        '<node id="{0}" version="1" lat="{1:.7f}" lon="{2:.7f}">'
+        '<tag k="name" v="{3}"/></node>'.format(
+            idx, 48 + idx * 1.3e-5, 7.8 + (idx * 7919 % 10007) * 1e-5,
+            os.urandom(8).hex())
+        for idx in range(1, count + 1))
+    members = ''.join('<member type="node" ref="{}" role="stop"/>'.format(idx)
+                      for idx in range(1, count + 1))
+    return ('<?xml version="1.0" encoding="UTF-8"?><osm version="0.6">{}'
+            '<relation id="1" version="1">{}<tag k="type" v="route"/>'
+            '<tag k="route" v="bus"/></relation></osm>'.format(
+                nodes, members)).encode()
+
+
+def _in_flight():
+    return app.CONVERSIONS_IN_FLIGHT.value()
+
+
+def test_stream_feed():
+    in_flight = _in_flight()
+    feed = b''.join(app.stream_feed(OSM_XML))
+    with zipfile.ZipFile(io.BytesIO(feed)) as zfile:
+        assert 'routes.txt' in zfile.namelist()
+    assert _in_flight() == in_flight
+
+
+def test_failed_stream_raises_before_sending():
+    in_flight = _in_flight()
+    with pytest.raises(Exception):
+        app.stream_feed(b'garbage')
+    assert _in_flight() == in_flight
+
+
+def test_dropped_stream_stops_conversion(monkeypatch):
+    futures = []
+
+    def submit(fn, *args):
+        futures.append(app._threads.submit(fn, *args))
+        return futures[-1]
+    monkeypatch.setattr(app, '_submit', submit)
+
+    feed = app.stream_feed(_large_osm_xml())
+    # Dropped without being sent
+    del feed
+    assert futures[0].exception(timeout=10)
+
+
+def test_workers_convert(monkeypatch):
+    monkeypatch.setattr(app, '_workers', None)
+    # Conversions of earlier tests may leave osmium objects behind, whose
+    # threads do not survive the fork.
+    gc.collect()
+    workers = app.start_workers(1)
+    try:
+        assert app._workers is workers
+        feed = b''.join(app.stream_feed(OSM_XML))
+    finally:
+        workers.shutdown()
+    with zipfile.ZipFile(io.BytesIO(feed)) as zfile:
+        assert 'routes.txt' in zfile.namelist()
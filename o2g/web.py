@@ -1,36 +1,250 @@
 """overpass and osm download functions"""
 import os
+import pickle
+import shutil
 import pathlib
 import tempfile
-import urllib
-from urllib.request import urlopen
+import multiprocessing
+import zlib
+import urllib.error
 
+from o2g.client import HTTPClient
 
-def dl_osm_from_overpass(area, bbox):
+
+OVERPASS_API_URL = "http://overpass-api.de/api/interpreter"
+
+# Overpass instances asked in turn when one fails. Mirrors have their own
+# usage policies, so they are only asked when listed in O2G_OVERPASS_URLS,
+# separated by commas.
+OVERPASS_API_URLS = [url.strip() for url in os.getenv(
+    'O2G_OVERPASS_URLS', OVERPASS_API_URL).split(',') if url.strip()]
+
+# Shared by all downloads of the process, so that connections are reused
+# and the requests per host are capped for all of them together.
+CLIENT = HTTPClient()
+
+# Overpass output formats osmium can parse. JSON and CSV would need a
+# parser of our own and are slower to read than libosmium's XML parser.
+OVERPASS_FORMATS = ('xml',)
+
+# How ways are requested:
+#   None   no ways, shapes are built from member nodes
+#   'skel' ways with node references, then their nodes with coordinates only
+#   'geom' ways with the coordinates inline, read without a location index
+WAY_GEOMETRIES = (None, 'skel', 'geom')
+
+
+def dl_osm_from_overpass(area, bbox, overpass_api_url=OVERPASS_API_URLS,
+                         way_geometry=None, out_format='xml'):
+    filepath = tempfile.mktemp(suffix='_overpass.osm')
+    with open(filepath, 'wb') as osm:
+        for chunk in _overpass_chunks(area, bbox, overpass_api_url,
+                                      way_geometry, out_format):
+            osm.write(chunk)
+    return os.path.split(filepath)[-1], filepath
+
+
+def read_osm_from_overpass(area, bbox, overpass_api_url=OVERPASS_API_URLS,
+                           way_geometry=None, out_format='xml'):
+    """Download from Overpass into memory. Returns the OSM XML as bytes."""
+    return b''.join(_overpass_chunks(area, bbox, overpass_api_url,
+                                     way_geometry, out_format))
+
+
+def _overpass_chunks(area, bbox, overpass_api_url, way_geometry, out_format):
     if not area and not bbox:
         raise Exception('At lease area or bbox must be given.')
 
-    overpass_query = build_overpass_query(area, bbox)
-    overpass_api_url = "http://overpass-api.de/api/interpreter"
+    overpass_query = build_overpass_query(area, bbox, way_geometry, out_format)
+    with _overpass_request(overpass_api_url, overpass_query) as resp:
+        for chunk in _response_chunks(resp):
+            yield chunk
 
-    filepath = tempfile.mktemp(suffix='_overpass.osm')
-    resp = urlopen(overpass_api_url, overpass_query.encode('utf-8'))
 
-    if resp.status == 200:
-        with open(filepath, 'w') as osm:
-            osm.write(resp.read().decode('utf-8'))
-        return os.path.split(filepath)[-1], filepath
-    else:
-        raise urllib.request.HTTPError(
-            'Error calling Overpass API. Status: {}, reason: {}'.format(
-                resp.status, resp.reason))
+def _overpass_request(urls, query):
+    """POST a query to the first Overpass instance that answers it.
+
+    :param urls: a URL or a list of mirrors
+    """
+    # OSM XML compresses about tenfold.
+    resp = CLIENT.request('POST', urls, query.encode('utf-8'),
+                          headers={'Accept-Encoding': 'gzip'})
+    _check_status(resp, 'Error calling Overpass API')
+    return resp
+
+
+def _check_status(resp, message):
+    if resp.status != 200:
+        resp.close()
+        raise urllib.error.HTTPError(
+            resp.url, resp.status,
+            '{}. Status: {}, reason: {}'.format(message, resp.status, resp.reason),
+            resp.headers, None)
+
+
+def _response_chunks(resp, chunk_size=64 * 1024):
+    """Yield the body of a response as it arrives, decompressed if needed."""
+    # read1 returns whatever arrived instead of waiting for a full chunk.
+    read = getattr(resp, 'read1', resp.read)
+    decompressor = None
+    if resp.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+    if decompressor:
+        rest = decompressor.flush()
+        if rest:
+            yield rest
+
 
-    raise Exception("Can't download data form overpass api.")
+class OverpassStream(object):
+    """Download Overpass data while it is being parsed.
 
+    The response is teed into a local file and a named pipe. The first pass
+    over the data reads the pipe while bytes are still arriving. Later
+    passes read the file once `wait` returned.
+
+    The download runs in a child process. osmium holds the GIL while it
+    reads, so a thread of this process would never get to feed the pipe.
+    """
+    def __init__(self, area, bbox, overpass_api_url=OVERPASS_API_URLS,
+                 chunk_size=64 * 1024, way_geometry=None, out_format='xml'):
+        if not area and not bbox:
+            raise Exception('At lease area or bbox must be given.')
+
+        self.query = build_overpass_query(area, bbox, way_geometry, out_format)
+        self.url = overpass_api_url
+        self.chunk_size = chunk_size
+
+        self._workdir = tempfile.mkdtemp(prefix='o2g_overpass_')
+        # osmium picks the format by the extension
+        self.pipe_path = os.path.join(self._workdir, 'stream.osm')
+        os.mkfifo(self.pipe_path)
+        self.filepath = tempfile.mktemp(suffix='_overpass.osm')
+        self.filename = os.path.split(self.filepath)[-1]
+
+        # A fresh interpreter does not inherit locks held by our threads.
+        context = multiprocessing.get_context('spawn')
+        self._received = context.Value('q', 0, lock=False)
+        self._errors, self._child_errors = context.Pipe(duplex=False)
+        self._hold = None
+        self._process = context.Process(
+            target=_download_to_pipe, daemon=True,
+            args=(self.url, self.query, self.chunk_size, self.pipe_path,
+                  self.filepath, self._received, self._child_errors))
+
+    @property
+    def bytes_received(self):
+        return self._received.value
+
+    def start(self):
+        # Holding a read end lets the child open the pipe right away. osmium
+        # opens it later without releasing the GIL, and would hang if the
+        # child never got to open its end.
+        self._hold = os.open(self.pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+        self._process.start()
+        # The child has its own copy. Without ours, a child that died
+        # shows up as an end of file.
+        self._child_errors.close()
+        try:
+            self._errors.recv()
+        except EOFError:
+            self._release()
+            raise IOError('Overpass download exited with {}.'.format(
+                self._process.exitcode))
+        return self
+
+    def _release(self):
+        """Let go of the read end, which ends writes nobody reads."""
+        if self._hold is not None:
+            os.close(self._hold)
+            self._hold = None
+
+    def wait(self):
+        """Wait for the download to finish and raise its error if any."""
+        self._release()
+        self._process.join()
+        try:
+            error = self._errors.recv()
+        except EOFError:
+            error = IOError('Overpass download exited with {}.'.format(
+                self._process.exitcode))
+        if error:
+            raise error
+        return self.filename, self.filepath
+
+    def close(self):
+        """Remove the pipe. The downloaded file is left to the caller."""
+        self._release()
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._errors.close()
+        shutil.rmtree(self._workdir, ignore_errors=True)
+
+
+def _download_to_pipe(url, query, chunk_size, pipe_path, filepath, received,
+                      errors):
+    """Body of the OverpassStream download process.
+
+    Sends None through `errors` once the pipe is open, then the error of
+    the download or None.
+    """
+    # Opening first guarantees the reader gets an end of file even if the
+    # request fails.
+    pipe = open(pipe_path, 'wb')
+    errors.send(None)
+    try:
+        with _overpass_request(url, query) as resp, \
+                open(filepath, 'wb') as tee:
+            for chunk in _response_chunks(resp, chunk_size):
+                received.value += len(chunk)
+                tee.write(chunk)
+                if pipe:
+                    try:
+                        pipe.write(chunk)
+                        pipe.flush()
+                    except BrokenPipeError:
+                        # The reader gave up. Keep downloading for the
+                        # later passes anyway.
+                        pipe = None
+        errors.send(None)
+    except Exception as e:
+        try:
+            pickle.loads(pickle.dumps(e))
+        except Exception:
+            # HTTPError does not survive pickling.
+            e = IOError(str(e))
+        errors.send(e)
+    finally:
+        if pipe:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+
+def build_overpass_query(area, bbox, way_geometry=None, out_format='xml'):
+    """Overpass query for transit relations and what o2g reads of them.
+
+    Only relations and their member nodes are returned with tags. Ways and
+    their nodes are only needed for way shapes, so they come without tags
+    in the form given by `way_geometry`. See WAY_GEOMETRIES.
+    """
+    if way_geometry not in WAY_GEOMETRIES:
+        raise ValueError('Unknown way geometry: {}'.format(way_geometry))
+    if out_format not in OVERPASS_FORMATS:
+        raise ValueError('osmium cannot read Overpass {} output.'.format(out_format))
 
-def build_overpass_query(area, bbox):
     template = """
-    {bbox}
+    [out:{out_format}]{bbox};
     {area}
     (
       rel
@@ -43,33 +257,51 @@ def build_overpass_query(area, bbox):
         ["type"="public_transport"]
         ["public_transport"="stop_area"]
         {area_limit};
-    );
-    out body;
+    )->.transit;
+    .transit out body qt;
 
-    way(r){area_limit};
-    out body;
-
-    node(w){area_limit};
-    out body;
+    node(r.transit){area_limit}->.members;
+    .members out body qt;
+    {ways}
     """
+    ways_templates = {
+        None: '',
+        # Way nodes that are members as well were returned with tags
+        # already. A second, tagless copy would replace them.
+        'skel': """
+    way(r.transit){area_limit}->.ways;
+    (node(w.ways){area_limit}; - node.members;);
+    out skel qt;
+    .ways out skel qt;
+    """,
+        'geom': """
+    way(r.transit){area_limit};
+    out skel geom qt;
+    """,
+    }
+
     bbox_fmt = ''
     area_fmt = ''
     area_limit_fmt = ''
 
     if bbox:
         south, west, north, east = bbox.split(',')
-        bbox_fmt = '[bbox:{},{},{},{}];'.format(south, west, north, east)
+        bbox_fmt = '[bbox:{},{},{},{}]'.format(south, west, north, east)
 
     if area:
         area_fmt = 'area["name"="{}"]->.searchArea;'.format(area)
         area_limit_fmt = '(area.searchArea)'
 
+    ways = ways_templates[way_geometry].format(area_limit=area_limit_fmt)
     return template.format(
-        bbox=bbox_fmt, area=area_fmt, area_limit=area_limit_fmt)
+        out_format=out_format, bbox=bbox_fmt, area=area_fmt,
+        area_limit=area_limit_fmt, ways=ways)
 
 
 def dl_osm_from_url(url):
-    filename = tempfile.mktemp(suffix=pathlib.Path(url).name)
-    filepath, headers =\
-        urllib.request.urlretrieve(url, filename=filename)
+    filepath = tempfile.mktemp(suffix=pathlib.Path(url).name)
+    with CLIENT.request('GET', url) as resp:
+        _check_status(resp, 'Error downloading {}'.format(url))
+        with open(filepath, 'wb') as osm:
+            shutil.copyfileobj(resp, osm)
     return pathlib.Path(url).name, filepath
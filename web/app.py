@@ -1,15 +1,131 @@
 """o2g web interface"""
+import io
 import os
+import time
+import types
+import shutil
 import tempfile
+import multiprocessing
+from socketserver import ThreadingMixIn
 from urllib.parse import urlparse
+from wsgiref.simple_server import WSGIServer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from bottle import run, template, request, static_file, abort, default_app
+from bottle import run, template, request, response, abort, default_app,\
+    HTTPResponse
 
-from o2g.cli import main
-from o2g.web import dl_osm_from_overpass, dl_osm_from_url
+from o2g.cli import main, preload
+from o2g.web import read_osm_from_overpass, dl_osm_from_url
+from o2g.metrics import REGISTRY, CONTENT_TYPE, SIZE_BUCKETS, resident_memory
 
 app = default_app()
 
+# Number of warm worker processes. Zero converts in threads instead.
+WORKERS = int(os.getenv('O2G_WORKERS', os.cpu_count() or 1))
+
+_workers = None
+
+# Runs conversions without workers, next to the thread sending the response.
+_threads = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+# Send feeds while they are written. O2G_STREAM=0 sends them once complete.
+STREAM = os.getenv('O2G_STREAM', '1') != '0'
+
+CHUNK_SIZE = 64 * 1024
+
+REQUESTS = REGISTRY.counter(
+    'o2g_http_requests_total', 'HTTP requests by endpoint and status.',
+    ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'o2g_http_request_duration_seconds',
+    'Time until the response was sent, streamed feeds included.',
+    ('endpoint', 'method'))
+CONVERSIONS = REGISTRY.counter(
+    'o2g_conversions_total', 'Finished conversions by result.', ('result',))
+CONVERSIONS_IN_FLIGHT = REGISTRY.gauge(
+    'o2g_conversions_in_flight', 'Conversions submitted and not finished.')
+STAGE_SECONDS = REGISTRY.histogram(
+    'o2g_conversion_stage_seconds', 'Time spent per conversion stage.',
+    ('stage',))
+INPUT_BYTES = REGISTRY.histogram(
+    'o2g_input_bytes', 'Size of the OSM inputs.', buckets=SIZE_BUCKETS)
+FEED_BYTES = REGISTRY.histogram(
+    'o2g_feed_bytes', 'Size of the zipped feeds sent.', buckets=SIZE_BUCKETS)
+OVERPASS_SECONDS = REGISTRY.histogram(
+    'o2g_overpass_download_seconds', 'Time spent downloading from Overpass.')
+CACHE_LOOKUPS = REGISTRY.counter(
+    'o2g_cache_lookups_total', 'Lookups of the PBF and timezone caches.',
+    ('cache', 'result'))
+REGISTRY.gauge('process_resident_memory_bytes',
+               'Resident memory of the web process, without its workers.',
+               function=resident_memory)
+
+
+def _ready():
+    return os.getpid()
+
+
+def start_workers(count=WORKERS):
+    """Fork `count` workers that convert feeds for the requests.
+
+    osmium and the o2g modules are imported before forking, so the
+    workers start warm and a small conversion only pays for itself.
+    """
+    global _workers
+    if count <= 0:
+        return None
+    preload()
+    _workers = ProcessPoolExecutor(
+        count, mp_context=multiprocessing.get_context('fork'),
+        initializer=preload)
+    # Fork them all now instead of on the first requests.
+    for future in [_workers.submit(_ready) for _ in range(count)]:
+        future.result()
+    return _workers
+
+
+def _observe_request(endpoint, method, status, start):
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    REQUEST_SECONDS.observe(time.time() - start, endpoint=endpoint,
+                            method=method)
+
+
+def instrument(callback):
+    """Plugin counting requests and timing them until the last byte."""
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        endpoint, method = request.route.rule, request.method
+        try:
+            body = callback(*args, **kwargs)
+        except HTTPResponse as resp:
+            _observe_request(endpoint, method, resp.status_code, start)
+            raise
+        except Exception:
+            _observe_request(endpoint, method, 500, start)
+            raise
+        if not isinstance(body, types.GeneratorType):
+            _observe_request(endpoint, method, response.status_code, start)
+            return body
+        return _observed(body, endpoint, method, response.status_code, start)
+    return wrapper
+
+
+def _observed(body, endpoint, method, status, start):
+    try:
+        for chunk in body:
+            yield chunk
+    finally:
+        _observe_request(endpoint, method, status, start)
+
+
+app.install(instrument)
+
+
+@app.get('/metrics')
+def metrics():
+    response.content_type = CONTENT_TYPE
+    return REGISTRY.render()
+
 
 @app.get('/')
 def index():
@@ -29,12 +145,12 @@ def do_index():
 
     if file:
         filename = file.filename
-        filepath = save_file(file)
+        source = file.file.read()
     elif url:
-        filename, filepath = dl_osm_from_url(url)
+        filename, source = dl_osm_from_url(url)
 
     return send_feed(
-        filepath,
+        source,
         filename + '.gtfs.zip',
         dummy=bool(request.forms.get('dummy')))
 
@@ -43,29 +159,145 @@ def is_valid_url(url):
     return urlparse(url).scheme in ('http', 'https')
 
 
-def save_file(file):
-    fd, filepath = tempfile.mkstemp(suffix=file.filename)
-    file.save(filepath, overwrite=True)
-    return filepath
+def _submit(fn, *args):
+    if _workers:
+        future = _workers.submit(fn, *args)
+    else:
+        future = _threads.submit(fn, *args)
+    CONVERSIONS_IN_FLIGHT.inc()
+    future.add_done_callback(_conversion_done)
+    return future
+
+
+def _conversion_done(future):
+    CONVERSIONS_IN_FLIGHT.dec()
+    CONVERSIONS.inc(result='error' if future.exception() else 'ok')
+
+
+def _observe_conversion(stats, input_bytes, feed_bytes):
+    for stage, seconds in stats.get('timings', {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    INPUT_BYTES.observe(input_bytes)
+    FEED_BYTES.observe(feed_bytes)
+    for cache in ('pbf', 'timezone'):
+        counts = stats.get(cache + '_cache', {})
+        for result, key in (('hit', 'hits'), ('miss', 'misses')):
+            if counts.get(key):
+                CACHE_LOOKUPS.inc(counts[key], cache=cache, result=result)
+
+
+def _input_size(source):
+    return len(source) if isinstance(source, bytes) else os.path.getsize(source)
+
+
+def _remove(source):
+    # Uploads and Overpass downloads are bytes, URL downloads are files.
+    if isinstance(source, str) and os.path.exists(source):
+        os.remove(source)
+
+
+def send_feed(source, filename, dummy=False):
+    """Convert the OSM data and send the zipped feed.
+
+    :param source: OSM data as bytes or the path of a downloaded file,
+        which is removed afterwards
+    """
+    response.content_type = 'application/zip'
+    response.set_header('Content-Disposition',
+                        'attachment; filename="{}"'.format(filename))
+    if STREAM:
+        return stream_feed(source, dummy)
+
+    try:
+        input_bytes = _input_size(source)
+        feed, stats = _submit(_convert_to_bytes, source, dummy).result()
+    finally:
+        _remove(source)
+    _observe_conversion(stats, input_bytes, len(feed))
+    return feed
+
 
+def _convert_to_bytes(source, dummy):
+    feed = io.BytesIO()
+    stats = {}
+    main(source, None, feed, dummy, stats=stats)
+    return feed.getvalue(), stats
 
-def send_feed(filepath, filename=None, dummy=False):
-    zipfile = create_zipfeed(filepath, dummy)
-    if not filename:
-        filename = os.path.split(zipfile)[-1]
 
-    return static_file(
-        os.path.split(zipfile)[-1],
-        root=os.path.split(zipfile)[0],
-        download=filename,
-        mimetype='application/zip')
+def _convert_to_pipe(source, pipe_path, dummy):
+    # The response holds the read end open already. If it went away, this
+    # fails right away instead of waiting for a reader.
+    fd = os.open(pipe_path, os.O_WRONLY | os.O_NONBLOCK)
+    os.set_blocking(fd, True)
+    stats = {}
+    with open(fd, 'wb') as pipe:
+        main(source, None, pipe, dummy, stats=stats)
+    return stats
 
 
-def create_zipfeed(filename, dummy=False):
-    zipfile = '{}.zip'.format(filename)
-    print('Writing GTFS feed to %s' % zipfile)
-    main(filename, '.', zipfile, dummy)
-    return zipfile
+def _conversion_finished(hold, workdir, source):
+    # The response only gets its end of file once the held write end is
+    # closed, also if the conversion failed before it opened the pipe.
+    os.close(hold)
+    shutil.rmtree(workdir, ignore_errors=True)
+    _remove(source)
+
+
+def stream_feed(source, dummy=False):
+    """Yield the zip while it is being written.
+
+    The conversion writes into a named pipe, either in a worker or in a
+    thread, and every table is sent as soon as it is zipped. Nothing but
+    the pipe touches the disk.
+
+    The zip starts with the first table, after all passes over the input.
+    The first chunk is waited for here, so that a conversion failing until
+    then raises its error instead of sending an empty feed.
+    """
+    workdir = tempfile.mkdtemp(prefix='o2g_feed_')
+    pipe_path = os.path.join(workdir, 'feed.zip')
+    os.mkfifo(pipe_path)
+    input_bytes = _input_size(source)
+
+    # Both ends are opened here, so that neither side ever blocks in
+    # open(). The write end is held until the conversion is done.
+    pipe = open(os.open(pipe_path, os.O_RDONLY | os.O_NONBLOCK), 'rb',
+                buffering=0)
+    hold = os.open(pipe_path, os.O_WRONLY)
+    os.set_blocking(pipe.fileno(), True)
+    try:
+        future = _submit(_convert_to_pipe, source, pipe_path, dummy)
+    except BaseException:
+        pipe.close()
+        _conversion_finished(hold, workdir, source)
+        raise
+    future.add_done_callback(
+        lambda _: _conversion_finished(hold, workdir, source))
+
+    try:
+        chunk = pipe.read(CHUNK_SIZE)
+        if not chunk:
+            future.result()
+    except BaseException:
+        pipe.close()
+        raise
+    return _send_pipe(pipe, chunk, future, input_bytes)
+
+
+def _send_pipe(pipe, chunk, future, input_bytes):
+    # A response dropped before it was sent closes the pipe once the
+    # generator is collected. Either way the conversion stops with a broken
+    # pipe instead of writing into the void.
+    feed_bytes = 0
+    try:
+        while chunk:
+            feed_bytes += len(chunk)
+            yield chunk
+            chunk = pipe.read(CHUNK_SIZE)
+    finally:
+        pipe.close()
+    # Too late to change the status. Log it at least.
+    _observe_conversion(future.result(), input_bytes, feed_bytes)
 
 
 @app.get('/o2g', methods=['GET'])
@@ -75,19 +307,31 @@ def o2g():
     url = request.params.get('url')
 
     if area or bbox:
-        filename, filepath = dl_osm_from_overpass(area, bbox)
-        if area:
-            filename = area + '_overpass'
+        start = time.time()
+        source = read_osm_from_overpass(area, bbox)
+        OVERPASS_SECONDS.observe(time.time() - start)
+        filename = (area or 'bbox') + '_overpass'
     elif url and is_valid_url(url):
-        filename, filepath = dl_osm_from_url(url)
+        filename, source = dl_osm_from_url(url)
     else:
         abort(400)
 
     return send_feed(
-        filepath,
+        source,
         filename + '.gtfs.zip',
         dummy=bool(request.params.get('dummy')))
 
 
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """wsgiref server handling every request in a thread of its own.
+
+    The default server handles one request at a time, which would keep
+    all but one worker idle.
+    """
+    daemon_threads = True
+
+
 if __name__ == '__main__':
-    run(host='0.0.0.0', port=int(os.getenv('PORT', 3000)), debug=True)
+    start_workers()
+    run(host='0.0.0.0', port=int(os.getenv('PORT', 3000)),
+        server_class=ThreadingWSGIServer)